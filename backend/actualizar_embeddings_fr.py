@@ -1,53 +1,190 @@
 import os
-import io
 import json
-import pymysql
-import face_recognition
-
-# Configuración base de datos (ajusta si usas otro host/usuario/pass/db)
-db = pymysql.connect(
-    host="localhost",
-    user="root",
-    password="12345678",
-    database="reconocimiento_facial_1"
-)
-
-cursor = db.cursor()
-
-# Seleccionar imágenes con embedding_fr NULL
-cursor.execute("SELECT id, imagen_path FROM imagenes WHERE embedding_fr IS NULL")
-registros = cursor.fetchall()
-print(f"Encontradas {len(registros)} imágenes sin embedding_fr")
-
-for fila in registros:
-    id_img, imagen_path = fila
-    ruta_img = os.path.join("uploads", imagen_path)  # ajusta la ruta base si tu carpeta uploads está en otro lado
-    print(f"Procesando id={id_img}, archivo={ruta_img}")
-
-    if not os.path.exists(ruta_img):
-        print(f"    [ERROR] Archivo no encontrado: {ruta_img}")
-        continue
-
-    with open(ruta_img, 'rb') as f:
-        imagen_bytes = f.read()
-
-    try:
-        img_fr = face_recognition.load_image_file(io.BytesIO(imagen_bytes))
-        encodings = face_recognition.face_encodings(img_fr)
-        if len(encodings) > 0:
-            embedding_fr = json.dumps(encodings[0].tolist())
-            # Actualizar en la base de datos
+import time
+import argparse
+import multiprocessing
+
+from utils.duplicados import resolver_ruta
+from utils.base_datos import conectar, ejecutar_lote
+from utils.galeria_compartida import descartar_snapshot
+from utils.codificacion_embeddings import columnas_no_binarias
+from config import galeria_config, embeddings_config
+
+# Rellena embeddings faltantes de la tabla imagenes en lotes:
+#   python actualizar_embeddings_fr.py                  # solo embedding_fr IS NULL
+#   python actualizar_embeddings_fr.py --tradicional    # también embeddings IS NULL
+#   python actualizar_embeddings_fr.py --recalcular     # recalcula todas las filas
+#   python actualizar_embeddings_fr.py --dry-run        # calcula pero no escribe
+
+
+def parsear_argumentos():
+    parser = argparse.ArgumentParser(description="Backfill de embeddings en la tabla imagenes")
+    parser.add_argument('--tradicional', action='store_true',
+                        help="calcular también el embedding LBP+LPQ+HOG cuando falte")
+    parser.add_argument('--recalcular', action='store_true',
+                        help="recalcular ambos embeddings en todas las filas")
+    parser.add_argument('--lote', type=int, default=200, help="filas por lote (una transacción por lote)")
+    parser.add_argument('--procesos', type=int, default=None, help="procesos en paralelo (por defecto, uno por núcleo)")
+    parser.add_argument('--sublote', type=int, default=8, help="imágenes por tarea enviada a cada proceso")
+    parser.add_argument('--checkpoint', default='backfill_checkpoint.json',
+                        help="archivo donde se guarda el último id procesado para poder reanudar")
+    parser.add_argument('--desde-cero', action='store_true', help="ignorar el checkpoint existente")
+    parser.add_argument('--dry-run', action='store_true', help="no escribir en la base de datos")
+    return parser.parse_args()
+
+
+# --------- Trabajo de cada proceso ----------
+def procesar_lote(tareas):
+    """Procesa un grupo de imágenes; los descriptores tradicionales se
+    calculan en una sola llamada por lote."""
+    from utils.preprocesamiento import ImagenPreprocesada, embeddings_tradicionales_lote, embedding_face_recognition
+    from utils.codificacion_embeddings import codificar_embedding
+
+    resultados = []
+    pendientes = []
+    for id_img, imagen_path, calcular_fr, calcular_trad in tareas:
+        ruta_img = resolver_ruta(imagen_path)
+        if not os.path.exists(ruta_img):
+            resultados.append((id_img, None, None, f"Archivo no encontrado: {ruta_img}"))
+            continue
+        try:
+            with open(ruta_img, 'rb') as f:
+                pre = ImagenPreprocesada(f.read())
+        except Exception as e:
+            resultados.append((id_img, None, None, f"No se pudo calcular: {e}"))
+            continue
+        emb_fr = codificar_embedding(embedding_face_recognition(pre)) if calcular_fr else None
+        pendientes.append((id_img, pre, calcular_fr, calcular_trad, emb_fr))
+
+    con_trad = [p for p in pendientes if p[3]]
+    matriz, errores = embeddings_tradicionales_lote([p[1] for p in con_trad])
+    trad = {p[0]: (None if k in errores else codificar_embedding(matriz[k])) for k, p in enumerate(con_trad)}
+
+    for id_img, pre, calcular_fr, calcular_trad, emb_fr in pendientes:
+        emb = trad.get(id_img)
+        aviso = None
+        if calcular_fr and emb_fr is None:
+            aviso = "No se detectó rostro en la imagen"
+        if calcular_trad and emb is None:
+            aviso = "No se pudo calcular el embedding LBP+LPQ+HOG"
+        resultados.append((id_img, emb, emb_fr, aviso))
+    return resultados
+
+
+def leer_checkpoint(ruta, modo):
+    if not os.path.exists(ruta):
+        return 0
+    with open(ruta) as f:
+        datos = json.load(f)
+    if datos.get('modo') != modo:
+        print(f"Checkpoint de otro modo ({datos.get('modo')}), se empieza desde cero")
+        return 0
+    return datos['ultimo_id']
+
+
+def guardar_checkpoint(ruta, modo, ultimo_id):
+    temporal = ruta + '.tmp'
+    with open(temporal, 'w') as f:
+        json.dump({'modo': modo, 'ultimo_id': ultimo_id}, f)
+    os.replace(temporal, ruta)
+
+
+def main():
+    args = parsear_argumentos()
+    modo = 'recalcular' if args.recalcular else ('tradicional' if args.tradicional else 'fr')
+
+    if args.recalcular:
+        condicion = "1=1"
+    elif args.tradicional:
+        condicion = "(embedding_fr IS NULL OR embeddings IS NULL)"
+    else:
+        condicion = "embedding_fr IS NULL"
+
+    db = conectar()
+    cursor = db.cursor()
+
+    # Los procesos escriben con embeddings_config['formato']: en binario, las
+    # columnas tienen que estar migradas a BLOB
+    if embeddings_config['formato'] != 'json' and not args.dry_run:
+        columnas = columnas_no_binarias(db)
+        if columnas:
+            print(f"Las columnas {', '.join(columnas)} no son BLOB y embeddings_config['formato'] es "
+                  f"'{embeddings_config['formato']}': ejecutar migrar_embeddings_binario.py o usar 'json'")
+            db.close()
+            return
+
+    cursor.execute(f"SELECT COUNT(*) FROM imagenes WHERE {condicion}")
+    print(f"Encontradas {cursor.fetchone()[0]} imágenes a procesar (modo {modo})"
+          + (" [DRY-RUN]" if args.dry_run else ""))
+
+    ultimo_id = 0 if args.desde_cero else leer_checkpoint(args.checkpoint, modo)
+    if ultimo_id:
+        print(f"Reanudando desde id > {ultimo_id}")
+
+    procesadas = actualizadas = errores = 0
+    inicio = time.time()
+    contexto = multiprocessing.get_context('spawn')
+    with contexto.Pool(processes=args.procesos) as pool:
+        while True:
+            # Paginación por clave: cada lote empieza después del último id visto
             cursor.execute(
-                "UPDATE imagenes SET embedding_fr=%s WHERE id=%s",
-                (embedding_fr, id_img)
+                f"SELECT id, imagen_path, embedding_fr IS NULL, embeddings IS NULL FROM imagenes "
+                f"WHERE {condicion} AND id > %s ORDER BY id LIMIT %s",
+                (ultimo_id, args.lote)
             )
-            db.commit()
-            print("    [OK] embedding_fr actualizado")
-        else:
-            print("    [WARN] No se detectó rostro en la imagen")
-    except Exception as e:
-        print("    [ERROR] No se pudo calcular embedding_fr:", e)
-
-cursor.close()
-db.close()
-print("¡Proceso finalizado!")
+            filas = cursor.fetchall()
+            if not filas:
+                break
+
+            tareas = [
+                (id_img, imagen_path,
+                 bool(args.recalcular or falta_fr),
+                 bool(args.recalcular or (args.tradicional and falta_trad)))
+                for id_img, imagen_path, falta_fr, falta_trad in filas
+            ]
+            sublotes = [tareas[i:i + args.sublote] for i in range(0, len(tareas), args.sublote)]
+            resultados = [r for grupo in pool.imap_unordered(procesar_lote, sublotes) for r in grupo]
+            actualizaciones = []
+            for id_img, emb, emb_fr, aviso in resultados:
+                if aviso:
+                    print(f"    [WARN] id={id_img}: {aviso}")
+                if emb is None and emb_fr is None:
+                    errores += 1
+                    continue
+                actualizaciones.append((emb_fr, emb, id_img))
+
+            if actualizaciones and not args.dry_run:
+                # Una sola transacción por lote; COALESCE conserva la columna
+                # que no se recalculó
+                ejecutar_lote(
+                    db,
+                    "UPDATE imagenes SET embedding_fr=COALESCE(%s, embedding_fr), "
+                    "embeddings=COALESCE(%s, embeddings) WHERE id=%s",
+                    actualizaciones
+                )
+
+            procesadas += len(filas)
+            actualizadas += len(actualizaciones)
+            ultimo_id = filas[-1][0]
+            if not args.dry_run:
+                guardar_checkpoint(args.checkpoint, modo, ultimo_id)
+            transcurrido = time.time() - inicio
+            print(f"[OK] lote hasta id={ultimo_id}: {len(actualizaciones)}/{len(filas)} actualizadas "
+                  f"({procesadas / transcurrido:.1f} img/s)")
+
+    cursor.close()
+    db.close()
+
+    transcurrido = time.time() - inicio
+    if not args.dry_run and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    if not args.dry_run and actualizadas:
+        # El snapshot compartido tiene los embeddings anteriores
+        descartar_snapshot(galeria_config['ruta'])
+    print(f"Procesadas: {procesadas}  actualizadas: {actualizadas}  sin resultado: {errores}")
+    print(f"Tiempo: {transcurrido:.1f} s  rendimiento: {procesadas / max(transcurrido, 1e-9):.1f} img/s")
+    print("¡Proceso finalizado!")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,30 @@
 import numpy as np
 
-from utils.face_utils import (
-    obtener_embeddings_lbp_lpq_hog as obtener_embeddings,
-    normalizar_embedding
+from utils.face_utils import normalizar_embedding
+from utils.codificacion_embeddings import codificar_embedding, verificar_columnas, columnas_verificadas
+from utils.indice_embeddings import IndiceEmbeddings
+from utils.seleccion import seleccionar_mejor_usuario
+from utils.busqueda_ann import BusquedaExacta, crear_busqueda
+from utils.pool_descriptores import (calcular_descriptores, calcular_descriptores_rostros, detectar_rostros_frame,
+                                     calcular_descriptores_cajas, ColaLlena, TiempoAgotado, ImagenInvalida)
+from utils.cola_trabajos import ColaTrabajos, TrabajoReintentable, iniciar_workers
+from utils.preprocesamiento import precalentar as precalentar_pipelines
+from utils.seguimiento import Seguidor, leer_frames
+from utils.cache_resultados import CacheResultados
+from utils.cache_usuarios import CacheUsuarios
+from utils.duplicados import ImagenDuplicada, dhash
+from utils.subidas import RequestEnMemoria, EscritorAuditoria, bytes_subida
+from utils import metricas, pool_descriptores
+from utils.importacion_diferida import tiempos_importacion
+from utils.metricas import etapa, PerfiladorMuestreo
+from utils.galeria_compartida import GaleriaCompartida
+from utils.listados import (
+    CAMPOS_USUARIO, CAMPOS_IMAGEN, CURSOR_USUARIOS, CURSOR_IMAGENES, ParametrosListado, ParametroInvalido,
+    pagina_usuarios, iterar_usuarios, huella_usuarios, pagina_imagenes, lineas_json, arreglo_json, etag_de
+)
+from utils.base_datos import (
+    BaseDatosFlask, SQL_CARGAR_GALERIA, SQL_RESUMEN_GALERIA, SQL_DATOS_USUARIO, SQL_IMAGENES_USUARIO,
+    SQL_INSERTAR_IMAGEN, SQL_EMBEDDINGS_POR_ID
 )
 
 def similitud_coseno(v1, v2):
@@ -16,29 +38,326 @@ def distancia_euclidiana(v1, v2):
     return float(np.linalg.norm(np.array(v1) - np.array(v2)))
 
 import os
+import time
+import threading
+import uuid
 import json
 import json
-from flask import Flask, request, jsonify
-from flask_mysqldb import MySQL
+from flask import Flask, Response, request, jsonify, stream_with_context, g
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-from config import db_config
-import face_recognition
-import io
+from werkzeug.exceptions import RequestEntityTooLarge
+from config import (pool_config, trabajos_config, video_config, cache_config, duplicados_config, subidas_config,
+                    metricas_config, galeria_config, arranque_config, reconocimiento_config)
 
 
 # Crear la app Flask
 app = Flask(__name__)
+# Las imágenes subidas quedan en memoria en lugar de un archivo temporal
+app.request_class = RequestEnMemoria
 CORS(app)
 
-# Configuración de la base de datos desde config.py
-app.config['MYSQL_HOST'] = db_config['host']
-app.config['MYSQL_USER'] = db_config['user']
-app.config['MYSQL_PASSWORD'] = db_config['password']
-app.config['MYSQL_DB'] = db_config['database']
+# Conexión MySQL desde un pool compartido (db_config y db_pool_config):
+# mysql.connection se toma del pool en cada contexto y se devuelve al cerrarlo
+mysql = BaseDatosFlask(app)
+
+# Embeddings de imágenes por id, con una conexión del pool (también desde
+# hilos sin contexto de Flask). Con el backend 'int8' el índice lee de aquí
+# las filas float32 que recalcula
+def leer_embeddings(imagen_ids):
+    with mysql.pool.conexion() as con:
+        cursor = con.cursor()
+        cursor.execute(SQL_EMBEDDINGS_POR_ID.format(', '.join(['%s'] * len(imagen_ids))), list(imagen_ids))
+        filas = cursor.fetchall()
+        cursor.close()
+    return filas
+
+
+# Índice de embeddings en memoria (vive mientras viva el proceso) y
+# backend de búsqueda sobre él (exacto, IVF, cascada o int8, según busqueda_config)
+indice = IndiceEmbeddings(fuente=leer_embeddings)
+busqueda = BusquedaExacta()
+lock_indice = threading.Lock()
+
+
+def cargar_indice():
+    global busqueda
+    asegurar_formato_embeddings()
+    with etapa('cargar_galeria'):
+        if not cargar_snapshot():
+            cursor = mysql.connection.cursor()
+            cursor.execute(SQL_CARGAR_GALERIA)
+            indice.cargar(cursor.fetchall())
+            cursor.close()
+            if galeria is not None:
+                galeria.publicar()
+    cache_resultados.invalidar()
+    print(f"Índice de embeddings cargado: {len(indice)} imágenes")
+    busqueda = crear_busqueda(indice)
+
+
+def cargar_snapshot():
+    """True si la galería se mapeó desde el snapshot compartido y coincide
+    con la base de datos (cantidad de imágenes y último id)."""
+    if galeria is None or not galeria.cargar():
+        return False
+    cursor = mysql.connection.cursor()
+    cursor.execute(SQL_RESUMEN_GALERIA)
+    cantidad, ultimo_id = cursor.fetchone()
+    cursor.close()
+    ids = indice.snapshot()[0]
+    if cantidad == len(ids) and (ultimo_id or 0) == (int(ids[-1]) if len(ids) else 0):
+        return True
+    print("El snapshot de la galería no coincide con la base de datos; se carga desde MySQL")
+    return False
+
+
+def asegurar_formato_embeddings():
+    # Una base sin migrar a BLOB sigue recibiendo JSON (ver embeddings_config)
+    if not columnas_verificadas():
+        verificar_columnas(mysql.connection)
+
+
+def asegurar_indice():
+    global busqueda
+    if not indice.cargado:
+        # El hilo de precalentamiento y las primeras peticiones pueden llegar juntos
+        with lock_indice:
+            if not indice.cargado:
+                cargar_indice()
+    elif galeria is not None and galeria.sincronizar():
+        # Otro proceso publicó una generación nueva del snapshot
+        cache_resultados.invalidar()
+        busqueda = crear_busqueda(indice)
+
+
+# Cache de reconocimientos por hash de la imagen; toda ruta que cambie
+# usuarios o imágenes llama a cache_resultados.invalidar()
+cache_resultados = CacheResultados(cache_config['max_entradas'], cache_config['ttl_s'])
+
+# Imágenes y embeddings decodificados por usuario (listado y borrado por
+# rostro); las rutas que agregan o borran imágenes invalidan al usuario
+cache_usuarios = CacheUsuarios(cache_config['max_usuarios'])
+
+
+def consultar_imagenes_usuario(usuario_id):
+    cursor = mysql.connection.cursor()
+    cursor.execute(SQL_IMAGENES_USUARIO, (usuario_id,))
+    filas = cursor.fetchall()
+    cursor.close()
+    return filas
+
+
+# Altas y bajas de la galería y ediciones de usuarios. Con
+# galeria_config['snapshot'] van al registro de cambios compartido y cada
+# proceso las aplica (e invalida sus caches) al sincronizar; si no, se
+# aplican directamente en este proceso
+def aplicar_cambio(cambio):
+    if cambio['op'] == 'agregar':
+        if indice.contiene(cambio['imagen_id']):
+            return
+        indice.agregar(cambio['imagen_id'], cambio['usuario_id'], cambio['ruta'], cambio['emb'], cambio['emb_fr'])
+        busqueda.agregar(cambio['imagen_id'], cambio['emb_fr'])
+    elif cambio['op'] == 'eliminar_imagenes':
+        indice.eliminar_imagenes(cambio['imagen_ids'])
+    elif cambio['op'] == 'eliminar_usuario':
+        indice.eliminar_usuario(cambio['usuario_id'])
+    # 'editar_usuario' no toca el índice: nombre o requisitoriado pueden haber
+    # cambiado en respuestas que están en el cache. El dHash de la imagen
+    # nueva pasa al cache por usuario para no recalcularlo desde el disco
+    hashes = {cambio['imagen_id']: cambio['dhash']} if cambio.get('dhash') is not None else None
+    cache_usuarios.invalidar(cambio['usuario_id'], hashes)
+    cache_resultados.invalidar()
+
+
+def registrar_cambio(**cambio):
+    if galeria is None:
+        aplicar_cambio(cambio)
+        return
+    asegurar_indice()
+    galeria.registrar(cambio)
+    asegurar_indice()
+
+
+galeria = (GaleriaCompartida(galeria_config['ruta'], indice, aplicar_cambio, galeria_config['max_cambios'])
+           if galeria_config['snapshot'] else None)
+
+
+# Cola de trabajos de enrolamiento (SQLite local) y sus hilos consumidores
+cola_trabajos = ColaTrabajos(trabajos_config['ruta_db'], trabajos_config['arriendo_s'])
+workers_trabajos = None
+lock_workers = threading.Lock()
+
+
+# Detección de duplicados al enrolar: el dHash se revisa antes de guardar la
+# imagen y la similitud del embedding cuando ya se calcularon los descriptores
+def hash_imagen(imagen_bytes):
+    if not duplicados_config['habilitado']:
+        return None
+    try:
+        return dhash(imagen_bytes)
+    except Exception:
+        # Si no se puede decodificar, el error se reporta al calcular los descriptores
+        return None
+
+
+def verificar_duplicado_hash(usuario_id, imagen_bytes):
+    """Devuelve el dHash calculado (o None) para registrarlo con la imagen."""
+    h = hash_imagen(imagen_bytes)
+    if h is None:
+        return None
+    datos = cache_usuarios.obtener(usuario_id, consultar_imagenes_usuario)
+    imagen_id = datos.duplicado_por_hash(h, duplicados_config['distancia_hash'])
+    if imagen_id is not None:
+        raise ImagenDuplicada(imagen_id, "hash perceptual")
+    return h
+
+
+def verificar_duplicado_embedding(usuario_id, embeddings):
+    if not duplicados_config['habilitado']:
+        return
+    datos = cache_usuarios.obtener(usuario_id, consultar_imagenes_usuario)
+    encontrado = datos.duplicado_por_embedding(embeddings, duplicados_config['umbral_similitud'])
+    if encontrado is not None:
+        raise ImagenDuplicada(encontrado[0], f"similitud {encontrado[1]:.4f}")
+
+
+def respuesta_duplicada(e):
+    if duplicados_config['accion'] == 'fusionar':
+        return jsonify({"mensaje": "La imagen ya estaba registrada; se conserva la existente",
+                        "imagen_id": e.imagen_id, "duplicado": True}), 200
+    return jsonify({"mensaje": "Imagen duplicada de una ya registrada para el usuario",
+                    "imagen_id": e.imagen_id, "motivo": e.motivo}), 409
+
+
+# Copia opcional de las imágenes consultadas (subidas_config['auditoria'])
+auditoria = EscritorAuditoria(subidas_config['carpeta_auditoria'])
+
+
+# Respuestas cuando el pool de descriptores no puede atender la petición
+def respuesta_ocupado():
+    return (jsonify({"mensaje": "Servidor ocupado, intente nuevamente en unos segundos"}), 503,
+            {"Retry-After": str(pool_config['retry_after_s'])})
+
+
+def respuesta_tiempo_agotado():
+    return jsonify({"mensaje": "El procesamiento de la imagen tardó demasiado"}), 504
+
+
+def respuesta_imagen_invalida():
+    return jsonify({"mensaje": "No se pudo leer la imagen enviada"}), 400
+
+
+# Latencia de cada petición por ruta, método y estado; con el perfilador
+# habilitado se guardan las pilas de las peticiones lentas
+perfilador = (PerfiladorMuestreo(metricas_config['carpeta_perfiles'],
+                                 metricas_config['umbral_perfil_ms'] / 1000,
+                                 metricas_config['intervalo_muestreo_ms'] / 1000)
+              if metricas_config['perfilador'] else None)
+
+
+@app.before_request
+def iniciar_medicion():
+    g.inicio_peticion = time.perf_counter()
+    if perfilador is not None:
+        perfilador.iniciar()
+
+
+# Los consumidores de la cola arrancan con la primera petición (también bajo
+# WSGI, donde __main__ no se ejecuta) para retomar los trabajos pendientes y
+# los de procesos que murieron sin esperar al próximo /agregar_imagen. Solo
+# importar app.py (scripts, tests) no arranca hilos
+@app.before_request
+def iniciar_workers_trabajos():
+    asegurar_workers()
+
 
-# Inicializar conexión MySQL
-mysql = MySQL(app)
+@app.before_request
+def leer_formulario():
+    # El formulario se lee antes de la ruta: si supera subidas_config['max_bytes']
+    # el 413 sale de aquí y no del try/except genérico de cada ruta
+    if request.mimetype == 'multipart/form-data':
+        request.files
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def respuesta_demasiado_grande(e):
+    return jsonify({"mensaje": "La imagen supera el tamaño máximo permitido",
+                    "max_bytes": subidas_config['max_bytes']}), 413
+
+
+@app.after_request
+def registrar_medicion(respuesta):
+    if metricas_config['habilitado'] and 'inicio_peticion' in g:
+        metricas.peticiones.observar(time.perf_counter() - g.inicio_peticion,
+                                     request.endpoint or 'desconocida', request.method,
+                                     str(respuesta.status_code))
+    return respuesta
+
+
+@app.teardown_request
+def terminar_perfil(excepcion=None):
+    if perfilador is not None:
+        ruta = perfilador.terminar(request.endpoint or 'desconocida')
+        if ruta:
+            print("Perfil de petición lenta guardado en", ruta)
+
+
+@app.route("/metrics", methods=["GET"])
+def exportar_metricas():
+    extras = ["# TYPE reconocimiento_galeria_imagenes gauge",
+              f"reconocimiento_galeria_imagenes {len(indice)}"]
+    for nombre, valor in cache_resultados.estadisticas().items():
+        if isinstance(valor, (int, float)):
+            extras.append(f"reconocimiento_cache_{nombre} {valor}")
+    for nombre, valor in mysql.pool.estadisticas().items():
+        extras.append(f"reconocimiento_bd_pool_{nombre} {valor}")
+    extras.append(f"reconocimiento_auditoria_descartadas {auditoria.descartadas}")
+    extras.append(f"reconocimiento_listo {int(estado_arranque['listo'])}")
+    if estado_arranque['duracion_s'] is not None:
+        extras.append(f"reconocimiento_precalentamiento_segundos {estado_arranque['duracion_s']}")
+    for modulo, segundos in sorted(tiempos_importacion.items()):
+        extras.append(f'reconocimiento_importacion_segundos{{modulo="{modulo}"}} {segundos:.6f}')
+    return Response(metricas.exportar(extras), mimetype='text/plain; version=0.0.4')
+
+
+# Precalentamiento del proceso: carga la galería, importa las librerías
+# pesadas y arranca los procesos del pool. Hasta que termina, /health/ready
+# responde 503 para que el balanceador no envíe tráfico a este proceso
+estado_arranque = {'listo': False, 'duracion_s': None, 'error': None}
+precalentamiento = None
+lock_precalentamiento = threading.Lock()
+
+
+def precalentar_proceso():
+    t0 = time.perf_counter()
+    try:
+        with app.app_context():
+            asegurar_indice()
+        if arranque_config['precalentar']:
+            if pool_descriptores.pool is not None:
+                pool_descriptores.pool.precalentar(arranque_config['timeout_s'])
+            if pool_descriptores.pool is None or arranque_config['proceso_principal']:
+                precalentar_pipelines()
+        estado_arranque['listo'] = True
+        print(f"Proceso listo en {time.perf_counter() - t0:.2f} s")
+    except Exception as e:
+        estado_arranque['error'] = str(e)
+        print("Error en el precalentamiento:", e)
+    finally:
+        estado_arranque['duracion_s'] = round(time.perf_counter() - t0, 3)
+
+
+def iniciar_precalentamiento():
+    """Arranca el precalentamiento en un hilo; si el anterior falló (por
+    ejemplo, sin base de datos) lo vuelve a intentar."""
+    global precalentamiento
+    with lock_precalentamiento:
+        if estado_arranque['listo'] or (precalentamiento is not None and precalentamiento.is_alive()):
+            return
+        estado_arranque['error'] = None
+        precalentamiento = threading.Thread(target=precalentar_proceso, daemon=True, name="precalentamiento")
+        precalentamiento.start()
 
 
 # Ruta raíz de prueba
@@ -47,6 +366,28 @@ def index():
     return "Backend funcionando correctamente."
 
 
+# Salud: /health responde mientras el proceso viva; /health/ready recién
+# cuando terminó el precalentamiento (y lo arranca si todavía no empezó)
+@app.route("/health", methods=["GET"])
+def salud():
+    return jsonify({"estado": "ok"}), 200
+
+
+@app.route("/health/ready", methods=["GET"])
+def salud_listo():
+    iniciar_precalentamiento()
+    cuerpo = {
+        "listo": estado_arranque['listo'],
+        "precalentar": arranque_config['precalentar'],
+        "duracion_s": estado_arranque['duracion_s'],
+        "imagenes": len(indice),
+        "importaciones_s": {m: round(t, 3) for m, t in sorted(tiempos_importacion.items())}
+    }
+    if estado_arranque['error']:
+        cuerpo["error"] = estado_arranque['error']
+    return jsonify(cuerpo), 200 if estado_arranque['listo'] else 503
+
+
 # Ruta: Registrar usuario (sin imagen aún)
 @app.route("/registrar_usuario", methods=["POST"])
 def registrar_usuario():
@@ -91,7 +432,8 @@ def registrar_usuario():
 
 
 
-# Ruta: Agregar imagen + embeddings LBP + LPQ + face_recognition a un usuario
+# Ruta: Agregar imagen a un usuario. La imagen se guarda y se encola;
+# los embeddings LBP + LPQ + face_recognition se calculan en segundo plano
 @app.route("/agregar_imagen/<int:usuario_id>", methods=["POST"])
 def agregar_imagen(usuario_id):
     try:
@@ -106,281 +448,397 @@ def agregar_imagen(usuario_id):
         carpeta_usuario = os.path.join("uploads", f"user_{usuario_id}")
         os.makedirs(carpeta_usuario, exist_ok=True)
 
-        # Guardar la imagen en la carpeta correspondiente
-        ruta_guardado = os.path.join(carpeta_usuario, filename)
-        imagen.save(ruta_guardado)
+        # Primer filtro de duplicados (dHash) antes de escribir nada
+        imagen_bytes = imagen.read()
+        verificar_duplicado_hash(usuario_id, imagen_bytes)
 
-        with open(ruta_guardado, 'rb') as f:
-            imagen_bytes = f.read()
+        # Guardar la imagen con un nombre único: la app siempre envía 'foto.jpg'
+        # y el trabajo la leerá más tarde desde el disco
+        ruta_guardado = os.path.join(carpeta_usuario, f"{uuid.uuid4().hex[:8]}_{filename}")
+        with open(ruta_guardado, 'wb') as f:
+            f.write(imagen_bytes)
 
-        # Embedding tradicional (LBP+LPQ+HOG)
-        embeddings = obtener_embeddings(imagen_bytes)
-        if embeddings is None:
-            return jsonify({"mensaje": "No se detectaron características LBP+LPQ+HOG"}), 400
+        trabajo_id = cola_trabajos.crear('enrolamiento', usuario_id, ruta_guardado)
 
-        # Embedding de face_recognition
-        try:
-            image_fr = face_recognition.load_image_file(io.BytesIO(imagen_bytes))
-            encodings_fr = face_recognition.face_encodings(image_fr)
-            if len(encodings_fr) > 0:
-                embedding_fr = encodings_fr[0].tolist()  # Lista serializable en JSON
-            else:
-                embedding_fr = None
-        except Exception as e:
-            print("Error obteniendo embedding face_recognition:", e)
-            embedding_fr = None
+        return jsonify({
+            "mensaje": "Imagen recibida, procesando embeddings",
+            "job_id": trabajo_id
+        }), 202
 
-        # Guardar ruta + embeddings en la base de datos
+    except ImagenDuplicada as e:
+        return respuesta_duplicada(e)
+    except Exception as e:
+        print(f"Error al agregar imagen: {e}")
+        return jsonify({"mensaje": "Error al agregar imagen"}), 500
+
+
+# Trabajo de enrolamiento: calcula embeddings, los guarda y actualiza el índice
+def procesar_enrolamiento(trabajo):
+    usuario_id = trabajo['usuario_id']
+    ruta_guardado = trabajo['imagen_path']
+    if not os.path.exists(ruta_guardado):
+        raise FileNotFoundError(f"Archivo no encontrado: {ruta_guardado}")
+    with open(ruta_guardado, 'rb') as f:
+        imagen_bytes = f.read()
+
+    # Embeddings tradicional (LBP+LPQ+HOG) y de face_recognition (una sola
+    # decodificación y una sola detección de rostro) y segundo filtro de
+    # duplicados: similitud con las imágenes del usuario
+    try:
+        embeddings, embedding_fr = calcular_descriptores(imagen_bytes)
+        if embeddings is None:
+            raise ValueError("No se detectaron características LBP+LPQ+HOG")
+        with app.app_context():
+            verificar_duplicado_embedding(usuario_id, embeddings)
+    except ColaLlena:
+        raise TrabajoReintentable()
+    except (ValueError, ImagenDuplicada) as e:
+        # Rechazo definitivo (imagen ilegible, sin características o
+        # repetida): reprocesar no cambiaría el resultado, el archivo se
+        # borra. Otros errores (p. ej. de la base) lo conservan para
+        # /jobs/<id>/reprocesar
+        os.remove(ruta_guardado)
+        if isinstance(e, ImagenDuplicada) and duplicados_config['accion'] == 'fusionar':
+            return e.imagen_id
+        raise
+
+    # Guardar ruta + embeddings en la base de datos
+    with app.app_context():
+        asegurar_formato_embeddings()
         cursor = mysql.connection.cursor()
-        sql = """INSERT INTO imagenes (usuario_id, imagen_path, embeddings, embedding_fr)
-                 VALUES (%s, %s, %s, %s)"""
-        cursor.execute(sql, (
+        cursor.execute(SQL_INSERTAR_IMAGEN, (
             usuario_id,
             ruta_guardado,
-            json.dumps(embeddings),
-            json.dumps(embedding_fr) if embedding_fr is not None else None
+            codificar_embedding(embeddings),
+            codificar_embedding(embedding_fr)
         ))
         mysql.connection.commit()
+        imagen_id = cursor.lastrowid
         cursor.close()
-
-        return jsonify({"mensaje": "Imagen agregada exitosamente"}), 200
+        registrar_cambio(op='agregar', imagen_id=imagen_id, usuario_id=usuario_id, ruta=ruta_guardado,
+                         emb=embeddings, emb_fr=embedding_fr, dhash=hash_imagen(imagen_bytes))
+    return imagen_id
+
+
+def asegurar_workers():
+    global workers_trabajos
+    if workers_trabajos is not None or not trabajos_config['workers_en_app']:
+        return
+    with lock_workers:
+        if workers_trabajos is None:
+            workers_trabajos = iniciar_workers(
+                cola_trabajos, procesar_enrolamiento,
+                hilos=trabajos_config['hilos'],
+                espera_reintento=pool_config['retry_after_s']
+            )
+
+
+# Ruta: Estado de un trabajo en segundo plano
+@app.route("/jobs/<int:job_id>", methods=["GET"])
+def estado_trabajo(job_id):
+    trabajo = cola_trabajos.obtener(job_id)
+    if trabajo is None:
+        return jsonify({"mensaje": "Trabajo no encontrado"}), 404
+    return jsonify(trabajo), 200
+
+
+# Ruta: Reprocesar un trabajo fallido
+@app.route("/jobs/<int:job_id>/reprocesar", methods=["POST"])
+def reprocesar_trabajo(job_id):
+    if cola_trabajos.reprocesar(job_id) == 0:
+        return jsonify({"mensaje": "Solo se pueden reprocesar trabajos fallidos existentes"}), 409
+    return jsonify({"mensaje": "Trabajo reencolado", "job_id": job_id}), 202
+
+
+# Ruta: Reprocesar todos los trabajos fallidos
+@app.route("/jobs/reprocesar_fallidos", methods=["POST"])
+def reprocesar_fallidos():
+    cantidad = cola_trabajos.reprocesar()
+    return jsonify({"mensaje": f"{cantidad} trabajos reencolados", "cantidad": cantidad}), 202
+
+
+# Respuesta generada por partes (listados completos). Con If-None-Match
+# igual al ETag no se genera nada
+def respuesta_por_partes(generador, mimetype, etag):
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={"ETag": f'"{etag}"'})
+    respuesta = Response(stream_with_context(generador), mimetype=mimetype)
+    respuesta.set_etag(etag)
+    return respuesta
+
+
+def respuesta_pagina(cuerpo):
+    respuesta = jsonify(cuerpo)
+    respuesta.add_etag()
+    return respuesta.make_conditional(request)
+
+
+# Ruta: Listar los usuarios registrados
+#   ?limite=50&cursor=...      página (keyset por id) con "siguiente" para la próxima
+#   ?campos=id,nombre          solo esas columnas
+#   ?requisitoriado=1          filtro
+#   ?formato=jsonl             exportación completa en líneas JSON
+# Sin ?limite ni ?cursor devuelve el arreglo completo de siempre, por partes
+@app.route("/listar_usuarios", methods=["GET"])
+def listar_usuarios():
+    try:
+        parametros = ParametrosListado(request.args, CAMPOS_USUARIO, CURSOR_USUARIOS)
+    except ParametroInvalido as e:
+        return jsonify({"mensaje": str(e)}), 400
+    try:
+        conexion = mysql.connection
+        if parametros.formato == 'jsonl':
+            return respuesta_por_partes(lineas_json(iterar_usuarios(conexion, parametros), app.json.dumps),
+                                        'application/x-ndjson', huella_usuarios(conexion, parametros))
+        if not parametros.paginado:
+            return respuesta_por_partes(arreglo_json(iterar_usuarios(conexion, parametros), app.json.dumps),
+                                        'application/json', huella_usuarios(conexion, parametros))
+        usuarios, siguiente = pagina_usuarios(conexion, parametros)
+        return respuesta_pagina({"usuarios": usuarios, "siguiente": siguiente})
 
     except Exception as e:
-        print(f"Error al agregar imagen: {e}")
-        return jsonify({"mensaje": "Error al agregar imagen"}), 500
+        print("Error al listar usuarios:", e)
+        return jsonify({"mensaje": "Error al obtener usuarios"}), 500
+    
+# Datos del usuario ganador (solo una consulta a la base de datos) + alerta
+def datos_mejor_usuario(mejor, rutas):
+    if not mejor:
+        return None
+    uid, fila, metodo, similitudes = mejor
+    with etapa('bd_usuario'):
+        cursor = mysql.connection.cursor()
+        cursor.execute(SQL_DATOS_USUARIO, (uid,))
+        datos = cursor.fetchone()
+        cursor.close()
+    if not datos:
+        return None
+    mejor_usuario = {
+        "usuario_id": uid,
+        "nombre": datos[0],
+        "apellido": datos[1],
+        "codigo_unico": datos[2],
+        **similitudes,
+        "requisitoriado": bool(datos[3]),
+        "imagen_referencia": rutas[fila],
+        "metodo": metodo
+    }
+    if mejor_usuario["requisitoriado"]:
+        mejor_usuario["alerta"] = True
+        mejor_usuario["mensaje_alerta"] = "¡ALERTA DE SEGURIDAD! Usuario requisitoriado detectado. Notificación enviada a la policía (simulada)."
+    return mejor_usuario
+
+
+# Todos los rostros de una imagen: embeddings calculados en un lote y un
+# producto matriz-matriz contra la galería. Devuelve (cuerpo, estado)
+def decidir_rostros(cajas, matriz_trad, matriz_fr):
+    if not cajas:
+        return {"mensaje": "No se detectaron rostros en la imagen"}, 400
+
+    calculados = [k for k in range(len(cajas)) if matriz_trad.shape[1] and not np.isnan(matriz_trad[k]).any()]
+    decisiones = {}
+    if calculados:
+        asegurar_indice()
+        with etapa('similitud'):
+            usuarios, rutas, sim_trad, sim_fr, validos = busqueda.similitudes_lote(
+                indice, matriz_trad[calculados], matriz_fr[calculados]
+            )
+        for j, k in enumerate(calculados):
+            with etapa('seleccion'):
+                mejor = seleccionar_mejor_usuario(usuarios, sim_trad[j], sim_fr[j], validos)
+            decisiones[k] = datos_mejor_usuario(mejor, rutas)
+
+    rostros = []
+    for k, (top, right, bottom, left) in enumerate(cajas):
+        rostro = {"caja": {"top": top, "right": right, "bottom": bottom, "left": left}}
+        if k not in decisiones:
+            rostro["mensaje"] = "No se detectaron características tradicionales en el rostro"
+        elif decisiones[k]:
+            rostro["resultado"] = decisiones[k]
+        else:
+            rostro["mensaje"] = "No se encontraron coincidencias."
+        rostros.append(rostro)
 
+    respuesta = {"rostros": rostros, "alerta": any(d and d.get("alerta") for d in decisiones.values())}
+    if respuesta["alerta"]:
+        respuesta["mensaje_alerta"] = "¡ALERTA DE SEGURIDAD! Usuario requisitoriado detectado. Notificación enviada a la policía (simulada)."
+    return respuesta, 200
 
 
-# Ruta: Listar todos los usuarios registrados
-@app.route("/listar_usuarios", methods=["GET"])
-def listar_usuarios():
-    try:
-        cursor = mysql.connection.cursor()
-        cursor.execute("SELECT id, nombre, apellido, codigo_unico, email, requisitoriado, fecha_registro FROM usuarios")
-        resultados = cursor.fetchall()
+# Un solo rostro: comparar contra el índice de embeddings en memoria.
+# Devuelve (cuerpo, estado)
+def decidir_rostro(emb_ext, emb_ext_fr):
+    if emb_ext is None:
+        return {"mensaje": "No se detectaron características tradicionales en la imagen"}, 400
+    if emb_ext_fr is None:
+        return {"mensaje": "No se detectó embedding face_recognition en la imagen"}, 400
 
-        lista = []
-        columnas = [col[0] for col in cursor.description]
+    asegurar_indice()
+    with etapa('similitud'):
+        usuarios, rutas, sim_trad, sim_fr, validos = busqueda.similitudes(indice, emb_ext, emb_ext_fr)
+    with etapa('seleccion'):
+        mejor = seleccionar_mejor_usuario(usuarios, sim_trad, sim_fr, validos)
 
-        for fila in resultados:
-            usuario = dict(zip(columnas, fila))
-            usuario['requisitoriado'] = bool(usuario['requisitoriado'])
-            lista.append(usuario)
+    mejor_usuario = datos_mejor_usuario(mejor, rutas)
+    if mejor_usuario:
+        return mejor_usuario, 200
+    return {"mensaje": "No se encontraron coincidencias."}, 200
 
-        cursor.close()
-        return jsonify(lista), 200
 
-    except Exception as e:
-        print("Error al listar usuarios:", e)
-        return jsonify({"mensaje": "Error al obtener usuarios"}), 500
-    
   #Reconocer Usuario 
 @app.route("/reconocer_usuario", methods=["POST"])
 def reconocer_usuario():
     try:
         # Recibir imagen
         imagen = request.files['imagen']
-        filename = secure_filename(imagen.filename)
-        ruta_temporal = os.path.join("uploads", filename)
-        imagen.save(ruta_temporal)
 
-        with open(ruta_temporal, 'rb') as f:
-            imagen_bytes = f.read()
-
-        # --- 1. Obtener embeddings tradicionales (tu método) ---
-        emb_ext = obtener_embeddings(imagen_bytes)
-        if emb_ext is None:
-            # Limpieza de archivo temporal
-            if os.path.exists(ruta_temporal):
-                os.remove(ruta_temporal)
-            return jsonify({"mensaje": "No se detectaron características tradicionales en la imagen"}), 400
-
-        # --- 2. Obtener embedding face_recognition ---
-        try:
-            image_fr = face_recognition.load_image_file(io.BytesIO(imagen_bytes))
-            encodings_fr = face_recognition.face_encodings(image_fr)
-            if len(encodings_fr) > 0:
-                emb_ext_fr = encodings_fr[0]
+        # Opcional: reconocer todos los rostros de la imagen (fotos grupales)
+        valor = request.form.get('multiples_rostros', request.args.get('multiples_rostros', ''))
+        multiples = valor.lower() in ('1', 'true', 'si', 'sí')
+
+        # La imagen se procesa en memoria: sin archivo temporal en uploads/
+        with bytes_subida(imagen) as imagen_bytes:
+            if subidas_config['auditoria']:
+                auditoria.guardar(imagen_bytes, imagen.filename, prefijo='reconocer_')
+
+            # Reintentos con la misma foto: la respuesta (o al menos los
+            # embeddings) sale del cache sin tocar la imagen. Antes se carga el
+            # índice y se aplican los cambios que otros procesos dejaron en el
+            # registro compartido, para leer la generación ya actualizada
+            usar_cache = cache_config['habilitado']
+            if usar_cache:
+                asegurar_indice()
+            with etapa('cache'):
+                clave = cache_resultados.clave(imagen_bytes, 'rostros' if multiples else 'rostro')
+                generacion = cache_resultados.generacion
+                en_cache = cache_resultados.obtener(clave) if usar_cache else None
+            if en_cache and en_cache[1] is not None:
+                cuerpo, estado = en_cache[1]
+                return jsonify(cuerpo), estado
+
+            if en_cache:
+                embeddings = en_cache[0]
+            elif multiples:
+                # --- 1-2. Embeddings tradicional y face_recognition (en el pool de procesos) ---
+                embeddings = calcular_descriptores_rostros(imagen_bytes)
             else:
-                emb_ext_fr = None
-        except Exception as e:
-            print("Error obteniendo embedding face_recognition:", e)
-            emb_ext_fr = None
-
-        if emb_ext_fr is None:
-            if os.path.exists(ruta_temporal):
-                os.remove(ruta_temporal)
-            return jsonify({"mensaje": "No se detectó embedding face_recognition en la imagen"}), 400
-
-        # --- 3. Buscar en la base de datos ---
-        cursor = mysql.connection.cursor()
-        cursor.execute("""
-            SELECT i.embeddings, i.embedding_fr, i.imagen_path, u.id, u.nombre, u.apellido, u.codigo_unico, u.requisitoriado
-            FROM imagenes i
-            JOIN usuarios u ON i.usuario_id = u.id
-        """)
-        resultados = cursor.fetchall()
-        cursor.close()
-
-        # Umbrales principales
-        umbral_similitud_tradicional = 0.85    # similitud coseno tradicional
-        umbral_similitud_fr = 0.60             # similitud coseno face_recognition
-        cantidad_minima = 4  # mínimo de coincidencias dobles para aceptar
-
-        # Umbrales estrictos para fallback
-        umbral_strict_tradicional = 0.98
-        umbral_strict_fr = 0.85
-
-        candidatos = {
-            'doble': {},
-            'tradicional': {},
-            'fr': {}
-        }
-
-        for fila in resultados:
-            emb_guardado = json.loads(fila[0])
-            emb_guardado_fr = json.loads(fila[1]) if fila[1] else None
-            imagen_path = fila[2]
-            usuario_id = fila[3]
-            nombre = fila[4]
-            apellido = fila[5]
-            codigo = fila[6]
-            requisitoriado = fila[7]
-
-            # Validación de tamaños y existencia de embeddings
-            if (
-                emb_guardado is None or
-                emb_guardado_fr is None or
-                len(emb_guardado) != len(emb_ext) or
-                len(emb_guardado_fr) != len(emb_ext_fr)
-            ):
-                continue
-
-            # --- Similitud tradicional (coseno) ---
-            sim_trad = float(np.dot(emb_ext, emb_guardado) / (np.linalg.norm(emb_ext) * np.linalg.norm(emb_guardado)))
-            # --- Similitud face_recognition (coseno) ---
-            emb_ext_fr_n = emb_ext_fr / np.linalg.norm(emb_ext_fr)
-            emb_guardado_fr_n = np.array(emb_guardado_fr) / np.linalg.norm(emb_guardado_fr)
-            sim_fr = float(np.dot(emb_ext_fr_n, emb_guardado_fr_n))
-
-            # --- Lógica Fallback ---
-            # Caso 1: Doble coincidencia
-            if sim_trad >= umbral_similitud_tradicional and sim_fr >= umbral_similitud_fr:
-                if usuario_id not in candidatos['doble']:
-                    candidatos['doble'][usuario_id] = {
-                        "nombre": nombre,
-                        "apellido": apellido,
-                        "codigo_unico": codigo,
-                        "requisitoriado": bool(requisitoriado),
-                        "similitudes_trad": [],
-                        "similitudes_fr": [],
-                        "imagenes": []
-                    }
-                candidatos['doble'][usuario_id]["similitudes_trad"].append(sim_trad)
-                candidatos['doble'][usuario_id]["similitudes_fr"].append(sim_fr)
-                candidatos['doble'][usuario_id]["imagenes"].append(imagen_path)
-            # Caso 2: Solo tradicional (umbral estricto)
-            elif sim_trad >= umbral_strict_tradicional:
-                if usuario_id not in candidatos['tradicional']:
-                    candidatos['tradicional'][usuario_id] = {
-                        "nombre": nombre,
-                        "apellido": apellido,
-                        "codigo_unico": codigo,
-                        "requisitoriado": bool(requisitoriado),
-                        "similitudes_trad": [],
-                        "imagenes": []
-                    }
-                candidatos['tradicional'][usuario_id]["similitudes_trad"].append(sim_trad)
-                candidatos['tradicional'][usuario_id]["imagenes"].append(imagen_path)
-            # Caso 3: Solo face_recognition (umbral estricto)
-            elif sim_fr >= umbral_strict_fr:
-                if usuario_id not in candidatos['fr']:
-                    candidatos['fr'][usuario_id] = {
-                        "nombre": nombre,
-                        "apellido": apellido,
-                        "codigo_unico": codigo,
-                        "requisitoriado": bool(requisitoriado),
-                        "similitudes_fr": [],
-                        "imagenes": []
-                    }
-                candidatos['fr'][usuario_id]["similitudes_fr"].append(sim_fr)
-                candidatos['fr'][usuario_id]["imagenes"].append(imagen_path)
-
-        # Limpieza del archivo temporal
-        if os.path.exists(ruta_temporal):
-            os.remove(ruta_temporal)
-
-        # --- Selección del mejor usuario según prioridad ---
-        mejor_usuario = None
-        max_coincidencias = 0
-
-        # 1. Buscar coincidencia doble
-        for uid, data in candidatos['doble'].items():
-            if len(data["similitudes_trad"]) >= cantidad_minima:
-                promedio_trad = sum(data["similitudes_trad"]) / len(data["similitudes_trad"])
-                promedio_fr = sum(data["similitudes_fr"]) / len(data["similitudes_fr"])
-                if len(data["similitudes_trad"]) > max_coincidencias:
-                    max_coincidencias = len(data["similitudes_trad"])
-                    mejor_usuario = {
-                        "usuario_id": uid,
-                        "nombre": data["nombre"],
-                        "apellido": data["apellido"],
-                        "codigo_unico": data["codigo_unico"],
-                        "similitud_tradicional_promedio": round(promedio_trad, 4),
-                        "similitud_face_recognition_promedio": round(promedio_fr, 4),
-                        "requisitoriado": data["requisitoriado"],
-                        "imagen_referencia": data["imagenes"][0],
-                        "metodo": "doble"
-                    }
-        # 2. Fallback tradicional
-        if not mejor_usuario:
-            for uid, data in candidatos['tradicional'].items():
-                promedio_trad = sum(data["similitudes_trad"]) / len(data["similitudes_trad"])
-                if len(data["similitudes_trad"]) > max_coincidencias:
-                    max_coincidencias = len(data["similitudes_trad"])
-                    mejor_usuario = {
-                        "usuario_id": uid,
-                        "nombre": data["nombre"],
-                        "apellido": data["apellido"],
-                        "codigo_unico": data["codigo_unico"],
-                        "similitud_tradicional_promedio": round(promedio_trad, 4),
-                        "requisitoriado": data["requisitoriado"],
-                        "imagen_referencia": data["imagenes"][0],
-                        "metodo": "solo_tradicional"
-                    }
-        # 3. Fallback face_recognition
-        if not mejor_usuario:
-            for uid, data in candidatos['fr'].items():
-                promedio_fr = sum(data["similitudes_fr"]) / len(data["similitudes_fr"])
-                if len(data["similitudes_fr"]) > max_coincidencias:
-                    max_coincidencias = len(data["similitudes_fr"])
-                    mejor_usuario = {
-                        "usuario_id": uid,
-                        "nombre": data["nombre"],
-                        "apellido": data["apellido"],
-                        "codigo_unico": data["codigo_unico"],
-                        "similitud_face_recognition_promedio": round(promedio_fr, 4),
-                        "requisitoriado": data["requisitoriado"],
-                        "imagen_referencia": data["imagenes"][0],
-                        "metodo": "solo_face_recognition"
-                    }
-
-        if mejor_usuario:
-            if mejor_usuario["requisitoriado"]:
-                mejor_usuario["alerta"] = True
-                mejor_usuario["mensaje_alerta"] = "¡ALERTA DE SEGURIDAD! Usuario requisitoriado detectado. Notificación enviada a la policía (simulada)."
-            return jsonify(mejor_usuario), 200
-        else:
-            return jsonify({"mensaje": "No se encontraron coincidencias."}), 200
-
+                embeddings = calcular_descriptores(imagen_bytes)
+
+        # --- 3. Comparar contra la galería ---
+        cuerpo, estado = decidir_rostros(*embeddings) if multiples else decidir_rostro(*embeddings)
+        if usar_cache:
+            cache_resultados.guardar(clave, embeddings, (cuerpo, estado), generacion)
+        return jsonify(cuerpo), estado
+
+    except ColaLlena:
+        return respuesta_ocupado()
+    except TiempoAgotado:
+        return respuesta_tiempo_agotado()
+    except ImagenInvalida:
+        return respuesta_imagen_invalida()
     except Exception as e:
         print("Error en reconocimiento:", e)
         import traceback; traceback.print_exc()
-        # Limpieza del archivo temporal en caso de error
-        if os.path.exists(ruta_temporal):
-            os.remove(ruta_temporal)
         return jsonify({"mensaje": "Error al procesar imagen"}), 500
 
+
+# Estadísticas del cache de reconocimientos
+@app.route("/cache/estadisticas", methods=["GET"])
+def estadisticas_cache():
+    return jsonify({"habilitado": cache_config['habilitado'], **cache_resultados.estadisticas()}), 200
+
+# Decisión de un track: similitudes promediadas sobre todos sus embeddings
+def decidir_track(track):
+    emb, emb_fr = track.embeddings_promedio()
+    usuarios, rutas, sim_trad, sim_fr, validos = busqueda.similitudes(indice, emb, emb_fr)
+    # La consulta se normaliza dentro del índice; multiplicar por la norma del
+    # promedio devuelve el promedio exacto de las similitudes de cada frame
+    sim_trad = sim_trad * np.linalg.norm(emb)
+    sim_fr = sim_fr * np.linalg.norm(emb_fr)
+    mejor = seleccionar_mejor_usuario(usuarios, sim_trad, sim_fr, validos)
+    return datos_mejor_usuario(mejor, rutas)
+
+
+#Reconocer en video: secuencia de frames con seguimiento de rostros
+@app.route("/reconocer_video", methods=["POST"])
+def reconocer_video():
+    """Cuerpo: frames JPEG con prefijo de longitud ([uint32 big-endian][bytes]...).
+    Respuesta: una línea JSON por frame (NDJSON) y un resumen final por track.
+    La detección y los embeddings van al pool de procesos como en las demás
+    rutas; los embeddings solo se calculan para tracks nuevos o cada N frames.
+    Un frame que el pool no puede atender (cola llena o timeout) o que no se
+    puede decodificar se informa en su línea y se omite."""
+    asegurar_indice()
+    seguidor = Seguidor(
+        iou_minimo=video_config['iou_minimo'],
+        cada_n=video_config['cada_n_frames'],
+        max_perdidos=video_config['max_frames_perdido'],
+        distancia_maxima=video_config['distancia_maxima_track']
+    )
+    stream = request.stream
+
+    def procesar_frame(frame, frame_bytes):
+        pre = detectar_rostros_frame(frame_bytes)
+        asociaciones = seguidor.actualizar(pre.ubicaciones, frame)
+
+        # Embeddings solo para los tracks que los necesitan, en un lote y
+        # sobre la imagen que ya se decodificó para detectar
+        pendientes = [i for i, (_, necesita) in enumerate(asociaciones) if necesita]
+        calculados = set()
+        if pendientes:
+            matriz_trad, matriz_fr = calcular_descriptores_cajas(
+                pre, [asociaciones[i][0].caja for i in pendientes])
+            for k, i in enumerate(pendientes):
+                if not matriz_trad.shape[1] or np.isnan(matriz_trad[k]).any():
+                    continue
+                # Un corte de escena puede dejar a otra persona en la misma caja
+                track = seguidor.confirmar_identidad(asociaciones[i][0], matriz_fr[k], frame)
+                track.agregar_embeddings(matriz_trad[k], matriz_fr[k], frame)
+                track.decision = decidir_track(track)
+                asociaciones[i] = (track, True)
+                calculados.add(i)
+
+        rostros = []
+        for i, (track, _) in enumerate(asociaciones):
+            top, right, bottom, left = [int(round(v / pre.escala)) for v in track.caja]
+            rostros.append({
+                "track": track.id,
+                "caja": {"top": top, "right": right, "bottom": bottom, "left": left},
+                "embedding_calculado": i in calculados,
+                "resultado": track.decision
+            })
+        alerta = any(r["resultado"] and r["resultado"].get("alerta") for r in rostros)
+        return {"frame": frame, "rostros": rostros, "alerta": alerta}
+
+    def generar():
+        try:
+            for frame, frame_bytes in enumerate(leer_frames(stream, video_config['max_bytes_frame'])):
+                try:
+                    linea = procesar_frame(frame, frame_bytes)
+                except ColaLlena:
+                    linea = {"frame": frame, "omitido": True, "mensaje": "Servidor ocupado",
+                             "reintentar_en_s": pool_config['retry_after_s']}
+                except TiempoAgotado:
+                    linea = {"frame": frame, "omitido": True,
+                             "mensaje": "El procesamiento del frame tardó demasiado"}
+                except ImagenInvalida:
+                    linea = {"frame": frame, "omitido": True, "mensaje": "No se pudo leer el frame"}
+                yield json.dumps(linea) + "\n"
+
+            resumen = [{
+                "track": t.id,
+                "primer_frame": t.primer_frame,
+                "ultimo_frame": t.ultimo_frame,
+                "embeddings": t.n_embeddings,
+                "resultado": t.decision
+            } for t in seguidor.todos()]
+            yield json.dumps({"resumen": resumen}) + "\n"
+        except Exception as e:
+            print("Error en reconocimiento de video:", e)
+            import traceback; traceback.print_exc()
+            yield json.dumps({"error": "Error al procesar la secuencia de frames"}) + "\n"
+
+    return Response(stream_with_context(generar()), mimetype="application/x-ndjson")
+
 #Editar Usuario de datos
 @app.route("/editar_usuario/<int:usuario_id>", methods=["PUT"])
 def editar_usuario(usuario_id):
@@ -401,29 +859,56 @@ def editar_usuario(usuario_id):
         # Si se envía imagen, agrega una nueva (¡no borra las anteriores!)
         if 'imagen' in request.files and request.files['imagen'].filename != '':
             imagen = request.files['imagen']
-            filename = secure_filename(imagen.filename)
-            carpeta_usuario = os.path.join("uploads", f"user_{usuario_id}")
-            os.makedirs(carpeta_usuario, exist_ok=True)
-            ruta_guardado = os.path.join(carpeta_usuario, filename)
-            imagen.save(ruta_guardado)
-            with open(ruta_guardado, 'rb') as f:
-                imagen_bytes = f.read()
+            # Nombre único como en /agregar_imagen: otra foto con el mismo
+            # nombre de cliente ("foto.jpg") no pisa el archivo de otra fila
+            filename = f"{uuid.uuid4().hex[:8]}_{secure_filename(imagen.filename)}"
+            imagen_bytes = imagen.read()
+            h = verificar_duplicado_hash(usuario_id, imagen_bytes)
 
-            embeddings = obtener_embeddings(imagen_bytes)
+            embeddings, embedding_fr = calcular_descriptores(imagen_bytes)
             if embeddings is None:
                 cursor.close()
                 return jsonify({"mensaje": "No se detectaron características LBP"}), 400
+            verificar_duplicado_embedding(usuario_id, embeddings)
 
+            # El archivo se escribe recién cuando la imagen fue aceptada
+            carpeta_usuario = os.path.join("uploads", f"user_{usuario_id}")
+            os.makedirs(carpeta_usuario, exist_ok=True)
+            with open(os.path.join(carpeta_usuario, filename), 'wb') as f:
+                f.write(imagen_bytes)
             ruta_relativa = os.path.join(f"user_{usuario_id}", filename)
 
             # ¡Solo INSERTA la nueva imagen y sus embeddings!
-            sql_img = """INSERT INTO imagenes (usuario_id, imagen_path, embeddings)
-                         VALUES (%s, %s, %s)"""
-            cursor.execute(sql_img, (usuario_id, ruta_relativa, json.dumps(embeddings)))
+            asegurar_formato_embeddings()
+            cursor.execute(SQL_INSERTAR_IMAGEN, (usuario_id, ruta_relativa, codificar_embedding(embeddings),
+                                     codificar_embedding(embedding_fr)))
+            nueva_imagen = (cursor.lastrowid, usuario_id, ruta_relativa, embeddings, embedding_fr, h)
+        else:
+            nueva_imagen = None
 
         mysql.connection.commit()
+        if nueva_imagen:
+            imagen_id, _, ruta_relativa, embeddings, embedding_fr, h = nueva_imagen
+            registrar_cambio(op='agregar', imagen_id=imagen_id, usuario_id=usuario_id, ruta=ruta_relativa,
+                             emb=embeddings, emb_fr=embedding_fr, dhash=h)
+        # Nombre o requisitoriado pueden haber cambiado aunque no haya imagen
+        # nueva: el cambio invalida el cache de resultados de todos los procesos
+        registrar_cambio(op='editar_usuario', usuario_id=usuario_id)
         cursor.close()
         return jsonify({"mensaje": "Usuario actualizado (datos y/o imagen agregada)"}), 200
+    except ImagenDuplicada as e:
+        # Con 'fusionar' se guardan los datos personales sin la imagen repetida
+        if duplicados_config['accion'] == 'fusionar':
+            mysql.connection.commit()
+            registrar_cambio(op='editar_usuario', usuario_id=usuario_id)
+        cursor.close()
+        return respuesta_duplicada(e)
+    except ColaLlena:
+        return respuesta_ocupado()
+    except TiempoAgotado:
+        return respuesta_tiempo_agotado()
+    except ImagenInvalida:
+        return respuesta_imagen_invalida()
     except Exception as e:
         print("Error editando usuario:", e)
         import traceback; traceback.print_exc()
@@ -436,24 +921,32 @@ def imagenes_usuario(usuario_id):
     try:
         cursor = mysql.connection.cursor()
         
-        # ----------- GET: Listar todas las imágenes del usuario -----------
+        # ----------- GET: Listar las imágenes del usuario -----------
+        # Mismos parámetros que /listar_usuarios salvo requisitoriado (400);
+        # el cursor es (fecha_registro, id) porque el orden es por fecha
         if request.method == "GET":
-            cursor.execute("""
-                SELECT id, imagen_path, fecha_registro
-                FROM imagenes
-                WHERE usuario_id = %s
-                ORDER BY fecha_registro DESC
-            """, (usuario_id,))
-            resultados = cursor.fetchall()
+            cursor.close()
+            try:
+                parametros = ParametrosListado(request.args, CAMPOS_IMAGEN, CURSOR_IMAGENES,
+                                               con_requisitoriado=False)
+            except ParametroInvalido as e:
+                return jsonify({"mensaje": str(e)}), 400
+            datos = cache_usuarios.obtener(usuario_id, consultar_imagenes_usuario)
             imagenes = []
-            for fila in resultados:
+            for _id, ruta, fecha in zip(datos.ids, datos.rutas, datos.fechas):
                 imagenes.append({
-                    "id": fila[0],
-                    "imagen_path": fila[1],
-                    "fecha_registro": str(fila[2]) if fila[2] else None
+                    "id": int(_id),
+                    "imagen_path": ruta,
+                    "fecha_registro": str(fecha) if fecha else None
                 })
-            cursor.close()
-            return jsonify(imagenes), 200
+            if parametros.paginado:
+                pagina, siguiente = pagina_imagenes(imagenes, parametros)
+                return respuesta_pagina({"imagenes": pagina, "siguiente": siguiente})
+            imagenes = [{c: i[c] for c in parametros.campos} for i in imagenes]
+            if parametros.formato == 'jsonl':
+                return respuesta_por_partes(lineas_json(imagenes, app.json.dumps), 'application/x-ndjson',
+                                            etag_de(imagenes))
+            return respuesta_pagina(imagenes)
         
         # ----------- DELETE: Eliminar por id o por comparación facial -----------
         if request.method == "DELETE":
@@ -472,34 +965,47 @@ def imagenes_usuario(usuario_id):
                     os.remove(ruta_absoluta)
                 cursor.execute("DELETE FROM imagenes WHERE id=%s AND usuario_id=%s", (imagen_id, usuario_id))
                 mysql.connection.commit()
+                registrar_cambio(op='eliminar_imagenes', imagen_ids=[int(imagen_id)], usuario_id=usuario_id)
                 cursor.close()
                 return jsonify({"mensaje": "Imagen eliminada correctamente (por imagen_id)"}), 200
             
             # Eliminar por comparación facial (si no se mandó imagen_id pero sí imagen)
             if 'imagen' in request.files and request.files['imagen'].filename != '':
                 imagen = request.files['imagen']
-                imagen_bytes = imagen.read()
-                emb_subida = obtener_embeddings(imagen_bytes)
+                with bytes_subida(imagen) as imagen_bytes:
+                    if subidas_config['auditoria']:
+                        auditoria.guardar(imagen_bytes, imagen.filename, prefijo='eliminar_')
+                    emb_subida, _ = calcular_descriptores(imagen_bytes, solo_tradicional=True)
                 if emb_subida is None:
                     cursor.close()
                     return jsonify({"mensaje": "No se detectaron características en la imagen subida"}), 400
 
-                cursor.execute("SELECT id, imagen_path, embeddings FROM imagenes WHERE usuario_id=%s", (usuario_id,))
-                resultados = cursor.fetchall()
-                umbral = 0.98  # Ajusta según tu necesidad
-
-                for fila in resultados:
-                    _id, _imagen_path, _embeddings_json = fila
-                    emb_guardado = np.array(json.loads(_embeddings_json))
-                    sim = float(np.dot(emb_subida, emb_guardado) / (np.linalg.norm(emb_subida) * np.linalg.norm(emb_guardado)))
-                    if sim >= umbral:
-                        ruta_absoluta = os.path.join("uploads", _imagen_path)
+                # Una sola comparación vectorizada contra las imágenes del usuario
+                datos = cache_usuarios.obtener(usuario_id, consultar_imagenes_usuario)
+                filas, sims = datos.similitudes(emb_subida)
+                umbral = reconocimiento_config['umbral_eliminar']
+                coinciden = sims >= umbral
+
+                if coinciden.any():
+                    # Todos los casi duplicados se borran en una sola transacción
+                    borrar = [int(datos.ids[k]) for k in filas[coinciden]]
+                    marcadores = ', '.join(['%s'] * len(borrar))
+                    cursor.execute(f"DELETE FROM imagenes WHERE usuario_id=%s AND id IN ({marcadores})",
+                                   (usuario_id, *borrar))
+                    mysql.connection.commit()
+                    registrar_cambio(op='eliminar_imagenes', imagen_ids=borrar, usuario_id=usuario_id)
+                    cursor.close()
+                    for k in filas[coinciden]:
+                        ruta_absoluta = os.path.join("uploads", datos.rutas[k])
                         if os.path.exists(ruta_absoluta):
                             os.remove(ruta_absoluta)
-                        cursor.execute("DELETE FROM imagenes WHERE id=%s AND usuario_id=%s", (_id, usuario_id))
-                        mysql.connection.commit()
-                        cursor.close()
-                        return jsonify({"mensaje": f"Imagen eliminada por coincidencia facial (similitud: {sim:.4f})"}), 200
+                    eliminadas = [{"id": int(datos.ids[k]), "similitud": round(float(sim), 4)}
+                                  for k, sim in zip(filas[coinciden], sims[coinciden])]
+                    return jsonify({
+                        "mensaje": f"{len(borrar)} imagen(es) eliminada(s) por coincidencia facial "
+                                   f"(similitud máxima: {float(sims.max()):.4f})",
+                        "eliminadas": eliminadas
+                    }), 200
 
                 cursor.close()
                 return jsonify({"mensaje": "No se encontró imagen similar para eliminar"}), 404
@@ -507,6 +1013,12 @@ def imagenes_usuario(usuario_id):
             cursor.close()
             return jsonify({"mensaje": "Debes enviar 'imagen_id' o 'imagen' para eliminar"}), 400
 
+    except ColaLlena:
+        return respuesta_ocupado()
+    except TiempoAgotado:
+        return respuesta_tiempo_agotado()
+    except ImagenInvalida:
+        return respuesta_imagen_invalida()
     except Exception as e:
         print("Error en imagenes_usuario:", e)
         import traceback; traceback.print_exc()
@@ -529,6 +1041,7 @@ def eliminar_usuario(usuario_id):
         # Eliminar usuario
         cursor.execute("DELETE FROM usuarios WHERE id=%s", (usuario_id,))
         mysql.connection.commit()
+        registrar_cambio(op='eliminar_usuario', usuario_id=usuario_id)
         cursor.close()
         # Eliminar carpeta si está vacía
         carpeta_usuario = os.path.join("uploads", f"user_{usuario_id}")
@@ -543,8 +1056,15 @@ def eliminar_usuario(usuario_id):
         return jsonify({"mensaje": "Error al eliminar usuario"}), 500
   
 
+
 # Ejecutar la app
 if __name__ == "__main__":
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    debug = True
+    # Cargar el índice y precalentar en segundo plano mientras el servidor
+    # arranca. Con el recargador de debug el script corre dos veces y el
+    # proceso que solo vigila los archivos no necesita hacerlo
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        iniciar_precalentamiento()
+    app.run(debug=debug, host='0.0.0.0', port=5000)
 
 
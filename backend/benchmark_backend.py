@@ -0,0 +1,514 @@
+import io
+import os
+import sys
+import json
+import glob
+import time
+import uuid
+import argparse
+import platform
+import subprocess
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Benchmarks del backend con las imágenes de uploads/ como fixtures.
+# Guarda los resultados en JSON para comparar entre commits.
+#   python benchmark_backend.py micro                       # etapas de los descriptores (y su versión original)
+#   python benchmark_backend.py galeria --tamanos 1000,10000,100000
+#   python benchmark_backend.py rutas                       # /reconocer_usuario con BD simulada
+#   python benchmark_backend.py carga --concurrencia 8 --peticiones 200
+#   python benchmark_backend.py carga --url http://localhost:5000   # contra un servidor real
+#   python benchmark_backend.py arranque                   # import de la app y primera petición
+#   python benchmark_backend.py todo
+#   python benchmark_backend.py comparar base.json nuevo.json
+
+DIM_TRAD = 2276
+DIM_FR = 128
+ROSTROS_POR_LOTE = 4      # consultas por lote en el modo galeria (rostros de una foto)
+
+
+def parsear_argumentos():
+    parser = argparse.ArgumentParser(description="Benchmarks y prueba de carga del backend")
+    parser.add_argument('modo', choices=['micro', 'galeria', 'rutas', 'carga', 'arranque', 'todo', 'comparar'])
+    parser.add_argument('archivos', nargs='*', help="con 'comparar': resultado base y resultado nuevo")
+    parser.add_argument('--fixtures', default='uploads', help="carpeta con imágenes de prueba")
+    parser.add_argument('--max-fixtures', type=int, default=20)
+    parser.add_argument('--repeticiones', type=int, default=3, help="repeticiones por imagen en micro")
+    parser.add_argument('--tamanos', default='1000,10000', help="tamaños de la galería sintética")
+    parser.add_argument('--consultas', type=int, default=50, help="consultas por tamaño de galería")
+    parser.add_argument('--galeria-rutas', type=int, default=10000,
+                        help="imágenes sintéticas de la galería en rutas y carga")
+    parser.add_argument('--concurrencia', type=int, default=4)
+    parser.add_argument('--peticiones', type=int, default=100)
+    parser.add_argument('--url', default=None, help="servidor real para 'carga' (si no, cliente de prueba de Flask)")
+    parser.add_argument('--sin-pool', action='store_true', help="calcular descriptores en el hilo de la petición")
+    parser.add_argument('--sin-cache', action='store_true', help="desactivar el cache de resultados en 'carga'")
+    parser.add_argument('--salida', default=None, help="archivo JSON (por defecto benchmark_resultados/<fecha>_<commit>.json)")
+    return parser.parse_args()
+
+
+# --------- Utilidades ----------
+def percentiles(tiempos_ms):
+    t = np.asarray(tiempos_ms, dtype=np.float64)
+    if len(t) == 0:
+        return {}
+    return {
+        "n": int(len(t)),
+        "media_ms": round(float(t.mean()), 3),
+        "p50_ms": round(float(np.percentile(t, 50)), 3),
+        "p95_ms": round(float(np.percentile(t, 95)), 3),
+        "p99_ms": round(float(np.percentile(t, 99)), 3),
+        "max_ms": round(float(t.max()), 3)
+    }
+
+
+def medir(funcion, *args):
+    t0 = time.perf_counter()
+    resultado = funcion(*args)
+    return (time.perf_counter() - t0) * 1000, resultado
+
+
+def cargar_fixtures(carpeta, maximo):
+    rutas = sorted(glob.glob(os.path.join(carpeta, '**', '*.jp*g'), recursive=True)
+                   + glob.glob(os.path.join(carpeta, '**', '*.png'), recursive=True))
+    fixtures = []
+    for ruta in rutas[:maximo]:
+        with open(ruta, 'rb') as f:
+            fixtures.append((ruta, f.read()))
+    if not fixtures:
+        raise SystemExit(f"No hay imágenes en {carpeta}")
+    return fixtures
+
+
+def commit_actual():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return 'desconocido'
+
+
+# --------- Galería sintética ----------
+def galeria_sintetica(n, imagenes_por_usuario=5, semilla=0):
+    """Arreglos para IndiceEmbeddings.cargar_arreglos: cada usuario es un
+    centro aleatorio y sus imágenes son variaciones cercanas. Los embeddings
+    tradicionales son no negativos, como los histogramas LBP/LPQ/HOG."""
+    rng = np.random.default_rng(semilla)
+    n_usuarios = max(1, n // imagenes_por_usuario)
+    usuarios = np.arange(n, dtype=np.int64) % n_usuarios
+    centros_trad = rng.random((n_usuarios, DIM_TRAD), dtype=np.float32)
+    centros_fr = rng.normal(size=(n_usuarios, DIM_FR)).astype(np.float32)
+    trad = np.empty((n, DIM_TRAD), dtype=np.float32)
+    fr = np.empty((n, DIM_FR), dtype=np.float32)
+    # Por bloques para no duplicar la memoria en galerías grandes
+    for inicio in range(0, n, 10000):
+        u = usuarios[inicio:inicio + 10000]
+        trad[inicio:inicio + 10000] = centros_trad[u] + 0.05 * rng.random((len(u), DIM_TRAD), dtype=np.float32)
+        fr[inicio:inicio + 10000] = centros_fr[u] + 0.35 * rng.normal(size=(len(u), DIM_FR)).astype(np.float32)
+    ids = np.arange(1, n + 1, dtype=np.int64)
+    rutas = [f"sintetico/{i}.jpg" for i in ids]
+    return ids, usuarios + 1, rutas, trad, fr, np.ones(n, dtype=bool)
+
+
+def embeddings_fixtures(fixtures):
+    from utils.preprocesamiento import calcular_embeddings
+    resultado = []
+    for ruta, datos in fixtures:
+        emb, emb_fr = calcular_embeddings(datos)
+        if emb is not None and emb_fr is not None:
+            resultado.append((ruta, datos, np.asarray(emb, dtype=np.float32), np.asarray(emb_fr, dtype=np.float32)))
+    return resultado
+
+
+def armar_indice(indice, n_sinteticas, fixtures_emb):
+    """Galería sintética de n imágenes más una imagen por fixture (usuarios
+    propios) para que las consultas tengan coincidencias reales."""
+    ids, usuarios, rutas, trad, fr, tiene_fr = galeria_sintetica(n_sinteticas)
+    if fixtures_emb:
+        k = len(fixtures_emb)
+        ids = np.concatenate([ids, np.arange(len(ids) + 1, len(ids) + 1 + k)])
+        usuarios = np.concatenate([usuarios, 10 ** 7 + np.arange(k)])
+        rutas = list(rutas) + [r for r, _, _, _ in fixtures_emb]
+        trad = np.vstack([trad, np.stack([e for _, _, e, _ in fixtures_emb])])
+        fr = np.vstack([fr, np.stack([f for _, _, _, f in fixtures_emb])])
+        tiene_fr = np.concatenate([tiene_fr, np.ones(k, dtype=bool)])
+    indice.cargar_arreglos(ids, usuarios, rutas, trad, fr, tiene_fr)
+    return indice
+
+
+# --------- 1. Micro-benchmarks por etapa ----------
+# Etapa vectorizada -> implementación original (utils/descriptores_referencia.py),
+# medidas sobre las mismas variantes para ver la aceleración
+ETAPAS_REFERENCIA = {'lbp_descriptor': 'lbp_referencia', 'lpq_descriptor': 'lpq_referencia'}
+
+
+def benchmark_micro(fixtures, repeticiones):
+    import face_recognition
+    from utils.face_utils import (preparar_variantes, lbp_descriptor, lpq_descriptor, hog_descriptor,
+                                  obtener_embeddings_lbp_lpq_hog)
+    from utils.descriptores_referencia import lbp_descriptor_referencia, lpq_referencia
+    from utils.preprocesamiento import ImagenPreprocesada, imagen_para_descriptores
+
+    etapas = {nombre: [] for nombre in ['decodificar_y_detectar', 'preparar_variantes', 'lbp_descriptor',
+                                        'lpq_descriptor', 'hog_descriptor', 'obtener_embeddings_lbp_lpq_hog',
+                                        'face_recognition_encoding', *ETAPAS_REFERENCIA.values()]}
+    for _, datos in fixtures:
+        for _ in range(repeticiones):
+            t, pre = medir(ImagenPreprocesada, datos)
+            etapas['decodificar_y_detectar'].append(t)
+            imagen = imagen_para_descriptores(pre)
+            t, variantes = medir(preparar_variantes, imagen)
+            etapas['preparar_variantes'].append(t)
+            etapas['lbp_descriptor'].append(medir(lbp_descriptor, variantes)[0])
+            etapas['lpq_descriptor'].append(medir(lpq_descriptor, variantes)[0])
+            etapas['hog_descriptor'].append(sum(medir(hog_descriptor, v)[0] for v in variantes))
+            etapas['obtener_embeddings_lbp_lpq_hog'].append(medir(obtener_embeddings_lbp_lpq_hog, imagen)[0])
+            # Las dos variantes, una por una como en el código original
+            etapas['lbp_referencia'].append(sum(medir(lbp_descriptor_referencia, v)[0] for v in variantes))
+            # convolve2d tal cual estaba, sin la resolución exacta de las respuestas nulas
+            etapas['lpq_referencia'].append(sum(medir(lpq_referencia, v, 7, False)[0] for v in variantes))
+            if pre.ubicacion is not None:
+                etapas['face_recognition_encoding'].append(medir(
+                    face_recognition.face_encodings, pre.rgb, [pre.ubicacion])[0])
+    resultado = {nombre: percentiles(t) for nombre, t in etapas.items()}
+    for nombre, estadisticas in resultado.items():
+        if estadisticas:
+            print(f"  {nombre:34s} p50 {estadisticas['p50_ms']:8.2f} ms   p95 {estadisticas['p95_ms']:8.2f} ms")
+    for nueva, original in ETAPAS_REFERENCIA.items():
+        if resultado[nueva] and resultado[original]:
+            aceleracion = resultado[original]['p50_ms'] / resultado[nueva]['p50_ms']
+            resultado[nueva]['aceleracion_vs_original'] = round(aceleracion, 1)
+            print(f"  {nueva}: {aceleracion:.1f}x más rápido que la implementación original (p50)")
+    return resultado
+
+
+# --------- 2. Escaneo de la galería según su tamaño ----------
+def benchmark_galeria(tamanos, consultas):
+    from utils.indice_embeddings import IndiceEmbeddings
+    from utils.busqueda_ann import BusquedaExacta, BusquedaCascada, BusquedaCuantizada
+    from config import busqueda_config
+
+    resultado = {}
+    rng = np.random.default_rng(1)
+    for n in tamanos:
+        indice = IndiceEmbeddings()
+        t, _ = medir(armar_indice, indice, n, [])
+        _, _, _, trad, fr, _ = indice.snapshot()
+        filas = rng.integers(0, n, consultas)
+        q = trad[filas] + 0.01 * rng.random((consultas, DIM_TRAD), dtype=np.float32)
+        q_fr = fr[filas] + 0.05 * rng.normal(size=(consultas, DIM_FR)).astype(np.float32)
+        por_backend = {"carga_ms": round(t, 1), "memoria_mb": round((trad.nbytes + fr.nbytes) / 2 ** 20, 1)}
+        # Hace de la tabla imagenes (ids 1..n): de aquí lee el backend int8 las filas que recalcula
+        indice.fuente = lambda imagen_ids: [(i, trad[i - 1], fr[i - 1]) for i in imagen_ids]
+        cuantizada = BusquedaCuantizada(busqueda_config['recalcular_desde_trad'], busqueda_config['recalcular_desde_fr'])
+        for backend in [BusquedaExacta(), BusquedaCascada(busqueda_config['top_usuarios']), cuantizada]:
+            if backend is cuantizada:
+                # Desde aquí el índice solo guarda la copia int8
+                indice.activar_cuantizacion()
+                por_backend["memoria_int8_mb"] = round((indice.trad_q.nbytes + indice.fr_q.nbytes) / 2 ** 20, 1)
+            tiempos = [medir(backend.similitudes, indice, q[k], q_fr[k])[0] for k in range(consultas)]
+            por_backend[backend.nombre] = percentiles(tiempos)
+            if backend.nombre in ('exacto', 'int8'):
+                # Varios rostros de una misma foto en un solo producto
+                lotes = [medir(backend.similitudes_lote, indice, q[k:k + ROSTROS_POR_LOTE], q_fr[k:k + ROSTROS_POR_LOTE])[0]
+                         for k in range(0, consultas - ROSTROS_POR_LOTE + 1, ROSTROS_POR_LOTE)]
+                por_backend[f"{backend.nombre}_lote"] = percentiles(lotes)
+        print(f"  galería {n:>7d}: exacto p50 {por_backend['exacto']['p50_ms']:.2f} ms, "
+              f"cascada p50 {por_backend['cascada']['p50_ms']:.2f} ms, "
+              f"int8 p50 {por_backend['int8']['p50_ms']:.2f} ms, "
+              f"{por_backend['memoria_mb']} MB (int8 {por_backend['memoria_int8_mb']} MB)")
+        if por_backend['exacto_lote'] and por_backend['int8_lote']:
+            print(f"      int8 vs exacto: {por_backend['memoria_mb'] / por_backend['memoria_int8_mb']:.1f}x menos "
+                  f"memoria, {por_backend['exacto']['p50_ms'] / por_backend['int8']['p50_ms']:.2f}x por consulta, "
+                  f"{por_backend['exacto_lote']['p50_ms'] / por_backend['int8_lote']['p50_ms']:.2f}x "
+                  f"con {ROSTROS_POR_LOTE} rostros por foto (p50)")
+        resultado[str(n)] = por_backend
+        del indice, trad, fr
+    return resultado
+
+
+# --------- App Flask con la base de datos simulada ----------
+class CursorFalso:
+    def __init__(self, conexion):
+        self.conexion = conexion
+        self.filas = []
+        self.lastrowid = None
+        self.rowcount = 0
+
+    def execute(self, sql, parametros=()):
+        from utils.base_datos import SQL_DATOS_USUARIO
+        if sql == SQL_DATOS_USUARIO:
+            uid = parametros[0]
+            self.filas = [("Usuario", str(uid), f"COD{uid}", 0)]
+        else:
+            self.filas = []
+        if sql.lstrip().upper().startswith("INSERT"):
+            self.conexion.siguiente_id += 1
+            self.lastrowid = self.conexion.siguiente_id
+        return len(self.filas)
+
+    def executemany(self, sql, filas):
+        for parametros in filas:
+            self.execute(sql, parametros)
+
+    def fetchone(self):
+        return self.filas[0] if self.filas else None
+
+    def fetchall(self):
+        return list(self.filas)
+
+    def close(self):
+        pass
+
+
+class ConexionFalsa:
+    """Responde las consultas frecuentes sin un servidor MySQL."""
+    siguiente_id = 10 ** 8
+
+    def cursor(self):
+        return CursorFalso(self)
+
+    def ping(self, reconnect=False):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def preparar_app(n_galeria, fixtures_emb, sin_pool):
+    import app as aplicacion
+    import utils.pool_descriptores as pool_descriptores
+    from utils.base_datos import PoolConexiones
+    from utils.busqueda_ann import crear_busqueda
+
+    aplicacion.mysql.pool = PoolConexiones(crear=ConexionFalsa)
+    if sin_pool:
+        pool_descriptores.pool = None
+    armar_indice(aplicacion.indice, n_galeria, fixtures_emb)
+    aplicacion.busqueda = crear_busqueda(aplicacion.indice)
+    return aplicacion
+
+
+def post_reconocer(cliente, datos, multiples=False):
+    formulario = {'imagen': (io.BytesIO(datos), 'foto.jpg')}
+    if multiples:
+        formulario['multiples_rostros'] = '1'
+    respuesta = cliente.post('/reconocer_usuario', data=formulario, content_type='multipart/form-data')
+    return respuesta.status_code
+
+
+# --------- 3. Rutas de punta a punta ----------
+def benchmark_rutas(aplicacion, fixtures_emb):
+    cliente = aplicacion.app.test_client()
+    resultado = {}
+    cache = aplicacion.cache_config['habilitado']
+    try:
+        # Calentamiento (arranque del pool de procesos)
+        post_reconocer(cliente, fixtures_emb[0][1])
+        aplicacion.cache_config['habilitado'] = False
+        for nombre, multiples in [('reconocer_usuario', False), ('reconocer_usuario_multiples_rostros', True)]:
+            tiempos, estados = [], {}
+            for _, datos, _, _ in fixtures_emb:
+                t, estado = medir(post_reconocer, cliente, datos, multiples)
+                tiempos.append(t)
+                estados[estado] = estados.get(estado, 0) + 1
+            resultado[nombre] = {**percentiles(tiempos), "estados": {str(k): v for k, v in estados.items()}}
+
+        aplicacion.cache_config['habilitado'] = True
+        for _, datos, _, _ in fixtures_emb:
+            post_reconocer(cliente, datos)
+        tiempos = [medir(post_reconocer, cliente, datos)[0] for _, datos, _, _ in fixtures_emb]
+        resultado['reconocer_usuario_cache'] = percentiles(tiempos)
+    finally:
+        aplicacion.cache_config['habilitado'] = cache
+    for nombre, estadisticas in resultado.items():
+        print(f"  {nombre:38s} p50 {estadisticas['p50_ms']:8.2f} ms   p95 {estadisticas['p95_ms']:8.2f} ms")
+    return resultado
+
+
+# --------- 4. Carga concurrente ----------
+def multipart(datos, nombre='foto.jpg'):
+    limite = uuid.uuid4().hex
+    cuerpo = (f"--{limite}\r\nContent-Disposition: form-data; name=\"imagen\"; filename=\"{nombre}\"\r\n"
+              f"Content-Type: image/jpeg\r\n\r\n").encode() + datos + f"\r\n--{limite}--\r\n".encode()
+    return cuerpo, f"multipart/form-data; boundary={limite}"
+
+
+def benchmark_carga(fixtures, concurrencia, peticiones, url=None, aplicacion=None):
+    local = threading.local()
+
+    def enviar(k):
+        datos = fixtures[k % len(fixtures)][1]
+        t0 = time.perf_counter()
+        if url:
+            cuerpo, tipo = multipart(datos)
+            solicitud = urllib.request.Request(url.rstrip('/') + '/reconocer_usuario', data=cuerpo,
+                                               headers={'Content-Type': tipo})
+            try:
+                with urllib.request.urlopen(solicitud, timeout=120) as respuesta:
+                    estado = respuesta.status
+            except urllib.error.HTTPError as e:
+                estado = e.code
+        else:
+            if not hasattr(local, 'cliente'):
+                local.cliente = aplicacion.app.test_client()
+            estado = post_reconocer(local.cliente, datos)
+        return (time.perf_counter() - t0) * 1000, estado
+
+    # Calentamiento fuera de la medición (arranque del pool de procesos)
+    enviar(0)
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as ejecutor:
+        resultados = list(ejecutor.map(enviar, range(peticiones)))
+    total = time.perf_counter() - inicio
+
+    estados = {}
+    for _, estado in resultados:
+        estados[str(estado)] = estados.get(str(estado), 0) + 1
+    resultado = {
+        **percentiles([t for t, _ in resultados]),
+        "concurrencia": concurrencia,
+        "peticiones_por_s": round(peticiones / total, 2),
+        "estados": estados,
+        "destino": url or "flask_test_client"
+    }
+    print(f"  {peticiones} peticiones, concurrencia {concurrencia}: p50 {resultado['p50_ms']:.1f} ms, "
+          f"p95 {resultado['p95_ms']:.1f} ms, p99 {resultado['p99_ms']:.1f} ms, "
+          f"{resultado['peticiones_por_s']} req/s, estados {estados}")
+    return resultado
+
+
+# --------- 5. Arranque en frío ----------
+def medir_arranque(precalentar, sin_pool, ruta_fixture, peticiones=3):
+    """Corre en un proceso nuevo (un import ya hecho no se puede volver a
+    medir): tiempo de `import app`, del precalentamiento y de las primeras
+    peticiones a /reconocer_usuario. Imprime el resultado en JSON."""
+    t0 = time.perf_counter()
+    import app as aplicacion
+    importacion = (time.perf_counter() - t0) * 1000
+    preparar_app(1000, [], sin_pool)
+    aplicacion.cache_config['habilitado'] = False
+    resultado = {"importacion_ms": round(importacion, 1)}
+    if precalentar:
+        t0 = time.perf_counter()
+        aplicacion.iniciar_precalentamiento()
+        aplicacion.precalentamiento.join()
+        resultado["precalentamiento_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    with open(ruta_fixture, 'rb') as f:
+        datos = f.read()
+    cliente = aplicacion.app.test_client()
+    tiempos = [medir(post_reconocer, cliente, datos)[0] for _ in range(peticiones)]
+    resultado["primera_peticion_ms"] = round(tiempos[0], 1)
+    resultado["siguientes_ms"] = round(float(np.median(tiempos[1:])), 1)
+    import utils.pool_descriptores as pool_descriptores
+    if pool_descriptores.pool is not None:
+        pool_descriptores.pool.cerrar()
+    print(json.dumps(resultado))
+
+
+def benchmark_arranque(fixtures, sin_pool):
+    resultado = {}
+    for nombre, precalentar in [('sin_precalentar', False), ('precalentado', True)]:
+        codigo = (f"import benchmark_backend as b; "
+                  f"b.medir_arranque({precalentar}, {sin_pool}, {fixtures[0][0]!r})")
+        salida = subprocess.run([sys.executable, '-c', codigo], capture_output=True, text=True, check=True)
+        resultado[nombre] = json.loads(salida.stdout.strip().splitlines()[-1])
+        print(f"  {nombre:16s} " + "   ".join(f"{k} {v:.1f}" for k, v in resultado[nombre].items()))
+    return resultado
+
+
+# --------- Comparación entre dos ejecuciones ----------
+def aplanar(datos, prefijo=''):
+    salida = {}
+    for clave, valor in datos.items():
+        if isinstance(valor, dict):
+            salida.update(aplanar(valor, f"{prefijo}{clave}."))
+        elif clave.endswith('_ms') or clave == 'peticiones_por_s':
+            salida[prefijo + clave] = valor
+    return salida
+
+
+def comparar(ruta_base, ruta_nueva):
+    with open(ruta_base) as f:
+        base = json.load(f)
+    with open(ruta_nueva) as f:
+        nueva = json.load(f)
+    print(f"Base {base.get('commit')} ({base.get('fecha')}) -> nuevo {nueva.get('commit')} ({nueva.get('fecha')})")
+    a, b = aplanar(base['resultados']), aplanar(nueva['resultados'])
+    for clave in sorted(set(a) & set(b)):
+        if not (a[clave] and b[clave]):
+            continue
+        cambio = b[clave] / a[clave]
+        # Más tiempo es peor; más peticiones por segundo es mejor
+        peor = cambio > 1.10 if clave.endswith('_ms') else cambio < 0.90
+        print(f"  {'[REGRESION] ' if peor else ''}{clave}: {a[clave]} -> {b[clave]} ({cambio:.2f}x)")
+
+
+def main():
+    args = parsear_argumentos()
+    if args.modo == 'comparar':
+        if len(args.archivos) != 2:
+            raise SystemExit("Uso: benchmark_backend.py comparar base.json nuevo.json")
+        comparar(*args.archivos)
+        return
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.getcwd())
+    fixtures = cargar_fixtures(args.fixtures, args.max_fixtures)
+    resultados = {}
+    modos = ['micro', 'galeria', 'rutas', 'carga', 'arranque'] if args.modo == 'todo' else [args.modo]
+
+    if 'micro' in modos:
+        print(f"Micro-benchmarks ({len(fixtures)} imágenes x {args.repeticiones})")
+        resultados['micro'] = benchmark_micro(fixtures, args.repeticiones)
+    if 'galeria' in modos:
+        print("Escaneo de la galería sintética")
+        resultados['galeria'] = benchmark_galeria([int(n) for n in args.tamanos.split(',')], args.consultas)
+
+    if 'arranque' in modos:
+        # Antes que el resto, que importa la app en este proceso
+        print("Arranque en frío (proceso nuevo por medición)")
+        resultados['arranque'] = benchmark_arranque(fixtures, args.sin_pool)
+
+    aplicacion = None
+    if ('rutas' in modos or 'carga' in modos) and not ('carga' in modos and args.url and len(modos) == 1):
+        fixtures_emb = embeddings_fixtures(fixtures)
+        aplicacion = preparar_app(args.galeria_rutas, fixtures_emb, args.sin_pool)
+        if args.sin_cache:
+            aplicacion.cache_config['habilitado'] = False
+        if 'rutas' in modos:
+            print(f"Rutas (galería de {len(aplicacion.indice)} imágenes, BD simulada)")
+            resultados['rutas'] = benchmark_rutas(aplicacion, fixtures_emb)
+    if 'carga' in modos:
+        print("Carga concurrente")
+        resultados['carga'] = benchmark_carga(fixtures, args.concurrencia, args.peticiones, args.url, aplicacion)
+
+    salida = args.salida or os.path.join(
+        'benchmark_resultados', f"{time.strftime('%Y%m%d-%H%M%S')}_{commit_actual()}.json")
+    os.makedirs(os.path.dirname(salida) or '.', exist_ok=True)
+    with open(salida, 'w') as f:
+        json.dump({
+            "commit": commit_actual(),
+            "fecha": time.strftime('%Y-%m-%d %H:%M:%S'),
+            "maquina": {"python": platform.python_version(), "plataforma": platform.platform(),
+                        "cpus": os.cpu_count()},
+            "parametros": vars(args),
+            "resultados": resultados
+        }, f, indent=2)
+    print(f"Resultados guardados en {salida}")
+    if aplicacion is not None:
+        import utils.pool_descriptores as pool_descriptores
+        if pool_descriptores.pool is not None:
+            pool_descriptores.pool.cerrar()
+
+
+if __name__ == "__main__":
+    main()
@@ -6,3 +6,171 @@ db_config = {
     'password': '12345678',
     'database': 'reconocimiento_facial_1'
 }
+
+# Pool de conexiones compartido por app.py (utils/base_datos.py)
+db_pool_config = {
+    'max_conexiones': 10,     # conexiones abiertas como máximo
+    'timeout_s': 10,          # espera máxima por una conexión libre
+    'verificar_tras_s': 30    # ping antes de reutilizar una conexión ociosa por más de N segundos
+}
+
+# Formato con el que se guardan los embeddings en la tabla imagenes:
+# 'json' (texto, formato antiguo) o 'float32' / 'float16' (binario compacto).
+# Los formatos binarios requieren columnas BLOB: ejecutar primero
+# migrar_embeddings_binario.py (convierte columnas y filas) y recién después
+# cambiar 'formato'. Si las columnas siguen siendo TEXT, la app escribe en
+# 'json' y lo avisa al arrancar; los scripts se niegan a escribir.
+embeddings_config = {
+    'formato': 'json'
+}
+
+# Arranque de cada proceso de la app. cv2, skimage y face_recognition se
+# importan recién cuando se usan; con 'precalentar' un hilo carga la galería y
+# pasa una imagen sintética por ambos pipelines (en los procesos del pool, o
+# en este proceso si el pool está deshabilitado) antes de que /health/ready
+# responda 200. 'proceso_principal' precalienta también el proceso de Flask
+# aunque haya pool (solo hace falta si algo calcula descriptores fuera de él).
+arranque_config = {
+    'precalentar': True,
+    'proceso_principal': False,
+    'timeout_s': 120
+}
+
+# Preprocesamiento compartido: la imagen se decodifica una vez, se reduce
+# para la detección y el rostro se detecta una sola vez para ambos pipelines.
+# Con 'descriptores_en_rostro' los descriptores LBP+LPQ+HOG se calculan sobre
+# el recorte del rostro (si no se detecta rostro, sobre la imagen completa).
+# Las consultas solo son comparables con embeddings calculados de la misma
+# forma: la galería existente está calculada sobre la imagen completa, así
+# que activarlo exige recalcularla con actualizar_embeddings_fr.py --recalcular
+# (con la app detenida) para que las coincidencias dobles no empeoren.
+preprocesamiento_config = {
+    'max_lado_deteccion': 800,   # lado mayor (px) de la imagen usada para detectar
+    'descriptores_en_rostro': False,
+    'margen_rostro': 0.2          # margen alrededor del rostro, relativo a su tamaño
+}
+
+# Pool de procesos para extraer descriptores fuera del hilo de Flask.
+# Si la cola está llena se responde 503 con Retry-After.
+pool_config = {
+    'habilitado': True,
+    'procesos': None,        # None = un proceso por núcleo
+    'max_en_cola': None,     # trabajos simultáneos (en curso + en espera); None = 2 x procesos
+    'timeout_s': 30,         # tiempo máximo por trabajo (504 si se excede)
+    'retry_after_s': 2
+}
+
+# Cola de trabajos de enrolamiento en segundo plano (/agregar_imagen). Los
+# hilos consumidores arrancan con la primera petición de cada proceso de la
+# app; un trabajo tomado queda a nombre de ese proceso mientras renueve su
+# arriendo, y solo vuelve a la cola si el arriendo vence (el proceso murió)
+trabajos_config = {
+    'ruta_db': 'trabajos.db',   # archivo SQLite local con el estado de los trabajos
+    'hilos': 2,                 # hilos que consumen la cola (el cálculo va al pool)
+    'arriendo_s': 60,           # segundos sin renovar tras los que un trabajo se da por abandonado
+    'workers_en_app': True      # los procesos de la app consumen la cola desde su primera petición;
+                                # False si la consume otro proceso con iniciar_workers()
+}
+
+# Umbrales de decisión de /reconocer_usuario (similitud coseno). Un usuario
+# se acepta por coincidencia doble si al menos 'cantidad_minima' de sus
+# imágenes superan ambos umbrales; si ninguno llega, con un solo descriptor
+# sobre su umbral estricto. 'umbral_eliminar' es la similitud tradicional
+# desde la que DELETE /imagenes_usuario borra por rostro. Se calibran con
+# evaluar_umbrales.py.
+reconocimiento_config = {
+    'umbral_tradicional': 0.85,
+    'umbral_fr': 0.60,
+    'cantidad_minima': 4,
+    'umbral_estricto_tradicional': 0.98,
+    'umbral_estricto_fr': 0.85,
+    'umbral_eliminar': 0.98
+}
+
+# Backend de búsqueda para /reconocer_usuario:
+# 'exacto' compara contra toda la galería; 'ivf' preselecciona candidatos con
+# un índice IVF (k-means) sobre los embeddings face_recognition construido con
+# construir_indice_ann.py; 'cascada' compara primero contra el centroide de
+# cada usuario y solo revisa las imágenes de los mejores usuarios. Con 'ivf'
+# y 'cascada' la lógica de fallback se evalúa sobre los candidatos. 'int8'
+# recorre una copia cuantizada de toda la galería (1/4 de la memoria de
+# 'exacto') y recalcula en float32 las filas cercanas a los umbrales,
+# leyéndolas del snapshot de galeria_config o de la base de datos por id.
+busqueda_config = {
+    'backend': 'exacto',
+    'ruta_indice_ivf': 'indice_ivf.npz',
+    'n_sondeos': 8,       # listas IVF revisadas por consulta
+    'top_usuarios': 10,   # usuarios que pasan a la etapa 2 de la cascada
+    # Backend 'int8': desde qué puntaje se recalculan las filas. Deben ser menores o
+    # iguales a los umbrales más bajos de reconocimiento_config
+    'recalcular_desde_trad': reconocimiento_config['umbral_tradicional'],
+    'recalcular_desde_fr': reconocimiento_config['umbral_fr']
+}
+
+# Reconocimiento sobre secuencias de frames (/reconocer_video)
+video_config = {
+    'cada_n_frames': 5,            # recalcular embeddings de un track cada N frames
+    'iou_minimo': 0.3,             # IoU mínimo para asociar una detección a un track
+    'max_frames_perdido': 10,      # frames sin detección antes de cerrar un track
+    'distancia_maxima_track': 0.6, # distancia face_recognition para seguir siendo la misma persona
+    'max_bytes_frame': 10 * 1024 * 1024
+}
+
+# Cache de resultados de /reconocer_usuario por hash de la imagen subida.
+# Cada proceso tiene el suyo: con varios workers WSGI, las altas, bajas y
+# ediciones hechas en otro proceso solo lo invalidan a través del registro
+# de cambios de galeria_config['snapshot']; sin snapshot, una respuesta puede
+# quedar desactualizada en los demás procesos hasta 'ttl_s'.
+cache_config = {
+    'habilitado': True,
+    'max_entradas': 1024,   # entradas LRU
+    'ttl_s': 300,           # segundos de vida de cada entrada
+    'max_usuarios': 256     # usuarios con imágenes decodificadas en memoria (listado y borrado por rostro)
+}
+
+# Detección de duplicados al enrolar (/agregar_imagen y /editar_usuario):
+# primero dHash contra las imágenes del usuario y, ya con los descriptores,
+# similitud del embedding tradicional
+duplicados_config = {
+    'habilitado': True,
+    'distancia_hash': 2,       # bits distintos (de 64) para considerar la misma foto
+    'umbral_similitud': 0.98,  # similitud coseno tradicional (igual que el borrado por rostro)
+    'accion': 'rechazar'       # 'rechazar' (409 / trabajo fallido) o 'fusionar' (se reutiliza la imagen existente)
+}
+
+# Subidas de imágenes: se procesan en memoria (sin archivo temporal). Con
+# 'auditoria' se guarda además una copia de cada consulta en segundo plano.
+subidas_config = {
+    'max_bytes': 20 * 1024 * 1024,   # tamaño máximo de un formulario con imagen
+    'auditoria': False,
+    'carpeta_auditoria': 'auditoria'
+}
+
+# Métricas de latencia por ruta y por etapa (GET /metrics, formato Prometheus).
+# Con 'perfilador' se muestrean las pilas de cada petición y se guarda un
+# perfil de las que tardan más de 'umbral_perfil_ms'.
+metricas_config = {
+    'habilitado': True,
+    'perfilador': False,
+    'umbral_perfil_ms': 1000,
+    'intervalo_muestreo_ms': 5,
+    'carpeta_perfiles': 'perfiles'
+}
+
+# Galería compartida entre varios procesos (workers WSGI): cada proceso mapea
+# con np.memmap un snapshot en disco en lugar de leer y decodificar la tabla
+# imagenes, y las altas/bajas posteriores se leen de un registro de cambios.
+# Los scripts que cambian embeddings sin pasar por la app descartan el snapshot.
+galeria_config = {
+    'snapshot': False,
+    'ruta': 'galeria.snap',
+    'max_cambios': 200     # cambios en el registro antes de reconstruir el snapshot
+}
+
+# Listados (/listar_usuarios y GET /imagenes_usuario): paginación por cursor
+# con ?limite y ?cursor; ?formato=jsonl exporta todo como líneas JSON
+listados_config = {
+    'limite_por_defecto': 50,
+    'limite_maximo': 500,
+    'lote_exportacion': 500    # filas por consulta al exportar completo
+}
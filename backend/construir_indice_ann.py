@@ -0,0 +1,111 @@
+import time
+import argparse
+import numpy as np
+
+from config import busqueda_config
+from utils.busqueda_ann import IndiceIVF
+from utils.indice_embeddings import normalizar_filas
+
+# Construye el índice IVF sobre los embeddings face_recognition y lo guarda
+# en busqueda_config['ruta_indice_ivf'] para que app.py lo cargue al arrancar.
+#   python construir_indice_ann.py                       # desde la base de datos
+#   python construir_indice_ann.py --benchmark           # + recall@k vs latencia
+#   python construir_indice_ann.py --sintetico 100000 --benchmark
+
+
+def parsear_argumentos():
+    parser = argparse.ArgumentParser(description="Construcción y evaluación del índice IVF")
+    parser.add_argument('--listas', type=int, default=None, help="cantidad de listas (por defecto ~sqrt(N))")
+    parser.add_argument('--iteraciones', type=int, default=20, help="iteraciones de k-means")
+    parser.add_argument('--salida', default=busqueda_config['ruta_indice_ivf'])
+    parser.add_argument('--sintetico', type=int, default=0,
+                        help="usar una galería sintética de N embeddings en lugar de la base de datos")
+    parser.add_argument('--benchmark', action='store_true', help="medir recall@k y latencia contra la búsqueda exacta")
+    parser.add_argument('--consultas', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    return parser.parse_args()
+
+
+def cargar_desde_bd():
+    from utils.base_datos import conectar
+    from utils.codificacion_embeddings import decodificar_embedding
+    db = conectar()
+    cursor = db.cursor()
+    cursor.execute("SELECT id, embedding_fr FROM imagenes WHERE embedding_fr IS NOT NULL ORDER BY id")
+    filas = cursor.fetchall()
+    cursor.close()
+    db.close()
+    ids = np.array([f[0] for f in filas], dtype=np.int64)
+    matriz = np.stack([decodificar_embedding(f[1]) for f in filas]) if filas else np.zeros((0, 128))
+    return ids, normalizar_filas(matriz)
+
+
+def galeria_sintetica(n, dim=128, imagenes_por_usuario=10, semilla=0):
+    # Cada usuario es un centro aleatorio; sus imágenes son variaciones cercanas
+    rng = np.random.default_rng(semilla)
+    n_usuarios = max(1, n // imagenes_por_usuario)
+    centros = rng.normal(size=(n_usuarios, dim)).astype(np.float32)
+    usuarios = rng.integers(0, n_usuarios, n)
+    matriz = centros[usuarios] + 0.35 * rng.normal(size=(n, dim)).astype(np.float32)
+    consultas = centros[rng.integers(0, n_usuarios, 1000)]
+    consultas = consultas + 0.35 * rng.normal(size=consultas.shape).astype(np.float32)
+    return np.arange(1, n + 1, dtype=np.int64), normalizar_filas(matriz), normalizar_filas(consultas)
+
+
+def benchmark(ivf, ids, matriz, consultas, k):
+    print(f"\nBenchmark sobre {len(ids)} imágenes, {len(consultas)} consultas, recall@{k}")
+    t0 = time.perf_counter()
+    exactos = []
+    for q in consultas:
+        sims = matriz @ q
+        exactos.append(set(ids[np.argpartition(-sims, k - 1)[:k]]))
+    t_exacto = (time.perf_counter() - t0) / len(consultas) * 1000
+    print(f"  exacto           latencia {t_exacto:8.3f} ms   recall 1.000   candidatos {len(ids)}")
+
+    for n_sondeos in [1, 2, 4, 8, 16, 32, 64]:
+        if n_sondeos > len(ivf.centroides):
+            break
+        aciertos = 0
+        candidatos_total = 0
+        t0 = time.perf_counter()
+        for q, exacto in zip(consultas, exactos):
+            candidatos = ivf.buscar(q, n_sondeos)
+            filas = np.searchsorted(ids, candidatos)
+            sims = matriz[filas] @ q
+            top = candidatos[np.argpartition(-sims, min(k, len(sims)) - 1)[:k]] if len(sims) else []
+            aciertos += len(exacto.intersection(top))
+            candidatos_total += len(candidatos)
+        t_ivf = (time.perf_counter() - t0) / len(consultas) * 1000
+        print(f"  ivf sondeos={n_sondeos:<3d} latencia {t_ivf:8.3f} ms   "
+              f"recall {aciertos / (k * len(consultas)):.3f}   "
+              f"candidatos {candidatos_total / len(consultas):.0f}")
+
+
+def main():
+    args = parsear_argumentos()
+    if args.sintetico:
+        ids, matriz, consultas = galeria_sintetica(args.sintetico)
+    else:
+        ids, matriz = cargar_desde_bd()
+        # Consultas: las propias imágenes de la galería
+        rng = np.random.default_rng(0)
+        consultas = matriz[rng.choice(len(matriz), min(args.consultas, len(matriz)), replace=False)]
+    if len(ids) == 0:
+        print("No hay embeddings face_recognition para indexar")
+        return
+
+    t0 = time.time()
+    ivf = IndiceIVF.construir(ids, matriz, n_listas=args.listas, iteraciones=args.iteraciones)
+    print(f"Índice IVF construido: {len(ids)} imágenes, {len(ivf.centroides)} listas "
+          f"en {time.time() - t0:.1f} s")
+
+    if not args.sintetico:
+        ivf.guardar(args.salida)
+        print(f"Guardado en {args.salida}")
+
+    if args.benchmark:
+        benchmark(ivf, ids, matriz, consultas[:args.consultas], min(args.k, len(ids)))
+
+
+if __name__ == "__main__":
+    main()
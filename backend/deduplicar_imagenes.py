@@ -0,0 +1,193 @@
+import os
+import time
+import hashlib
+import argparse
+import numpy as np
+
+from config import duplicados_config, galeria_config
+from utils.codificacion_embeddings import decodificar_embedding
+from utils.indice_embeddings import normalizar_filas
+from utils.duplicados import dhash_archivo, distancias_hamming, resolver_ruta
+from utils.base_datos import conectar, ejecutar_lote
+from utils.galeria_compartida import descartar_snapshot
+
+# Busca imágenes duplicadas por usuario (dHash y similitud del embedding
+# tradicional) y archivos de uploads/ que ninguna fila usa.
+#   python deduplicar_imagenes.py                      # solo reporte
+#   python deduplicar_imagenes.py --umbral 0.95        # criterio más amplio
+#   python deduplicar_imagenes.py --aplicar            # borra filas y archivos duplicados
+#   python deduplicar_imagenes.py --aplicar --borrar-copias
+
+
+def parsear_argumentos():
+    parser = argparse.ArgumentParser(description="Detección de imágenes duplicadas en la galería")
+    parser.add_argument('--distancia-hash', type=int, default=duplicados_config['distancia_hash'],
+                        help="bits distintos de dHash para considerar la misma foto")
+    parser.add_argument('--umbral', type=float, default=duplicados_config['umbral_similitud'],
+                        help="similitud coseno tradicional para considerar duplicado")
+    parser.add_argument('--uploads', default='uploads', help="carpeta de imágenes")
+    parser.add_argument('--aplicar', action='store_true', help="borrar las filas y archivos duplicados")
+    parser.add_argument('--borrar-copias', action='store_true',
+                        help="con --aplicar, borrar también los archivos sin fila que son copia exacta de otro")
+    return parser.parse_args()
+
+
+def tamano(ruta):
+    return os.path.getsize(ruta) if os.path.exists(ruta) else 0
+
+
+def sha256_archivo(ruta):
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 20), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+# --------- Duplicados dentro de cada usuario ----------
+def buscar_duplicados(filas, distancia_hash, umbral):
+    """filas: (id, usuario_id, imagen_path, embeddings) ordenadas por id.
+    Se conserva la imagen más antigua; devuelve [(id_duplicado, id_conservado, motivo)]."""
+    por_usuario = {}
+    for fila in filas:
+        por_usuario.setdefault(fila[1], []).append(fila)
+
+    duplicados = []
+    for usuario_id, imagenes in por_usuario.items():
+        hashes = [dhash_archivo(f[2]) for f in imagenes]
+        embeddings = [decodificar_embedding(f[3]) for f in imagenes]
+        conservadas = []    # posiciones dentro de `imagenes`
+        for k, (imagen_id, _, _, _) in enumerate(imagenes):
+            motivo = None
+            con_hash = [j for j in conservadas if hashes[j] is not None]
+            if hashes[k] is not None and con_hash:
+                distancias = distancias_hamming(hashes[k], [hashes[j] for j in con_hash])
+                if distancias.min() <= distancia_hash:
+                    motivo = (con_hash[int(np.argmin(distancias))], f"dHash a {int(distancias.min())} bits")
+            con_emb = [j for j in conservadas if embeddings[j] is not None and embeddings[k] is not None
+                       and len(embeddings[j]) == len(embeddings[k])]
+            if motivo is None and con_emb:
+                sims = normalizar_filas([embeddings[j] for j in con_emb]) @ normalizar_filas([embeddings[k]])[0]
+                if sims.max() >= umbral:
+                    motivo = (con_emb[int(np.argmax(sims))], f"similitud {float(sims.max()):.4f}")
+            if motivo is None:
+                conservadas.append(k)
+            else:
+                duplicados.append((imagen_id, imagenes[motivo[0]][0], motivo[1]))
+    return duplicados
+
+
+def ruta_normalizada(imagen_path):
+    # 'uploads/user_X/a.jpg' y 'user_X/a.jpg' pueden ser el mismo archivo
+    return os.path.normcase(os.path.abspath(resolver_ruta(imagen_path)))
+
+
+def archivos_a_borrar(filas, ids_borrados):
+    """Archivos de las filas borradas que ninguna fila conservada usa.
+    Varias filas pueden apuntar al mismo archivo (p. ej. dos subidas con el
+    mismo nombre); si una de ellas se conserva, el archivo no se toca."""
+    por_ruta = {}
+    for imagen_id, _, imagen_path, *_ in filas:
+        por_ruta.setdefault(ruta_normalizada(imagen_path), []).append(imagen_id)
+    return sorted(ruta for ruta, ids in por_ruta.items()
+                  if any(i in ids_borrados for i in ids) and all(i in ids_borrados for i in ids))
+
+
+# --------- Archivos de uploads/ sin fila en la base de datos ----------
+def buscar_huerfanos(carpeta, rutas_usadas):
+    usadas = {os.path.normpath(r) for r in rutas_usadas}
+    hashes_usados = {}
+    huerfanos = []
+    for raiz, _, archivos in os.walk(carpeta):
+        for nombre in archivos:
+            ruta = os.path.normpath(os.path.join(raiz, nombre))
+            if ruta in usadas:
+                hashes_usados.setdefault(sha256_archivo(ruta), ruta)
+            else:
+                huerfanos.append(ruta)
+    # Un huérfano es "copia" si su contenido es idéntico a un archivo usado
+    return [(ruta, hashes_usados.get(sha256_archivo(ruta))) for ruta in huerfanos]
+
+
+def tiempo_escaneo(matriz, consultas=200):
+    if len(matriz) == 0:
+        return 0.0
+    q = matriz[np.random.default_rng(0).integers(0, len(matriz), consultas)]
+    t0 = time.perf_counter()
+    for v in q:
+        matriz @ v
+    return (time.perf_counter() - t0) / consultas * 1000
+
+
+def main():
+    args = parsear_argumentos()
+    db = conectar()
+    cursor = db.cursor()
+    cursor.execute(
+        "SELECT id, usuario_id, imagen_path, embeddings, "
+        "COALESCE(LENGTH(embeddings), 0) + COALESCE(LENGTH(embedding_fr), 0) "
+        "FROM imagenes ORDER BY id"
+    )
+    filas = cursor.fetchall()
+    print(f"Imágenes en la galería: {len(filas)}")
+
+    t0 = time.time()
+    duplicados = buscar_duplicados([f[:4] for f in filas], args.distancia_hash, args.umbral)
+    print(f"Análisis de duplicados en {time.time() - t0:.1f} s "
+          f"(dHash <= {args.distancia_hash} bits o similitud >= {args.umbral})")
+
+    por_id = {f[0]: f for f in filas}
+    bytes_bd = 0
+    for imagen_id, conservada, motivo in duplicados:
+        fila = por_id[imagen_id]
+        bytes_bd += fila[4]
+        print(f"  [DUP] id={imagen_id} usuario={fila[1]} {fila[2]} -> conserva id={conservada} ({motivo})")
+    ids_dup = {d[0] for d in duplicados}
+    archivos_dup = archivos_a_borrar(filas, ids_dup)
+    bytes_archivos = sum(tamano(r) for r in archivos_dup)
+
+    # Tiempo de escaneo de la galería tradicional antes y después
+    embeddings = [(f[0], decodificar_embedding(f[3])) for f in filas]
+    dims = [len(e) for _, e in embeddings if e is not None]
+    dim = max(set(dims), key=dims.count) if dims else 0
+    validas = [(i, e) for i, e in embeddings if e is not None and len(e) == dim]
+    matriz = normalizar_filas([e for _, e in validas]) if validas else np.zeros((0, 1), dtype=np.float32)
+    sin_dup = np.array([i not in ids_dup for i, _ in validas], dtype=bool)
+    antes = tiempo_escaneo(matriz)
+    despues = tiempo_escaneo(matriz[sin_dup]) if len(validas) else 0.0
+
+    huerfanos = buscar_huerfanos(args.uploads, [resolver_ruta(f[2]) for f in filas])
+    copias = [(r, original) for r, original in huerfanos if original]
+    for ruta, original in huerfanos:
+        print(f"  [SIN FILA] {ruta}" + (f" (copia de {original})" if original else ""))
+
+    print("\nResumen")
+    print(f"  filas duplicadas:         {len(duplicados)} de {len(filas)}")
+    print(f"  archivos duplicados:      {len(archivos_dup)} ({bytes_archivos / 1024:.1f} KB)")
+    print(f"  embeddings en la BD:      {bytes_bd / 1024:.1f} KB")
+    print(f"  archivos sin fila:        {len(huerfanos)} "
+          f"({sum(tamano(r) for r, _ in huerfanos) / 1024:.1f} KB; {len(copias)} son copias exactas, "
+          f"{sum(tamano(r) for r, _ in copias) / 1024:.1f} KB)")
+    print(f"  escaneo tradicional:      {antes:.3f} ms -> {despues:.3f} ms por consulta "
+          f"({int(sin_dup.sum())} de {len(validas)} filas)")
+
+    if args.aplicar and duplicados:
+        # Una sola transacción para todas las filas
+        ejecutar_lote(db, "DELETE FROM imagenes WHERE id=%s", [(d[0],) for d in duplicados])
+        for ruta in archivos_dup:
+            if os.path.exists(ruta):
+                os.remove(ruta)
+        descartar_snapshot(galeria_config['ruta'])
+        print(f"[OK] {len(duplicados)} filas y {len(archivos_dup)} archivos sin otra fila que los use eliminados; "
+              f"reiniciar app.py para recargar el índice")
+    if args.aplicar and args.borrar_copias:
+        for ruta, _ in copias:
+            os.remove(ruta)
+        print(f"[OK] {len(copias)} copias sin fila eliminadas")
+
+    cursor.close()
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
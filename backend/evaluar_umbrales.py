@@ -0,0 +1,501 @@
+import json
+import time
+import argparse
+import numpy as np
+
+from config import reconocimiento_config
+from utils.indice_embeddings import IndiceEmbeddings
+from utils.seleccion import seleccionar_mejor_usuario
+
+# Calibración de los umbrales de reconocimiento_config con los embeddings
+# guardados, sin reenviar peticiones. Cada imagen con embedding
+# face_recognition se usa como consulta contra el resto de la galería:
+#   - sin ella misma (consulta genuina, si su usuario tiene otras imágenes)
+#   - sin ninguna imagen de su usuario (consulta impostora: alguien que no
+#     está registrado)
+# y se reproduce seleccionar_mejor_usuario para todas las combinaciones de
+# umbrales a la vez, por bloques de consultas y sin bucles por par.
+#   python evaluar_umbrales.py                                 # desde la base de datos
+#   python evaluar_umbrales.py --sintetico 20000
+#   python evaluar_umbrales.py --far-objetivo 0.001 --salida calibracion.json
+#   python evaluar_umbrales.py --umbrales-trad 0.80:0.95:0.025 --cantidades 2,3,4
+
+# Histogramas de similitud por pares: 1000 bins por unidad en [-1, 1]
+RESOLUCION = 1000
+N_BINS = 2 * RESOLUCION + 1
+METODOS = ('doble', 'solo_tradicional', 'solo_face_recognition')
+# Celdas de las tablas por (consulta, usuario) de un bloque; si se pasa, el bloque se parte
+MAX_CELDAS = 2 ** 23
+
+
+def parsear_argumentos():
+    parser = argparse.ArgumentParser(description="Curvas FAR/FRR y calibración de los umbrales de reconocimiento")
+    parser.add_argument('--sintetico', type=int, default=0,
+                        help="usar una galería sintética de N imágenes en lugar de la base de datos")
+    parser.add_argument('--imagenes-por-usuario', type=int, default=5, help="con --sintetico")
+    parser.add_argument('--umbrales-trad', default='0.75:0.95:0.05', help="inicio:fin:paso o lista con comas")
+    parser.add_argument('--umbrales-fr', default='0.45:0.75:0.05')
+    parser.add_argument('--cantidades', default='1,2,3,4,5,6', help="valores de cantidad_minima")
+    parser.add_argument('--estrictos-trad', default='0.96,0.98,0.99,1.01',
+                        help="umbrales estrictos del fallback tradicional (> 1 lo desactiva)")
+    parser.add_argument('--estrictos-fr', default='0.80,0.85,0.90,1.01',
+                        help="umbrales estrictos del fallback face_recognition (> 1 lo desactiva)")
+    parser.add_argument('--far-objetivo', type=float, default=0.001,
+                        help="tasa máxima de aceptaciones de impostores y de identificaciones erróneas")
+    parser.add_argument('--colateral-objetivo', type=float, default=0.01,
+                        help="tasa máxima de otras imágenes del mismo usuario borradas por umbral_eliminar")
+    parser.add_argument('--bloque', type=int, default=64, help="consultas por bloque")
+    parser.add_argument('--medir', type=int, default=200,
+                        help="consultas con las que se mide y verifica seleccionar_mejor_usuario")
+    parser.add_argument('--top', type=int, default=10, help="combinaciones listadas")
+    parser.add_argument('--salida', default=None, help="archivo JSON con las curvas y todas las combinaciones")
+    return parser.parse_args()
+
+
+def parsear_grilla(texto, actual):
+    """'inicio:fin:paso' o 'a,b,c'; siempre incluye el valor actual de la configuración."""
+    if ':' in texto:
+        inicio, fin, paso = (float(v) for v in texto.split(':'))
+        valores = np.arange(inicio, fin + paso / 2, paso)
+    else:
+        valores = [float(v) for v in texto.split(',') if v.strip()]
+    return np.unique(np.round(np.append(valores, actual), 6))
+
+
+def cargar_galeria(args):
+    indice = IndiceEmbeddings()
+    if args.sintetico:
+        from benchmark_backend import galeria_sintetica
+        indice.cargar_arreglos(*galeria_sintetica(args.sintetico, args.imagenes_por_usuario))
+    else:
+        from utils.base_datos import conectar, SQL_CARGAR_GALERIA
+        db = conectar()
+        cursor = db.cursor()
+        cursor.execute(SQL_CARGAR_GALERIA)
+        indice.cargar(cursor.fetchall())
+        cursor.close()
+        db.close()
+    _, usuarios, _, trad, fr, tiene_fr = indice.snapshot()
+    return usuarios, trad, fr, tiene_fr
+
+
+# --------- Curvas por par (un solo descriptor) ----------
+def bins_de(similitudes):
+    return np.clip(np.floor((similitudes + 1) * RESOLUCION), 0, N_BINS - 1).astype(np.int32)
+
+
+def umbral_de_bin(j):
+    return round(j / RESOLUCION - 1, 6)
+
+
+def bin_de_umbral(umbral):
+    return int(np.clip(np.ceil(round((umbral + 1) * RESOLUCION, 6)), 0, N_BINS))
+
+
+def curva(genuinos, impostores):
+    """FAR y FRR para cada umbral de bin (similitud >= umbral es aceptar)."""
+    far = np.cumsum(impostores[::-1])[::-1] / max(impostores.sum(), 1)
+    frr = np.concatenate([[0], np.cumsum(genuinos)[:-1]]) / max(genuinos.sum(), 1)
+    return far, frr
+
+
+def resumen_curva(genuinos, impostores, umbrales, far_objetivo):
+    far, frr = curva(genuinos, impostores)
+    eer = int(np.argmin(np.abs(far - frr)))
+    dentro = np.flatnonzero(far <= far_objetivo)
+    objetivo = int(dentro[0]) if len(dentro) else None
+    resultado = {
+        "pares_genuinos": int(genuinos.sum()),
+        "pares_impostores": int(impostores.sum()),
+        "eer": round(float((far[eer] + frr[eer]) / 2), 6),
+        "umbral_eer": umbral_de_bin(eer),
+        "umbral_far_objetivo": umbral_de_bin(objetivo) if objetivo is not None else None,
+        "frr_en_far_objetivo": round(float(frr[objetivo]), 6) if objetivo is not None else None,
+        "puntos": {}
+    }
+    for umbral in umbrales:
+        j = bin_de_umbral(umbral)
+        if j < N_BINS:
+            resultado["puntos"][f"{umbral:.3f}"] = {"far": round(float(far[j]), 6), "frr": round(float(frr[j]), 6)}
+    return resultado
+
+
+# --------- Evaluación de todas las combinaciones de umbrales ----------
+class Evaluacion:
+    """Acumula, bloque por bloque de consultas, los histogramas de pares y
+    el resultado de seleccionar_mejor_usuario para cada combinación
+    (trad, fr, cantidad_minima, estricto_trad, estricto_fr).
+
+    Cada similitud se lleva a un nivel: cuántos valores de la grilla
+    (umbrales y estrictos juntos) alcanza. Por cada par (consulta, usuario)
+    se arma una tabla de conteos por nivel tradicional x nivel fr y su
+    primera fila por celda; con sumas y mínimos acumulados sobre esa tabla
+    salen, para todas las combinaciones a la vez, cuántas imágenes de cada
+    usuario entran en cada máscara de seleccionar_mejor_usuario y cuál es la
+    primera (el desempate por orden de aparición)."""
+
+    def __init__(self, usuarios, trad, fr, tiene_fr, grillas):
+        self.trad, self.fr, self.tiene_fr = trad, fr, tiene_fr
+        self.n = len(usuarios)
+        self.usuario_ids, self.usuario_idx = np.unique(usuarios, return_inverse=True)
+        self.n_usuarios = len(self.usuario_ids)
+        self.T, self.F, self.K, self.TS, self.FS = grillas
+        # Niveles: cantidad de valores de la grilla menores o iguales a la
+        # similitud. En float32, como compara seleccionar_mejor_usuario
+        self.niveles_trad = np.unique(np.concatenate([self.T, self.TS])).astype(np.float32)
+        self.niveles_fr = np.unique(np.concatenate([self.F, self.FS])).astype(np.float32)
+        self.iT = np.searchsorted(self.niveles_trad, self.T.astype(np.float32))
+        self.iTS = np.searchsorted(self.niveles_trad, self.TS.astype(np.float32))
+        self.jF = np.searchsorted(self.niveles_fr, self.F.astype(np.float32))
+        self.jFS = np.searchsorted(self.niveles_fr, self.FS.astype(np.float32))
+        self.na, self.nb = len(self.niveles_trad) + 1, len(self.niveles_fr) + 1
+
+        # Con estrictos menores que los umbrales principales la combinación no tiene sentido
+        forma = (len(self.T), len(self.F), len(self.K), len(self.TS), len(self.FS))
+        self.validas = ((self.TS[np.newaxis, :] >= self.T[:, np.newaxis])[:, np.newaxis, np.newaxis, :, np.newaxis]
+                        & (self.FS[np.newaxis, :] >= self.F[:, np.newaxis])[np.newaxis, :, np.newaxis, np.newaxis, :])
+        self.validas = np.broadcast_to(self.validas, forma)
+
+        # Consultas: imágenes con embedding fr (sin él, /reconocer_usuario responde 400)
+        self.consultas = np.flatnonzero(tiene_fr)
+        por_usuario = np.bincount(self.usuario_idx[tiene_fr], minlength=self.n_usuarios)
+        self.genuina = por_usuario[self.usuario_idx] >= 2
+
+        self.hist = {clave: np.zeros(N_BINS, dtype=np.int64)
+                     for clave in ('trad_genuinos', 'trad_impostores', 'fr_genuinos', 'fr_impostores')}
+        self.correctas = np.zeros(forma, dtype=np.int64)
+        self.erroneas = np.zeros(forma, dtype=np.int64)
+        self.por_metodo = np.zeros((3,) + forma, dtype=np.int64)
+        self.impostoras_aceptadas = np.zeros(forma, dtype=np.int64)
+        self.filas_doble = np.zeros(forma[:2], dtype=np.int64)
+        self.usuarios_doble = np.zeros(forma[:2], dtype=np.int64)
+        self.n_genuinas = 0
+        self.n_impostoras = 0
+
+    def similitudes(self, filas):
+        return self.trad[filas] @ self.trad.T, self.fr[filas] @ self.fr.T
+
+    def procesar(self, filas):
+        st, sf = self.similitudes(filas)
+        locales = np.arange(len(filas))
+        propio = self.usuario_idx[filas]
+        mismo = self.usuario_idx[np.newaxis, :] == propio[:, np.newaxis]
+
+        # Histogramas por par (la diagonal y las filas sin fr van a un bin descartado)
+        descartar = 2 * N_BINS
+        codigos = bins_de(st) + N_BINS * mismo
+        codigos[locales, filas] = descartar
+        conteo = np.bincount(codigos.ravel(), minlength=descartar + 1)
+        self.hist['trad_impostores'] += conteo[:N_BINS]
+        self.hist['trad_genuinos'] += conteo[N_BINS:descartar]
+        codigos = bins_de(sf) + N_BINS * mismo
+        codigos[:, ~self.tiene_fr] = descartar
+        codigos[locales, filas] = descartar
+        conteo = np.bincount(codigos.ravel(), minlength=descartar + 1)
+        self.hist['fr_impostores'] += conteo[:N_BINS]
+        self.hist['fr_genuinos'] += conteo[N_BINS:descartar]
+
+        genuinas, impostoras, filas_doble, usuarios_doble = self.decisiones(st, sf, filas)
+        objetivo = propio[:, np.newaxis, np.newaxis, np.newaxis, np.newaxis, np.newaxis]
+        usuario, metodo = genuinas
+        es_genuina = self.genuina[filas]
+        correctas = (usuario == objetivo)[es_genuina]
+        self.correctas += correctas.sum(axis=0)
+        self.erroneas += ((usuario >= 0) & (usuario != objetivo))[es_genuina].sum(axis=0)
+        for m in range(3):
+            self.por_metodo[m] += (correctas & (metodo[es_genuina] == m + 1)).sum(axis=0)
+        self.impostoras_aceptadas += (impostoras[0] >= 0).sum(axis=0)
+        self.filas_doble += filas_doble
+        self.usuarios_doble += usuarios_doble
+        self.n_genuinas += int(es_genuina.sum())
+        self.n_impostoras += len(filas)
+
+    def decisiones(self, st, sf, filas):
+        """Usuario elegido (índice, -1 si ninguno) y método (1-3, 0 si
+        ninguno) para cada consulta y combinación, con la galería sin la
+        propia imagen (genuinas) y sin el propio usuario (impostoras)."""
+        n, U = self.n, self.n_usuarios
+        locales = np.arange(len(filas))
+        a = np.searchsorted(self.niveles_trad, st, side='right')
+        b = np.searchsorted(self.niveles_fr, sf, side='right')
+        # Pares que pueden entrar en alguna máscara para alguna combinación
+        a_estricto = self.iTS.min() + 1
+        b_estricto = self.jFS.min() + 1
+        candidato = ((a >= 1) & (b >= 1)) | (a >= a_estricto) | (b >= b_estricto)
+        candidato &= self.tiene_fr[np.newaxis, :]
+        candidato[locales, filas] = False
+        r, c = np.nonzero(candidato)
+        forma_k = (len(filas), len(self.T), len(self.F), len(self.K))
+        if len(r) == 0:
+            vacio = np.full(forma_k + (len(self.TS), len(self.FS)), -1, dtype=np.int64)
+            ceros = np.zeros(forma_k[1:3], dtype=np.int64)
+            return (vacio, np.zeros_like(vacio)), (vacio, np.zeros_like(vacio)), ceros, ceros
+
+        grupos, inversa = np.unique(r * U + self.usuario_idx[c], return_inverse=True)
+        G, celdas = len(grupos), self.na * self.nb
+        if G * celdas > MAX_CELDAS and len(filas) > 1:
+            # Galería muy densa en candidatos: dos mitades del bloque por separado
+            mitad = len(filas) // 2
+            p = self.decisiones(st[:mitad], sf[:mitad], filas[:mitad])
+            q = self.decisiones(st[mitad:], sf[mitad:], filas[mitad:])
+            unir = lambda x, y: tuple(np.concatenate([a, b]) for a, b in zip(x, y))
+            return unir(p[0], q[0]), unir(p[1], q[1]), p[2] + q[2], p[3] + q[3]
+        indices = inversa * celdas + a[r, c] * self.nb + b[r, c]
+        conteos = np.bincount(indices, minlength=G * celdas).astype(np.int32).reshape(G, self.na, self.nb)
+        primera = np.full(G * celdas, n, dtype=np.int32)
+        np.minimum.at(primera, indices, c)
+        primera = primera.reshape(G, self.na, self.nb)
+
+        # Q[x, y] = imágenes con nivel trad >= x y nivel fr >= y (con una fila y columna de ceros al final)
+        Q = np.zeros((G, self.na + 1, self.nb + 1), dtype=np.int32)
+        Q[:, :-1, :-1] = conteos[:, ::-1, ::-1].cumsum(axis=1).cumsum(axis=2)[:, ::-1, ::-1]
+        # Primera fila en cada cuadrante: (>=, >=), (>=, <=) y (<=, >=)
+        M_aa = np.full((G, self.na + 1, self.nb + 1), n, dtype=np.int32)
+        M_aa[:, :-1, :-1] = np.minimum.accumulate(np.minimum.accumulate(
+            primera[:, ::-1, ::-1], axis=1), axis=2)[:, ::-1, ::-1]
+        M_ab = np.full((G, self.na + 1, self.nb), n, dtype=np.int32)
+        M_ab[:, :-1] = np.minimum.accumulate(np.minimum.accumulate(
+            primera[:, ::-1], axis=1), axis=2)[:, ::-1]
+        M_ba = np.full((G, self.na, self.nb + 1), n, dtype=np.int32)
+        M_ba[:, :, :-1] = np.minimum.accumulate(np.minimum.accumulate(
+            primera[:, :, ::-1], axis=2), axis=1)[:, :, ::-1]
+
+        iT, iTS, jF, jFS = self.iT, self.iTS, self.jF, self.jFS
+        # Caso 1: doble (trad >= T y fr >= F)
+        c1 = Q[:, iT + 1][:, :, jF + 1]
+        r1 = M_aa[:, iT + 1][:, :, jF + 1]
+        # Caso 2: trad >= TS y no doble; con TS >= T es trad >= TS y fr < F
+        c2 = Q[:, iTS + 1, 0][:, :, np.newaxis] - Q[:, iTS + 1][:, :, jF + 1]
+        r2 = M_ab[:, iTS + 1][:, :, jF]
+        # Caso 3: fr >= FS, no doble ni caso 2; con FS >= F es fr >= FS y trad < T
+        c3 = Q[:, 0, jFS + 1][:, np.newaxis, :] - Q[:, iT + 1][:, :, jFS + 1]
+        r3 = M_ba[:, iT][:, :, jFS + 1]
+
+        # Grupos ordenados por consulta: segmentos para reducir por consulta
+        consulta_grupo = grupos // U
+        usuario_grupo = grupos % U
+        inicios = np.flatnonzero(np.r_[True, consulta_grupo[1:] != consulta_grupo[:-1]])
+        con_grupos = consulta_grupo[inicios]
+
+        def elegir(cantidades, primeras, minimo, excluir=None):
+            # Más imágenes primero y, a igual cantidad, la que aparece antes en la galería
+            clave = np.where(cantidades >= minimo, cantidades.astype(np.int64) * (n + 1) + (n - primeras), -1)
+            if excluir is not None:
+                clave[excluir] = -1
+            mejor = np.full((len(filas),) + clave.shape[1:], -1, dtype=np.int64)
+            mejor[con_grupos] = np.maximum.reduceat(clave, inicios, axis=0)
+            fila = n - mejor % (n + 1)
+            return np.where(mejor >= 0, self.usuario_idx[np.minimum(fila, n - 1)], -1)
+
+        minimo_k = self.K.reshape(1, 1, 1, -1)
+        propio = usuario_grupo == self.usuario_idx[filas][consulta_grupo]
+        resultados = []
+        for excluir in (None, propio):
+            u1 = elegir(c1[..., np.newaxis], r1[..., np.newaxis], minimo_k, excluir)
+            u2 = elegir(c2, r2, 1, excluir).transpose(0, 2, 1)[:, np.newaxis, :, np.newaxis, :, np.newaxis]
+            u3 = elegir(c3, r3, 1, excluir)[:, :, np.newaxis, np.newaxis, np.newaxis, :]
+            u1 = u1[..., np.newaxis, np.newaxis]
+            usuario = np.where(u1 >= 0, u1, np.where(u2 >= 0, u2, u3))
+            metodo = np.where(u1 >= 0, 1, np.where(u2 >= 0, 2, np.where(u3 >= 0, 3, 0)))
+            resultados.append((usuario, metodo))
+
+        # Tamaño de la máscara doble (lo que recorre agrupar_por_usuario)
+        filas_doble = c1.sum(axis=0)
+        usuarios_doble = (c1 > 0).sum(axis=0)
+        return resultados[0], resultados[1], filas_doble, usuarios_doble
+
+    # ---- Resultados ----
+    def combinaciones(self):
+        """Una fila por combinación válida con sus tasas."""
+        gen, imp = max(self.n_genuinas, 1), max(self.n_impostoras, 1)
+        filas = []
+        for t, f, k, ts, fs in zip(*np.nonzero(self.validas)):
+            correctas = int(self.correctas[t, f, k, ts, fs])
+            erroneas = int(self.erroneas[t, f, k, ts, fs])
+            filas.append({
+                "umbrales": self.umbrales(t, f, k, ts, fs),
+                "frr": round(1 - correctas / gen, 6),
+                "far": round(int(self.impostoras_aceptadas[t, f, k, ts, fs]) / imp, 6),
+                "identificacion_erronea": round(erroneas / gen, 6),
+                "rechazo": round((gen - correctas - erroneas) / gen, 6),
+                "por_metodo": {m: round(int(self.por_metodo[i, t, f, k, ts, fs]) / gen, 6)
+                               for i, m in enumerate(METODOS)},
+                "filas_doble_por_consulta": round(int(self.filas_doble[t, f]) / imp, 2),
+                "usuarios_doble_por_consulta": round(int(self.usuarios_doble[t, f]) / imp, 2),
+                "indice": (int(t), int(f), int(k), int(ts), int(fs))
+            })
+        return filas
+
+    def umbrales(self, t, f, k, ts, fs):
+        return {
+            'umbral_tradicional': float(self.T[t]), 'umbral_fr': float(self.F[f]),
+            'cantidad_minima': int(self.K[k]),
+            'umbral_estricto_tradicional': float(self.TS[ts]), 'umbral_estricto_fr': float(self.FS[fs])
+        }
+
+    def indice_de(self, umbrales):
+        return (int(np.flatnonzero(self.T == round(umbrales['umbral_tradicional'], 6))[0]),
+                int(np.flatnonzero(self.F == round(umbrales['umbral_fr'], 6))[0]),
+                int(np.flatnonzero(self.K == umbrales['cantidad_minima'])[0]),
+                int(np.flatnonzero(self.TS == round(umbrales['umbral_estricto_tradicional'], 6))[0]),
+                int(np.flatnonzero(self.FS == round(umbrales['umbral_estricto_fr'], 6))[0]))
+
+
+# --------- Costo real de cada combinación ----------
+def medir_seleccion(evaluacion, combinacion, muestra):
+    """Corre seleccionar_mejor_usuario sobre `muestra` consultas (genuinas e
+    impostoras): latencia por consulta y coincidencia con la evaluación
+    vectorizada."""
+    ev = evaluacion
+    t, f, k, ts, fs = combinacion["indice"]
+    umbrales = combinacion["umbrales"]
+    st, sf = ev.similitudes(muestra)
+    genuinas, impostoras, _, _ = ev.decisiones(st, sf, muestra)
+    tiempos, coincidencias, total = [], 0, 0
+    for i, fila in enumerate(muestra):
+        validos = ev.tiene_fr.copy()
+        validos[fila] = False
+        mismo = ev.usuario_idx == ev.usuario_idx[fila]
+        for validas, (usuario, _) in ((validos, genuinas), (validos & ~mismo, impostoras)):
+            t0 = time.perf_counter()
+            mejor = seleccionar_mejor_usuario(ev.usuario_idx, st[i], sf[i], validas, umbrales)
+            tiempos.append((time.perf_counter() - t0) * 1000)
+            esperado = int(usuario[i, t, f, k, ts, fs])
+            coincidencias += (mejor[0] if mejor else -1) == esperado
+            total += 1
+    tiempos = np.asarray(tiempos)
+    return {
+        "seleccion_p50_ms": round(float(np.percentile(tiempos, 50)), 3),
+        "seleccion_p95_ms": round(float(np.percentile(tiempos, 95)), 3),
+        "consultas_por_s": round(1000 / float(tiempos.mean()), 1),
+        "coincidencia_con_evaluacion": round(coincidencias / total, 4)
+    }
+
+
+def recomendar(filas, far_objetivo):
+    """Menor FRR con FAR e identificaciones erróneas dentro del objetivo; a
+    igual FRR, la que deja menos filas en la máscara doble (más rápida)."""
+    dentro = [f for f in filas if f["far"] <= far_objetivo and f["identificacion_erronea"] <= far_objetivo]
+    orden = sorted(dentro, key=lambda f: (f["frr"], f["filas_doble_por_consulta"], f["far"]))
+    equilibrio = min(filas, key=lambda f: (f["far"] + f["frr"] + f["identificacion_erronea"],
+                                           f["filas_doble_por_consulta"]))
+    return orden, equilibrio
+
+
+def formato_umbrales(u):
+    estricto = lambda v: f"{v:.2f}" if v <= 1 else "  — "
+    return (f"trad {u['umbral_tradicional']:.3f}  fr {u['umbral_fr']:.3f}  min {u['cantidad_minima']}  "
+            f"estr_trad {estricto(u['umbral_estricto_tradicional'])}  estr_fr {estricto(u['umbral_estricto_fr'])}")
+
+
+def imprimir_combinacion(titulo, fila):
+    print(f"  {titulo:14s} {formato_umbrales(fila['umbrales'])}")
+    print(f"  {'':14s} FRR {fila['frr']:.4f}  FAR {fila['far']:.4f}  errónea {fila['identificacion_erronea']:.4f}  "
+          f"filas doble/consulta {fila['filas_doble_por_consulta']:.1f}  "
+          f"usuarios {fila['usuarios_doble_por_consulta']:.1f}", end='')
+    if 'seleccion_p50_ms' in fila:
+        print(f"  selección p50 {fila['seleccion_p50_ms']:.3f} ms ({fila['consultas_por_s']:.0f}/s)  "
+              f"coincide {fila['coincidencia_con_evaluacion']:.2%}", end='')
+    print()
+
+
+def main():
+    args = parsear_argumentos()
+    actual = reconocimiento_config
+    grillas = (parsear_grilla(args.umbrales_trad, actual['umbral_tradicional']),
+               parsear_grilla(args.umbrales_fr, actual['umbral_fr']),
+               parsear_grilla(args.cantidades, actual['cantidad_minima']).astype(np.int64),
+               parsear_grilla(args.estrictos_trad, actual['umbral_estricto_tradicional']),
+               parsear_grilla(args.estrictos_fr, actual['umbral_estricto_fr']))
+
+    t0 = time.perf_counter()
+    usuarios, trad, fr, tiene_fr = cargar_galeria(args)
+    if trad is None or not tiene_fr.any():
+        print("No hay imágenes con embeddings para evaluar")
+        return
+    evaluacion = Evaluacion(usuarios, trad, fr, tiene_fr, grillas)
+    print(f"Galería: {len(usuarios)} imágenes de {evaluacion.n_usuarios} usuarios "
+          f"(cargada en {time.perf_counter() - t0:.1f} s); "
+          f"{len(evaluacion.consultas)} consultas, {int(evaluacion.genuina[evaluacion.consultas].sum())} genuinas")
+    print(f"Combinaciones evaluadas: {int(evaluacion.validas.sum())}")
+
+    t0 = time.perf_counter()
+    for inicio in range(0, len(evaluacion.consultas), args.bloque):
+        evaluacion.procesar(evaluacion.consultas[inicio:inicio + args.bloque])
+    duracion = time.perf_counter() - t0
+    pares = len(evaluacion.consultas) * len(usuarios)
+    print(f"Evaluación en {duracion:.1f} s ({pares / duracion / 1e6:.1f} M pares/s)")
+
+    # ---- Curvas por descriptor ----
+    h = evaluacion.hist
+    curvas = {
+        "tradicional": resumen_curva(h['trad_genuinos'], h['trad_impostores'],
+                                     np.unique(np.concatenate([grillas[0], grillas[3]])), args.far_objetivo),
+        "face_recognition": resumen_curva(h['fr_genuinos'], h['fr_impostores'],
+                                          np.unique(np.concatenate([grillas[1], grillas[4]])), args.far_objetivo)
+    }
+    print("\nPor par de imágenes (un solo descriptor):")
+    for nombre, c in curvas.items():
+        objetivo = (f"umbral para FAR <= {args.far_objetivo}: {c['umbral_far_objetivo']} (FRR {c['frr_en_far_objetivo']})"
+                    if c['umbral_far_objetivo'] is not None else f"FAR <= {args.far_objetivo} inalcanzable")
+        print(f"  {nombre:17s} EER {c['eer']:.4f} en {c['umbral_eer']:.3f}; {objetivo}")
+        print("    " + "  ".join(f"{u}: FAR {p['far']:.4f} FRR {p['frr']:.4f}" for u, p in c['puntos'].items()))
+
+    # Borrado por rostro: otras imágenes del mismo usuario que superan umbral_eliminar
+    colateral = np.cumsum(h['trad_genuinos'][::-1])[::-1] / max(h['trad_genuinos'].sum(), 1)
+    j_actual = bin_de_umbral(actual['umbral_eliminar'])
+    dentro = np.flatnonzero(colateral <= args.colateral_objetivo)
+    eliminar = {
+        "umbral_actual": actual['umbral_eliminar'],
+        "colateral_actual": round(float(colateral[j_actual]), 6) if j_actual < N_BINS else 0.0,
+        "umbral_recomendado": umbral_de_bin(int(dentro[0])) if len(dentro) else None
+    }
+    print(f"\nBorrado por rostro (umbral_eliminar {eliminar['umbral_actual']}): "
+          f"{eliminar['colateral_actual']:.2%} de las otras imágenes del mismo usuario lo superan; "
+          f"umbral mínimo para <= {args.colateral_objetivo:.0%}: {eliminar['umbral_recomendado']}")
+
+    # ---- Decisión completa (seleccionar_mejor_usuario) ----
+    filas = evaluacion.combinaciones()
+    por_indice = {f["indice"]: f for f in filas}
+    actual_fila = por_indice.get(evaluacion.indice_de(actual))
+    orden, equilibrio = recomendar(filas, args.far_objetivo)
+    rng = np.random.default_rng(0)
+    muestra = np.sort(rng.choice(evaluacion.consultas, min(args.medir, len(evaluacion.consultas)), replace=False))
+    reportadas = [('actual', actual_fila), ('equilibrio', equilibrio)]
+    if orden:
+        reportadas.insert(1, ('recomendada', orden[0]))
+    for _, fila in reportadas:
+        if fila is not None and 'seleccion_p50_ms' not in fila:
+            fila.update(medir_seleccion(evaluacion, fila, muestra))
+
+    print(f"\nDecisión completa ({evaluacion.n_genuinas} consultas genuinas, {evaluacion.n_impostoras} impostoras):")
+    for titulo, fila in reportadas:
+        if fila is not None:
+            imprimir_combinacion(titulo, fila)
+    if not orden:
+        print(f"  Ninguna combinación logra FAR e identificación errónea <= {args.far_objetivo}")
+    print(f"\nMejores {args.top} con FAR <= {args.far_objetivo}:")
+    for fila in orden[:args.top]:
+        print(f"  {formato_umbrales(fila['umbrales'])}   FRR {fila['frr']:.4f}  FAR {fila['far']:.4f}  "
+              f"filas doble {fila['filas_doble_por_consulta']:.1f}")
+
+    if args.salida:
+        with open(args.salida, 'w') as f:
+            json.dump({
+                "imagenes": len(usuarios), "usuarios": evaluacion.n_usuarios,
+                "consultas_genuinas": evaluacion.n_genuinas, "consultas_impostoras": evaluacion.n_impostoras,
+                "far_objetivo": args.far_objetivo,
+                "curvas": curvas,
+                "roc": {nombre: {"umbral": [umbral_de_bin(j) for j in range(N_BINS)],
+                                 "far": np.round(far, 6).tolist(), "frr": np.round(frr, 6).tolist()}
+                        for nombre, (far, frr) in (("tradicional", curva(h['trad_genuinos'], h['trad_impostores'])),
+                                                   ("face_recognition", curva(h['fr_genuinos'], h['fr_impostores'])))},
+                "eliminar": eliminar,
+                "actual": actual_fila, "recomendada": orden[0] if orden else None, "equilibrio": equilibrio,
+                "combinaciones": filas
+            }, f, indent=1)
+        print(f"\nResultados guardados en {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
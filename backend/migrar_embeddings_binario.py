@@ -0,0 +1,95 @@
+import sys
+import time
+
+from config import embeddings_config
+from utils.base_datos import conectar, ejecutar_lote
+from utils.codificacion_embeddings import codificar_embedding, decodificar_embedding, es_binario, columnas_no_binarias
+
+# Filas leídas y convertidas por lote
+TAMANO_LOTE = 500
+# Destino: el del argumento, el configurado si ya es binario o float32
+FORMATO = sys.argv[1] if len(sys.argv) > 1 else (
+    embeddings_config['formato'] if embeddings_config['formato'] != 'json' else 'float32')
+
+if FORMATO == 'json':
+    print("El formato destino debe ser binario ('float32' o 'float16')")
+    sys.exit(1)
+
+db = conectar()
+
+cursor = db.cursor()
+
+# Las columnas deben poder guardar bytes (TEXT no sirve para binario)
+for columna in columnas_no_binarias(db):
+    print(f"Convirtiendo columna {columna} a MEDIUMBLOB...")
+    cursor.execute(f"ALTER TABLE imagenes MODIFY {columna} MEDIUMBLOB NULL")
+db.commit()
+
+
+def tamano(valor):
+    return len(valor) if valor is not None else 0
+
+
+ultimo_id = 0
+convertidas = 0
+bytes_antes = 0
+bytes_despues = 0
+tiempo_carga_json = 0.0
+tiempo_carga_binario = 0.0
+inicio = time.time()
+
+while True:
+    # Paginación por clave: nunca relee filas ya procesadas
+    cursor.execute(
+        "SELECT id, embeddings, embedding_fr FROM imagenes WHERE id > %s ORDER BY id LIMIT %s",
+        (ultimo_id, TAMANO_LOTE)
+    )
+    lote = cursor.fetchall()
+    if not lote:
+        break
+    ultimo_id = lote[-1][0]
+
+    actualizaciones = []
+    for id_img, emb, emb_fr in lote:
+        if (emb is None or es_binario(emb)) and (emb_fr is None or es_binario(emb_fr)):
+            continue
+        try:
+            t0 = time.perf_counter()
+            vec = decodificar_embedding(emb)
+            vec_fr = decodificar_embedding(emb_fr)
+            tiempo_carga_json += time.perf_counter() - t0
+
+            nuevo = codificar_embedding(vec, FORMATO)
+            nuevo_fr = codificar_embedding(vec_fr, FORMATO)
+
+            t0 = time.perf_counter()
+            decodificar_embedding(nuevo)
+            decodificar_embedding(nuevo_fr)
+            tiempo_carga_binario += time.perf_counter() - t0
+        except Exception as e:
+            print(f"    [ERROR] id={id_img}: no se pudo convertir:", e)
+            continue
+
+        bytes_antes += tamano(emb) + tamano(emb_fr)
+        bytes_despues += tamano(nuevo) + tamano(nuevo_fr)
+        actualizaciones.append((nuevo, nuevo_fr, id_img))
+
+    if actualizaciones:
+        convertidas += ejecutar_lote(
+            db, "UPDATE imagenes SET embeddings=%s, embedding_fr=%s WHERE id=%s", actualizaciones
+        )
+    print(f"Lote hasta id={ultimo_id}: {len(actualizaciones)} filas convertidas")
+
+cursor.close()
+db.close()
+
+print(f"Filas convertidas a {FORMATO}: {convertidas} en {time.time() - inicio:.1f} s")
+if convertidas:
+    print(f"Bytes antes: {bytes_antes}  después: {bytes_despues}  "
+          f"ahorro: {bytes_antes - bytes_despues} ({100 * (1 - bytes_despues / bytes_antes):.1f}%)")
+    print(f"Tiempo de carga JSON: {tiempo_carga_json * 1000:.1f} ms  "
+          f"binario: {tiempo_carga_binario * 1000:.1f} ms  "
+          f"({tiempo_carga_json / max(tiempo_carga_binario, 1e-9):.1f}x más rápido)")
+if embeddings_config['formato'] != FORMATO:
+    print(f"Cambiar embeddings_config['formato'] a '{FORMATO}' en config.py para escribir en binario")
+print("¡Proceso finalizado!")
@@ -0,0 +1,162 @@
+import io
+import os
+import sqlite3
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# Los tests importan config, utils y app como lo hacen los scripts del backend
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND not in sys.path:
+    sys.path.insert(0, BACKEND)
+
+
+@pytest.fixture(scope='session')
+def modulo_app(tmp_path_factory):
+    """app.py importado una sola vez, con la cola de trabajos en un archivo
+    temporal (los hilos consumidores arrancan con la primera petición)."""
+    import config
+    config.trabajos_config['ruta_db'] = str(tmp_path_factory.mktemp('trabajos') / 'trabajos.db')
+    import app
+    return app
+
+
+# --------- Base de datos de prueba: SQLite con los marcadores %s de MySQL ----------
+ESQUEMA_PRUEBAS = [
+    """CREATE TABLE usuarios (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, nombre TEXT, apellido TEXT, codigo_unico TEXT, email TEXT,
+        requisitoriado INTEGER DEFAULT 0, fecha_registro TEXT DEFAULT CURRENT_TIMESTAMP)""",
+    """CREATE TABLE imagenes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, usuario_id INTEGER, imagen_path TEXT,
+        embeddings BLOB, embedding_fr BLOB, fecha_registro TEXT DEFAULT CURRENT_TIMESTAMP)""",
+]
+
+
+class CursorSqlite:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, parametros=()):
+        self._cursor.execute(sql.replace('%s', '?'), tuple(parametros))
+        return self._cursor.rowcount
+
+    def executemany(self, sql, filas):
+        self._cursor.executemany(sql.replace('%s', '?'), [tuple(f) for f in filas])
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+class ConexionSqlite:
+    """Lo que la app usa de una conexión PyMySQL, sobre un archivo SQLite."""
+
+    def __init__(self, ruta):
+        self._con = sqlite3.connect(ruta, timeout=10, check_same_thread=False)
+        self.cerrada = False
+
+    def cursor(self):
+        return CursorSqlite(self._con.cursor())
+
+    def execute(self, sql):
+        # _verificar() de utils.base_datos usa SELECT 1 si no hay ping()
+        if self.cerrada:
+            raise sqlite3.ProgrammingError("conexión cerrada")
+        return self._con.execute(sql)
+
+    def commit(self):
+        self._con.commit()
+
+    def rollback(self):
+        self._con.rollback()
+
+    def close(self):
+        self.cerrada = True
+        self._con.close()
+
+
+class BaseDePrueba:
+    def __init__(self, ruta):
+        self.ruta = str(ruta)
+        self.conexiones = []
+        with sqlite3.connect(self.ruta) as con:
+            for sentencia in ESQUEMA_PRUEBAS:
+                con.execute(sentencia)
+
+    def conectar(self):
+        con = ConexionSqlite(self.ruta)
+        self.conexiones.append(con)
+        return con
+
+    def consultar(self, sql, parametros=()):
+        with sqlite3.connect(self.ruta) as con:
+            return con.execute(sql.replace('%s', '?'), parametros).fetchall()
+
+
+@pytest.fixture
+def bd(tmp_path):
+    return BaseDePrueba(tmp_path / 'pruebas.db')
+
+
+# --------- Descriptores deterministas para las pruebas de rutas ----------
+class DescriptoresFalsos:
+    """Reemplaza a calcular_descriptores: cada imagen de prueba tiene
+    embeddings fijos registrados por el test."""
+
+    def __init__(self):
+        self.por_imagen = {}
+
+    def registrar(self, imagen_bytes, emb, emb_fr):
+        self.por_imagen[bytes(imagen_bytes)] = (np.asarray(emb, dtype=np.float64), np.asarray(emb_fr, dtype=np.float64))
+
+    def __call__(self, imagen_bytes, solo_tradicional=False):
+        emb, emb_fr = self.por_imagen[bytes(imagen_bytes)]
+        return emb, (None if solo_tradicional else emb_fr)
+
+
+def imagen_png(semilla, lado=32):
+    """Imagen de ruido distinta por semilla (dHash distinto)."""
+    gris = np.random.default_rng(semilla).integers(0, 256, (lado, lado), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(gris).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def descriptores():
+    return DescriptoresFalsos()
+
+
+@pytest.fixture
+def app_bd(modulo_app, bd, descriptores, tmp_path, monkeypatch):
+    """La app sobre la base SQLite, con índice y caches vacíos, uploads/ en
+    un directorio temporal y los descriptores de `descriptores`."""
+    from utils.base_datos import PoolConexiones
+    from utils.indice_embeddings import IndiceEmbeddings
+    from utils.busqueda_ann import BusquedaExacta
+    from utils.cache_resultados import CacheResultados
+    from utils.cache_usuarios import CacheUsuarios
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(modulo_app.mysql, 'pool', PoolConexiones(crear=bd.conectar, max_conexiones=4, timeout_s=5))
+    monkeypatch.setattr(modulo_app, 'indice', IndiceEmbeddings(fuente=modulo_app.leer_embeddings))
+    monkeypatch.setattr(modulo_app, 'busqueda', BusquedaExacta())
+    monkeypatch.setattr(modulo_app, 'cache_resultados', CacheResultados())
+    monkeypatch.setattr(modulo_app, 'cache_usuarios', CacheUsuarios())
+    monkeypatch.setattr(modulo_app, 'calcular_descriptores', descriptores)
+    return modulo_app
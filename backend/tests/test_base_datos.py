@@ -0,0 +1,139 @@
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+from utils.base_datos import BaseDatosFlask, PoolAgotado, PoolConexiones, ejecutar_lote
+
+
+def crear_pool(bd, **opciones):
+    opciones.setdefault('max_conexiones', 2)
+    opciones.setdefault('timeout_s', 5)
+    return PoolConexiones(crear=bd.conectar, **opciones)
+
+
+def usuarios(bd):
+    return [f[0] for f in bd.consultar("SELECT nombre FROM usuarios ORDER BY id")]
+
+
+# --------- Entrega y devolución ----------
+def test_reutiliza_la_conexion_devuelta(bd):
+    pool = crear_pool(bd)
+    con = pool.tomar()
+    pool.devolver(con)
+    assert pool.tomar() is con
+    otra = pool.tomar()
+    assert otra is not con
+    assert (pool.creadas, pool.reutilizadas) == (2, 1)
+
+
+def test_devolver_deshace_lo_no_confirmado(bd):
+    pool = crear_pool(bd)
+    con = pool.tomar()
+    con.cursor().execute("INSERT INTO usuarios (nombre) VALUES (%s)", ('sin commit',))
+    pool.devolver(con)
+    assert usuarios(bd) == []
+    # La misma conexión, ya reutilizada, tampoco lo ve
+    cursor = pool.tomar().cursor()
+    cursor.execute("SELECT COUNT(*) FROM usuarios")
+    assert cursor.fetchone() == (0,)
+
+
+def test_transaccion_confirma_o_deshace(bd):
+    pool = crear_pool(bd)
+    with pool.transaccion() as cursor:
+        cursor.execute("INSERT INTO usuarios (nombre) VALUES (%s)", ('Ana',))
+    with pytest.raises(ZeroDivisionError):
+        with pool.transaccion() as cursor:
+            cursor.execute("INSERT INTO usuarios (nombre) VALUES (%s)", ('Luis',))
+            1 / 0
+    assert usuarios(bd) == ['Ana']
+    # La conexión sigue viva: vuelve al pool en lugar de descartarse
+    assert pool.estadisticas()['libres'] == 1 and pool.descartadas == 0
+
+
+def test_ejecutar_lote_deshace_todo_si_falla(bd):
+    con = bd.conectar()
+    assert ejecutar_lote(con, "INSERT INTO usuarios (nombre) VALUES (%s)", [('a',), ('b',), ('c',)],
+                         tamano_lote=2) == 3
+    with pytest.raises(Exception):
+        ejecutar_lote(con, "INSERT INTO usuarios (id, nombre) VALUES (%s, %s)", [(10, 'd'), (1, 'repetido')])
+    assert usuarios(bd) == ['a', 'b', 'c']
+
+
+# --------- Verificación tras inactividad ----------
+def test_conexion_caida_se_reemplaza_tras_inactividad(bd):
+    pool = crear_pool(bd, verificar_tras_s=0)
+    con = pool.tomar()
+    pool.devolver(con)
+    con.close()                 # p. ej. el servidor cerró la conexión ociosa
+    nueva = pool.tomar()
+    assert nueva is not con
+    nueva.execute("SELECT 1")
+    assert (pool.creadas, pool.descartadas) == (2, 1)
+
+
+def test_conexion_reciente_no_se_verifica(bd):
+    pool = crear_pool(bd, verificar_tras_s=60)
+    con = pool.tomar()
+    pool.devolver(con)
+    verificaciones = []
+    con.execute = lambda sql: verificaciones.append(sql)
+    assert pool.tomar() is con and verificaciones == []
+
+
+# --------- Pool agotado ----------
+def test_pool_agotado_tras_el_timeout(bd):
+    pool = crear_pool(bd, max_conexiones=1, timeout_s=0.2)
+    con = pool.tomar()
+    t0 = time.perf_counter()
+    with pytest.raises(PoolAgotado):
+        pool.tomar()
+    assert 0.15 < time.perf_counter() - t0 < 1
+    pool.devolver(con)
+    assert pool.tomar() is con
+
+
+def test_espera_hasta_que_se_libera_una_conexion(bd):
+    pool = crear_pool(bd, max_conexiones=1, timeout_s=5)
+    con = pool.tomar()
+    tomada = {}
+    hilo = threading.Thread(target=lambda: tomada.setdefault('con', pool.tomar()))
+    hilo.start()
+    time.sleep(0.1)
+    assert 'con' not in tomada
+    pool.devolver(con)
+    hilo.join(timeout=5)
+    assert tomada['con'] is con
+
+
+# --------- Conexión por contexto de Flask ----------
+def test_flask_devuelve_la_conexion_al_cerrar_el_contexto(bd):
+    app = Flask(__name__)
+    pool = crear_pool(bd, max_conexiones=1, timeout_s=0.2)
+    mysql = BaseDatosFlask(app, pool=pool)
+    with app.app_context():
+        con = mysql.connection
+        assert mysql.connection is con
+        con.cursor().execute("INSERT INTO usuarios (nombre) VALUES (%s)", ('sin commit',))
+    assert pool.estadisticas()['libres'] == 1
+    assert usuarios(bd) == []
+    with app.app_context():
+        assert mysql.connection is con
+
+
+def test_flask_descarta_la_conexion_caida_tras_un_error(bd):
+    app = Flask(__name__)
+    pool = crear_pool(bd, max_conexiones=1)
+    mysql = BaseDatosFlask(app, pool=pool)
+
+    @app.route('/falla')
+    def falla():
+        mysql.connection.close()
+        raise RuntimeError("conexión perdida")
+
+    app.test_client().get('/falla')
+    assert pool.descartadas == 1 and pool.estadisticas()['libres'] == 0
+    with app.app_context():
+        mysql.connection.execute("SELECT 1")
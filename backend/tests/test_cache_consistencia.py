@@ -0,0 +1,207 @@
+import io
+import time
+
+import numpy as np
+import pytest
+
+from conftest import imagen_png
+
+# Ruido de cada imagen respecto de la persona: similitud ~0.93 con la
+# consulta (supera ambos umbrales) y ~0.86 entre imágenes (no son duplicados)
+RUIDO = 0.4
+
+
+class Persona:
+    """Embeddings sintéticos de una persona: cada imagen es la base más un
+    ruido ortogonal; la consulta es la base exacta."""
+
+    def __init__(self, descriptores, semilla):
+        self.descriptores = descriptores
+        self.rng = np.random.default_rng(semilla)
+        self.semilla = semilla
+        self.base = [self._unitario(64), self._unitario(128)]
+        self.n_imagenes = 0
+        self.consulta = imagen_png(semilla * 1000)
+        descriptores.registrar(self.consulta, *self.base)
+
+    def _unitario(self, dim):
+        v = self.rng.normal(size=dim)
+        return v / np.linalg.norm(v)
+
+    def imagen(self):
+        self.n_imagenes += 1
+        datos = imagen_png(self.semilla * 1000 + self.n_imagenes)
+        embeddings = []
+        for base in self.base:
+            ruido = self._unitario(len(base))
+            ruido -= (ruido @ base) * base
+            embeddings.append(base + RUIDO * ruido / np.linalg.norm(ruido))
+        self.descriptores.registrar(datos, *embeddings)
+        return datos
+
+
+def formulario(nombre, requisitoriado=False, imagen=None):
+    datos = {'nombre': nombre, 'apellido': 'Prueba', 'codigo_unico': f'C-{nombre}', 'email': f'{nombre}@x.pe',
+             'requisitoriado': 'true' if requisitoriado else 'false'}
+    if imagen is not None:
+        datos['imagen'] = (io.BytesIO(imagen), 'foto.jpg')
+    return datos
+
+
+@pytest.fixture
+def cliente(app_bd):
+    return app_bd.app.test_client()
+
+
+def registrar(cliente, nombre):
+    respuesta = cliente.post('/registrar_usuario', data=formulario(nombre))
+    assert respuesta.status_code == 200
+    return respuesta.get_json()['id_usuario']
+
+
+def editar(cliente, uid, nombre, imagen=None, requisitoriado=False):
+    respuesta = cliente.put(f'/editar_usuario/{uid}', data=formulario(nombre, requisitoriado, imagen),
+                            content_type='multipart/form-data')
+    assert respuesta.status_code == 200, respuesta.get_json()
+
+
+def agregar_por_trabajo(cliente, uid, imagen):
+    respuesta = cliente.post(f'/agregar_imagen/{uid}', data={'imagen': (io.BytesIO(imagen), 'foto.jpg')},
+                             content_type='multipart/form-data')
+    assert respuesta.status_code == 202
+    job_id = respuesta.get_json()['job_id']
+    fin = time.monotonic() + 15
+    while time.monotonic() < fin:
+        trabajo = cliente.get(f'/jobs/{job_id}').get_json()
+        if trabajo['estado'] in ('completado', 'fallido'):
+            assert trabajo['estado'] == 'completado', trabajo['error']
+            return trabajo['imagen_id']
+        time.sleep(0.05)
+    raise AssertionError(f"el trabajo {job_id} no terminó")
+
+
+def reconocer(cliente, persona):
+    respuesta = cliente.post('/reconocer_usuario', data={'imagen': (io.BytesIO(persona.consulta), 'foto.jpg')},
+                             content_type='multipart/form-data')
+    assert respuesta.status_code == 200
+    return respuesta.get_json()
+
+
+def verificar_consistencia(app_bd, cliente, bd, uid):
+    """Listado (cache por usuario), índice en memoria y tabla imagenes coinciden."""
+    en_bd = sorted(f[0] for f in bd.consultar("SELECT id FROM imagenes WHERE usuario_id=%s", (uid,)))
+    listado = sorted(i['id'] for i in cliente.get(f'/imagenes_usuario/{uid}').get_json())
+    en_indice = sorted(int(i) for i in app_bd.indice.ids[app_bd.indice.usuarios == uid])
+    assert listado == en_bd == en_indice
+    return en_bd
+
+
+def test_editar_datos_invalida_el_resultado_cacheado(app_bd, cliente, descriptores):
+    ana = Persona(descriptores, 1)
+    uid = registrar(cliente, 'Ana')
+    for _ in range(4):
+        editar(cliente, uid, 'Ana', ana.imagen())
+
+    resultado = reconocer(cliente, ana)
+    assert (resultado['usuario_id'], resultado['nombre'], resultado['metodo']) == (uid, 'Ana', 'doble')
+    assert reconocer(cliente, ana) == resultado
+    assert app_bd.cache_resultados.aciertos == 1
+
+    editar(cliente, uid, 'Beatriz', requisitoriado=True)
+    resultado = reconocer(cliente, ana)
+    assert resultado['nombre'] == 'Beatriz' and resultado['alerta'] is True
+
+
+def test_altas_y_bajas_intercaladas(app_bd, cliente, bd, descriptores):
+    ana, luis = Persona(descriptores, 2), Persona(descriptores, 3)
+    uid_ana, uid_luis = registrar(cliente, 'Ana'), registrar(cliente, 'Luis')
+
+    imagenes_ana = {}
+    for _ in range(4):
+        datos = ana.imagen()
+        editar(cliente, uid_ana, 'Ana', datos)
+        imagenes_ana[verificar_consistencia(app_bd, cliente, bd, uid_ana)[-1]] = datos
+        editar(cliente, uid_luis, 'Luis', luis.imagen())
+    assert reconocer(cliente, ana)['usuario_id'] == uid_ana
+    assert reconocer(cliente, luis)['usuario_id'] == uid_luis
+
+    # Alta por la cola de trabajos (otro hilo) mientras el resultado está en cache
+    datos = ana.imagen()
+    imagenes_ana[agregar_por_trabajo(cliente, uid_ana, datos)] = datos
+    assert len(verificar_consistencia(app_bd, cliente, bd, uid_ana)) == 5
+    assert reconocer(cliente, ana)['similitud_tradicional_promedio'] > 0
+
+    # Baja por id y baja por rostro: quedan 3 imágenes, menos que cantidad_minima
+    primera, segunda = sorted(imagenes_ana)[:2]
+    respuesta = cliente.delete(f'/imagenes_usuario/{uid_ana}', data={'imagen_id': str(primera)})
+    assert respuesta.status_code == 200
+    verificar_consistencia(app_bd, cliente, bd, uid_ana)
+    respuesta = cliente.delete(f'/imagenes_usuario/{uid_ana}',
+                               data={'imagen': (io.BytesIO(imagenes_ana[segunda]), 'foto.jpg')},
+                               content_type='multipart/form-data')
+    assert [e['id'] for e in respuesta.get_json()['eliminadas']] == [segunda]
+    assert len(verificar_consistencia(app_bd, cliente, bd, uid_ana)) == 3
+    assert reconocer(cliente, ana) == {"mensaje": "No se encontraron coincidencias."}
+    # Las bajas de Ana no invalidan mal a Luis
+    assert reconocer(cliente, luis)['usuario_id'] == uid_luis
+
+    # Otra alta: vuelve a reconocerse
+    editar(cliente, uid_ana, 'Ana', ana.imagen())
+    assert len(verificar_consistencia(app_bd, cliente, bd, uid_ana)) == 4
+    assert reconocer(cliente, ana)['usuario_id'] == uid_ana
+
+    # Borrar el usuario completo
+    assert cliente.delete(f'/eliminar_usuario/{uid_ana}').status_code == 200
+    assert verificar_consistencia(app_bd, cliente, bd, uid_ana) == []
+    assert reconocer(cliente, ana) == {"mensaje": "No se encontraron coincidencias."}
+
+
+def test_edicion_en_otro_proceso_invalida_el_cache(app_bd, cliente, bd, descriptores, tmp_path, monkeypatch):
+    from utils.galeria_compartida import GaleriaCompartida
+    from utils.indice_embeddings import IndiceEmbeddings
+
+    ana = Persona(descriptores, 4)
+    uid = registrar(cliente, 'Ana')
+    for _ in range(4):
+        editar(cliente, uid, 'Ana', ana.imagen())
+
+    # Este proceso pasa a usar la galería compartida (snapshot + registro)
+    ruta = str(tmp_path / 'galeria.snap')
+    app_bd.indice.cargado = False
+    monkeypatch.setattr(app_bd, 'galeria', GaleriaCompartida(ruta, app_bd.indice, app_bd.aplicar_cambio))
+    assert reconocer(cliente, ana)['nombre'] == 'Ana'
+    assert reconocer(cliente, ana)['nombre'] == 'Ana'
+    assert app_bd.cache_resultados.aciertos == 1
+
+    # Otro proceso edita el usuario: UPDATE en la base y cambio en el registro
+    otro = GaleriaCompartida(ruta, IndiceEmbeddings(), aplicar=lambda cambio: None)
+    assert otro.cargar()
+    bd.consultar("UPDATE usuarios SET nombre='Beatriz' WHERE id=%s", (uid,))
+    otro.registrar({'op': 'editar_usuario', 'usuario_id': uid})
+
+    assert reconocer(cliente, ana)['nombre'] == 'Beatriz'
+
+
+def test_backend_int8_recalcula_con_los_embeddings_de_la_base(app_bd, cliente, bd, descriptores, monkeypatch):
+    from config import busqueda_config
+
+    ana, luis = Persona(descriptores, 5), Persona(descriptores, 6)
+    uid_ana, uid_luis = registrar(cliente, 'Ana'), registrar(cliente, 'Luis')
+    for _ in range(4):
+        editar(cliente, uid_ana, 'Ana', ana.imagen())
+        editar(cliente, uid_luis, 'Luis', luis.imagen())
+
+    # Al recargar, el índice solo guarda la copia int8
+    monkeypatch.setitem(busqueda_config, 'backend', 'int8')
+    app_bd.indice.cargado = False
+    resultado = reconocer(cliente, ana)
+    assert (resultado['usuario_id'], resultado['metodo']) == (uid_ana, 'doble')
+    assert app_bd.busqueda.nombre == 'int8'
+    assert app_bd.indice.trad is None and len(app_bd.indice.trad_q.q) == 8
+
+    # Las altas y bajas posteriores también se recalculan desde la base
+    editar(cliente, uid_luis, 'Luis', luis.imagen())
+    assert reconocer(cliente, luis)['usuario_id'] == uid_luis
+    assert cliente.delete(f'/eliminar_usuario/{uid_ana}').status_code == 200
+    assert reconocer(cliente, ana) == {"mensaje": "No se encontraron coincidencias."}
+    verificar_consistencia(app_bd, cliente, bd, uid_luis)
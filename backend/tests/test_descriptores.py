@@ -0,0 +1,121 @@
+import io
+import os
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.descriptores_referencia import (
+    lbp_referencia, histograma_referencia, lpq_codigos_referencia, lpq_respuestas_referencia, lpq_referencia
+)
+from utils.face_utils import (
+    lbp_codigos, lbp_descriptor, lpq_codigos, lpq_descriptor, preparar_variantes, obtener_embeddings_lbp_lpq_hog
+)
+
+# Los códigos son idénticos; los histogramas y el embedding solo difieren por
+# el orden de las sumas en punto flotante
+TOLERANCIA = 1e-6
+UPLOADS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'uploads')
+FOTOS = ['BENITES.jpg', 'Sthefano4.jpg', 'fotaso.jpg', 'joe19.jpg', 'sthefano6.jpg']
+
+
+# --------- Implementación de referencia (la original) ----------
+def embedding_referencia(imagen_bytes):
+    from skimage.feature import hog
+    imagen_np = np.array(Image.open(io.BytesIO(imagen_bytes)).convert('L'))
+    imagen_np = cv2.equalizeHist(cv2.resize(imagen_np, (128, 128)))
+    fusiones = []
+    for variante in [imagen_np, cv2.flip(imagen_np, 1)]:
+        hog_vec = hog(variante.astype('float32') / 255.0, pixels_per_cell=(16, 16), cells_per_block=(2, 2),
+                      orientations=9, block_norm='L2-Hys', visualize=False)
+        fusiones.append(np.concatenate([
+            histograma_referencia(lbp_referencia(variante)),
+            lpq_referencia(variante, win_size=7),
+            hog_vec / (np.linalg.norm(hog_vec) + 1e-6)
+        ]))
+    promedio = np.mean(np.stack(fusiones), axis=0)
+    return promedio / np.linalg.norm(promedio)
+
+
+# --------- Imágenes fijas ----------
+def imagen_sintetica(semilla, lado=96, franja_plana=False):
+    rng = np.random.default_rng(semilla)
+    gris = rng.integers(0, 256, (lado, lado), dtype=np.uint8)
+    if franja_plana:
+        # Muchos vecinos iguales al centro: el caso >= del LBP. En una ventana
+        # 7x7 constante las respuestas LPQ son exactamente 0
+        gris[lado // 4:lado // 2, :] = 128
+    buffer = io.BytesIO()
+    Image.fromarray(gris).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def leer_foto(nombre):
+    ruta = os.path.join(UPLOADS, nombre)
+    if not os.path.exists(ruta):
+        pytest.skip(f"falta {ruta}")
+    with open(ruta, 'rb') as f:
+        return f.read()
+
+
+def cargar(nombre):
+    tipo, _, semilla = nombre.partition('-')
+    if tipo in ('ruido', 'plana'):
+        return imagen_sintetica(int(semilla), franja_plana=tipo == 'plana')
+    return leer_foto(nombre)
+
+
+IMAGENES = [f"ruido-{s}" for s in range(2)] + ["plana-0", "plana-1"] + FOTOS
+
+
+@pytest.fixture(params=IMAGENES)
+def imagen_bytes(request):
+    return cargar(request.param)
+
+
+# --------- Paridad ----------
+def test_lbp_codigos_identicos(imagen_bytes):
+    variantes = preparar_variantes(imagen_bytes)
+    for variante in variantes:
+        np.testing.assert_array_equal(lbp_codigos(variante), lbp_referencia(variante))
+    # La pila (N, H, W) da los mismos códigos que cada imagen por separado
+    np.testing.assert_array_equal(lbp_codigos(variantes), np.stack([lbp_referencia(v) for v in variantes]))
+
+
+def test_lbp_histograma_identico(imagen_bytes):
+    variantes = preparar_variantes(imagen_bytes)
+    esperados = np.stack([histograma_referencia(lbp_referencia(v)) for v in variantes])
+    np.testing.assert_array_equal(lbp_descriptor(variantes), esperados)
+    np.testing.assert_array_equal(lbp_descriptor(variantes[0]), esperados[0])
+
+
+def test_lpq_codigos_identicos(imagen_bytes):
+    variantes = preparar_variantes(imagen_bytes)
+    esperados = np.stack([lpq_codigos_referencia(v) for v in variantes])
+    np.testing.assert_array_equal(lpq_codigos(variantes), esperados)
+    np.testing.assert_array_equal(lpq_codigos(variantes[0]), esperados[0])
+
+
+def test_lpq_original_solo_difiere_en_respuestas_nulas(imagen_bytes):
+    # El código original toma el signo del redondeo cuando la respuesta es 0
+    for variante in preparar_variantes(imagen_bytes):
+        respuestas = lpq_respuestas_referencia(variante)
+        distintos = lpq_codigos_referencia(variante, ceros_exactos=False) != lpq_codigos(variante)
+        bits = (respuestas > 0) != ((lpq_codigos(variante)[..., np.newaxis] >> np.arange(8)) & 1).astype(bool)
+        assert np.array_equal(bits.any(axis=-1), distintos)
+        assert np.all(np.abs(respuestas[bits]) < 1e-9)
+
+
+def test_lpq_histograma(imagen_bytes):
+    variantes = preparar_variantes(imagen_bytes)
+    esperados = np.stack([lpq_referencia(v) for v in variantes])
+    np.testing.assert_allclose(lpq_descriptor(variantes), esperados, rtol=0, atol=TOLERANCIA)
+    np.testing.assert_allclose(lpq_descriptor(variantes[0]), esperados[0], rtol=0, atol=TOLERANCIA)
+
+
+def test_embedding_completo(imagen_bytes):
+    esperado = embedding_referencia(imagen_bytes)
+    obtenido = np.asarray(obtener_embeddings_lbp_lpq_hog(imagen_bytes))
+    assert obtenido.shape == esperado.shape
+    np.testing.assert_allclose(obtenido, esperado, rtol=0, atol=TOLERANCIA)
@@ -0,0 +1,130 @@
+import io
+import os
+import time
+
+import numpy as np
+import pytest
+
+import deduplicar_imagenes
+from conftest import imagen_png
+
+
+DATOS = {'nombre': 'Ana', 'apellido': 'Prueba', 'codigo_unico': 'C-1', 'email': 'ana@x.pe',
+         'requisitoriado': 'false'}
+
+
+def subir_en_edicion(cliente, uid, imagen):
+    datos = dict(DATOS, imagen=(io.BytesIO(imagen), 'foto.jpg'))
+    return cliente.put(f'/editar_usuario/{uid}', data=datos, content_type='multipart/form-data')
+
+
+def contenido_por_fila(bd, uid):
+    filas = bd.consultar("SELECT id, imagen_path FROM imagenes WHERE usuario_id=%s ORDER BY id", (uid,))
+    contenidos = {}
+    for imagen_id, ruta in filas:
+        with open(os.path.join('uploads', ruta), 'rb') as f:
+            contenidos[imagen_id] = f.read()
+    return contenidos
+
+
+def test_editar_con_el_mismo_nombre_no_pisa_ni_borra_archivos(app_bd, bd, descriptores):
+    cliente = app_bd.app.test_client()
+    uid = cliente.post('/registrar_usuario', data=DATOS).get_json()['id_usuario']
+    rng = np.random.default_rng(0)
+    imagenes = [imagen_png(k) for k in range(2)]
+    for datos in imagenes:
+        descriptores.registrar(datos, rng.normal(size=64), rng.normal(size=128))
+
+    # Dos fotos distintas subidas como "foto.jpg": cada fila con su archivo
+    for datos in imagenes:
+        assert subir_en_edicion(cliente, uid, datos).status_code == 200
+    assert list(contenido_por_fila(bd, uid).values()) == imagenes
+
+    # La repetida se rechaza sin escribir ni borrar archivos de otras filas
+    archivos = sorted(os.listdir(os.path.join('uploads', f'user_{uid}')))
+    assert subir_en_edicion(cliente, uid, imagenes[0]).status_code == 409
+    assert sorted(os.listdir(os.path.join('uploads', f'user_{uid}'))) == archivos
+    assert list(contenido_por_fila(bd, uid).values()) == imagenes
+
+
+def test_el_dhash_de_las_altas_no_se_relee_del_disco(app_bd, bd, descriptores, monkeypatch):
+    from utils import cache_usuarios
+    leidos = []
+    original = cache_usuarios.dhash_archivo
+    monkeypatch.setattr(cache_usuarios, 'dhash_archivo', lambda ruta: leidos.append(ruta) or original(ruta))
+
+    cliente = app_bd.app.test_client()
+    uid = cliente.post('/registrar_usuario', data=DATOS).get_json()['id_usuario']
+    rng = np.random.default_rng(1)
+    imagenes = [imagen_png(10 + k) for k in range(3)]
+    for datos in imagenes:
+        descriptores.registrar(datos, rng.normal(size=64), rng.normal(size=128))
+
+    # Cada alta invalida el cache del usuario, pero su dHash pasa a la próxima carga
+    for datos in imagenes:
+        assert subir_en_edicion(cliente, uid, datos).status_code == 200
+    assert subir_en_edicion(cliente, uid, imagenes[1]).status_code == 409
+    assert leidos == []
+
+    # Tras vaciar el cache, el primer duplicado vuelve a leer los archivos
+    monkeypatch.setattr(app_bd, 'cache_usuarios', cache_usuarios.CacheUsuarios())
+    assert subir_en_edicion(cliente, uid, imagenes[2]).status_code == 409
+    assert len(leidos) == 3
+
+
+def esperar_trabajo(cliente, job_id):
+    fin = time.monotonic() + 15
+    while time.monotonic() < fin:
+        trabajo = cliente.get(f'/jobs/{job_id}').get_json()
+        if trabajo['estado'] in ('completado', 'fallido'):
+            return trabajo
+        time.sleep(0.05)
+    raise AssertionError(f"el trabajo {job_id} no terminó")
+
+
+@pytest.mark.parametrize('motivo', ['duplicado', 'sin_caracteristicas', 'error_transitorio'])
+def test_trabajo_rechazado_no_deja_su_archivo(app_bd, descriptores, monkeypatch, motivo):
+    cliente = app_bd.app.test_client()
+    uid = cliente.post('/registrar_usuario', data=DATOS).get_json()['id_usuario']
+    rng = np.random.default_rng(2)
+    emb, emb_fr = rng.normal(size=64), rng.normal(size=128)
+    original, nueva = imagen_png(20), imagen_png(21)
+    descriptores.registrar(original, emb, emb_fr)
+    assert subir_en_edicion(cliente, uid, original).status_code == 200
+    carpeta = os.path.join('uploads', f'user_{uid}')
+    archivos = sorted(os.listdir(carpeta))
+
+    # dHash distinto: el rechazo llega recién en el trabajo
+    if motivo == 'duplicado':
+        descriptores.registrar(nueva, emb, emb_fr)
+    elif motivo == 'sin_caracteristicas':
+        monkeypatch.setattr(app_bd, 'calcular_descriptores', lambda imagen_bytes: (None, None))
+    else:
+        def falla(imagen_bytes):
+            raise RuntimeError("pool no disponible")
+        monkeypatch.setattr(app_bd, 'calcular_descriptores', falla)
+    respuesta = cliente.post(f'/agregar_imagen/{uid}', data={'imagen': (io.BytesIO(nueva), 'foto.jpg')},
+                             content_type='multipart/form-data')
+    assert esperar_trabajo(cliente, respuesta.get_json()['job_id'])['estado'] == 'fallido'
+
+    # Un error que no es un rechazo conserva el archivo para reprocesarlo
+    restantes = sorted(os.listdir(carpeta))
+    if motivo == 'error_transitorio':
+        assert len(restantes) == len(archivos) + 1
+    else:
+        assert restantes == archivos
+
+
+def test_deduplicar_no_borra_archivos_de_filas_conservadas(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('uploads/user_1')
+    for nombre in ('foto.jpg', 'otra.jpg'):
+        open(os.path.join('uploads/user_1', nombre), 'wb').close()
+    # Las filas 1 y 2 comparten archivo (con y sin el prefijo uploads/)
+    filas = [(1, 1, 'uploads/user_1/foto.jpg'), (2, 1, 'user_1/foto.jpg'), (3, 1, 'user_1/otra.jpg')]
+
+    assert deduplicar_imagenes.archivos_a_borrar(filas, {2}) == []
+    assert deduplicar_imagenes.archivos_a_borrar(filas, {2, 3}) == [
+        deduplicar_imagenes.ruta_normalizada('user_1/otra.jpg')]
+    assert deduplicar_imagenes.archivos_a_borrar(filas, {1, 2}) == [
+        deduplicar_imagenes.ruta_normalizada('user_1/foto.jpg')]
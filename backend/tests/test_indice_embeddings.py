@@ -0,0 +1,184 @@
+import numpy as np
+import pytest
+
+from utils.busqueda_ann import BusquedaCuantizada
+from utils.galeria_compartida import GaleriaCompartida
+from utils.indice_embeddings import IndiceEmbeddings
+
+UMBRAL_TRAD, UMBRAL_FR = 0.85, 0.60
+TOP_K = 5
+
+
+def galeria(n=2000, dim_trad=64, dim_fr=32, semilla=0):
+    rng = np.random.default_rng(semilla)
+    usuarios = np.arange(n) // 4
+    base_trad = rng.normal(size=(n // 4 + 1, dim_trad))
+    base_fr = rng.normal(size=(n // 4 + 1, dim_fr))
+    trad = base_trad[usuarios] + 0.3 * rng.normal(size=(n, dim_trad))
+    fr = base_fr[usuarios] + 0.5 * rng.normal(size=(n, dim_fr))
+    return (np.arange(1, n + 1), usuarios, [f"user_{u}/{i}.jpg" for i, u in enumerate(usuarios)],
+            trad, fr, np.ones(n, dtype=bool)), base_trad, base_fr
+
+
+def consultas(base_trad, base_fr, semilla=1, k=20):
+    rng = np.random.default_rng(semilla)
+    usuarios = rng.integers(0, len(base_trad) - 1, k)
+    return (base_trad[usuarios] + 0.2 * rng.normal(size=(k, base_trad.shape[1])),
+            base_fr[usuarios] + 0.3 * rng.normal(size=(k, base_fr.shape[1])))
+
+
+class BaseFalsa:
+    """Hace de la tabla imagenes: devuelve los embeddings sin normalizar por
+    id y recuerda qué ids se pidieron."""
+
+    def __init__(self, ids, trad, fr):
+        self.filas = {int(i): (t, f) for i, t, f in zip(ids, trad, fr)}
+        self.pedidos = []
+
+    def agregar(self, imagen_id, emb, emb_fr):
+        self.filas[imagen_id] = (emb, emb_fr)
+
+    def __call__(self, imagen_ids):
+        self.pedidos.extend(imagen_ids)
+        return [(i, *self.filas[i]) for i in imagen_ids if i in self.filas]
+
+
+def indices(arreglos):
+    """(índice float32 que nunca se cuantiza, índice int8 con su base falsa)."""
+    exacto = IndiceEmbeddings()
+    exacto.cargar_arreglos(*arreglos)
+    base = BaseFalsa(arreglos[0], arreglos[3], arreglos[4])
+    cuantizado = IndiceEmbeddings(fuente=base)
+    cuantizado.cargar_arreglos(*arreglos)
+    cuantizado.activar_cuantizacion()
+    return exacto, cuantizado, base
+
+
+def mejores(indice, q, q_fr, umbral_trad, umbral_fr, cuantizada):
+    """Por consulta: ids aceptados (ordenados por similitud tradicional) y sus similitudes."""
+    if cuantizada:
+        _, _, sim_trad, sim_fr, _ = BusquedaCuantizada(umbral_trad, umbral_fr).similitudes_lote(indice, q, q_fr)
+    else:
+        _, _, sim_trad, sim_fr, _ = indice.similitudes_lote(q, q_fr)
+    aceptadas = (sim_trad >= umbral_trad) | (sim_fr >= umbral_fr)
+    resultado = []
+    for k in range(len(q)):
+        filas = np.flatnonzero(aceptadas[k])
+        filas = filas[np.argsort(-sim_trad[k, filas], kind='stable')][:TOP_K]
+        resultado.append((indice.ids[filas], sim_trad[k, filas], sim_fr[k, filas]))
+    return aceptadas, resultado
+
+
+def comparar(exacto, cuantizado, q, q_fr, umbral_trad=UMBRAL_TRAD, umbral_fr=UMBRAL_FR):
+    aceptadas, esperados = mejores(exacto, q, q_fr, umbral_trad, umbral_fr, cuantizada=False)
+    obtenidas, resultados = mejores(cuantizado, q, q_fr, umbral_trad, umbral_fr, cuantizada=True)
+    np.testing.assert_array_equal(obtenidas, aceptadas)
+    for (ids, trad, fr), (ids_q, trad_q, fr_q) in zip(esperados, resultados):
+        np.testing.assert_array_equal(ids_q, ids)
+        np.testing.assert_allclose(trad_q, trad, atol=1e-6)
+        np.testing.assert_allclose(fr_q, fr, atol=1e-6)
+    return aceptadas
+
+
+def test_int8_solo_deja_en_memoria_la_copia_int8():
+    arreglos, _, _ = galeria(n=400, dim_trad=512, dim_fr=128)
+    exacto, cuantizado, _ = indices(arreglos)
+    assert cuantizado.trad is None and cuantizado.fr is None and cuantizado.resumen_trad is None
+    bytes_float32 = exacto.trad.nbytes + exacto.fr.nbytes
+    assert bytes_float32 / (cuantizado.trad_q.nbytes + cuantizado.fr_q.nbytes) > 3.8
+
+
+def test_int8_decide_y_ordena_igual_que_la_galeria_float32():
+    arreglos, base_trad, base_fr = galeria()
+    exacto, cuantizado, base = indices(arreglos)
+    q, q_fr = consultas(base_trad, base_fr)
+    assert comparar(exacto, cuantizado, q, q_fr).any()
+    # Solo se leyeron de la base las filas cercanas a los umbrales
+    assert 0 < len(base.pedidos) < len(exacto) // 10
+    # Una sola consulta va por el producto matriz-vector
+    comparar(exacto, cuantizado, q[:1], q_fr[:1])
+
+
+@pytest.mark.parametrize('lado', [-1, 1])
+def test_int8_umbral_pegado_a_un_puntaje_real(lado):
+    arreglos, base_trad, base_fr = galeria()
+    exacto, cuantizado, _ = indices(arreglos)
+    q, q_fr = consultas(base_trad, base_fr)
+    _, _, sim_trad, _, _ = exacto.similitudes_lote(q, q_fr)
+    # Un puntaje de una imagen del mismo usuario, con el umbral a un ulp de él
+    puntaje = np.float32(np.sort(sim_trad[0])[-2])
+    umbral = float(np.nextafter(puntaje, np.float32(lado * np.inf)))
+    aceptadas = comparar(exacto, cuantizado, q, q_fr, umbral_trad=umbral, umbral_fr=2.0)
+    assert aceptadas[0, np.flatnonzero(sim_trad[0] == puntaje)].all() == (lado < 0)
+
+
+def test_int8_altas_y_bajas():
+    arreglos, base_trad, base_fr = galeria(n=400)
+    exacto, cuantizado, base = indices(arreglos)
+    for indice in (exacto, cuantizado):
+        indice.agregar(10 ** 6, 10 ** 6, 'nueva.jpg', base_trad[0], base_fr[0])
+        indice.eliminar_imagenes([1, 2, 3])
+    base.agregar(10 ** 6, base_trad[0], base_fr[0])
+    assert cuantizado.trad is None and len(cuantizado.trad_q.q) == len(cuantizado) == 398
+    q, q_fr = consultas(base_trad, base_fr, k=5)
+    comparar(exacto, cuantizado, np.vstack([base_trad[:1], q]), np.vstack([base_fr[:1], q_fr]))
+    assert not {1, 2, 3} & set(base.pedidos)
+
+
+def test_int8_con_snapshot_mapeado_recalcula_desde_el_archivo(tmp_path):
+    arreglos, base_trad, base_fr = galeria(n=400)
+    exacto = IndiceEmbeddings()
+    exacto.cargar_arreglos(*arreglos)
+    GaleriaCompartida(str(tmp_path / 'galeria.snap'), exacto, aplicar=None).publicar()
+
+    base = BaseFalsa([], [], [])
+    cuantizado = IndiceEmbeddings(fuente=base)
+    cuantizado.activar_cuantizacion()
+    assert GaleriaCompartida(str(tmp_path / 'galeria.snap'), cuantizado, aplicar=None).cargar()
+    assert cuantizado.trad is None and isinstance(cuantizado.base[1], np.memmap)
+
+    # Las imágenes del snapshot se recalculan desde el archivo; la nueva, desde la base
+    for indice in (exacto, cuantizado):
+        indice.agregar(10 ** 6, 10 ** 6, 'nueva.jpg', base_trad[0], base_fr[0])
+    base.agregar(10 ** 6, base_trad[0], base_fr[0])
+    assert cuantizado.trad is None and len(cuantizado.trad_q.q) == 401
+    q, q_fr = consultas(base_trad, base_fr, k=5)
+    comparar(exacto, cuantizado, np.vstack([base_trad[:1], q]), np.vstack([base_fr[:1], q_fr]))
+    assert set(base.pedidos) == {10 ** 6}
+
+    # Al exportar (para el próximo snapshot) se arma la galería float32 completa
+    (_, _, _, trad, fr, _), resumen = cuantizado.exportar()
+    np.testing.assert_array_equal(trad, exacto.trad)
+    np.testing.assert_array_equal(fr, exacto.fr)
+    np.testing.assert_array_equal(resumen[0], exacto.resumen()[0])
+    np.testing.assert_allclose(resumen[1], exacto.resumen()[1], atol=1e-6)
+
+
+def test_publicar_elige_la_generacion_con_el_archivo_bloqueado(tmp_path, monkeypatch):
+    fcntl = pytest.importorskip('fcntl')
+    from utils import galeria_compartida
+    ruta = str(tmp_path / 'galeria.snap')
+    arreglos, _, _ = galeria(n=40)
+    indice = IndiceEmbeddings()
+    indice.cargar_arreglos(*arreglos)
+    primera = GaleriaCompartida(ruta, indice, aplicar=None)
+    assert primera.publicar()
+
+    bloqueada = []
+    original = galeria_compartida.leer_generacion
+
+    def leer(ruta_snapshot):
+        with open(f"{ruta}.lock", 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                fcntl.flock(f, fcntl.LOCK_UN)
+                bloqueada.append(False)
+            except BlockingIOError:
+                bloqueada.append(True)
+        return original(ruta_snapshot)
+
+    # Otro proceso (otra instancia, sin la generación en memoria) publica después
+    monkeypatch.setattr(galeria_compartida, 'leer_generacion', leer)
+    assert GaleriaCompartida(ruta, indice, aplicar=None).publicar()
+    assert bloqueada == [True]
+    assert original(ruta) == primera.generacion + 1
@@ -0,0 +1,87 @@
+import io
+
+import pytest
+
+from conftest import imagen_png
+from utils.listados import (CAMPOS_IMAGEN, CAMPOS_USUARIO, CURSOR_IMAGENES, ParametroInvalido,
+                            ParametrosListado, codificar_cursor, decodificar_cursor)
+
+
+# --------- Validación del cursor ----------
+@pytest.mark.parametrize('valores', [[7], [0]])
+def test_cursor_de_usuarios_valido(valores):
+    assert decodificar_cursor(codificar_cursor(valores)) == valores
+
+
+@pytest.mark.parametrize('texto', ['MQ', codificar_cursor(1), codificar_cursor([]), codificar_cursor([1, 2]),
+                                   codificar_cursor(['1']), codificar_cursor([True]), codificar_cursor([1.5]),
+                                   codificar_cursor({'id': 1}), 'no es base64!'])
+def test_cursor_de_usuarios_con_otra_forma(texto):
+    with pytest.raises(ParametroInvalido):
+        ParametrosListado({'cursor': texto}, CAMPOS_USUARIO)
+
+
+@pytest.mark.parametrize('valores', [['2024-01-01 10:00:00', 3], [None, 3]])
+def test_cursor_de_imagenes_valido(valores):
+    assert decodificar_cursor(codificar_cursor(valores), CURSOR_IMAGENES) == valores
+
+
+@pytest.mark.parametrize('valores', [[3], ['2024-01-01', '3'], [5, 3], ['2024-01-01', 3, 1]])
+def test_cursor_de_imagenes_con_otra_forma(valores):
+    with pytest.raises(ParametroInvalido):
+        ParametrosListado({'cursor': codificar_cursor(valores)}, CAMPOS_IMAGEN, CURSOR_IMAGENES)
+
+
+def test_requisitoriado_solo_donde_se_aplica():
+    assert ParametrosListado({'requisitoriado': '1'}, CAMPOS_USUARIO).requisitoriado is True
+    with pytest.raises(ParametroInvalido):
+        ParametrosListado({'requisitoriado': '1'}, CAMPOS_IMAGEN, CURSOR_IMAGENES, con_requisitoriado=False)
+
+
+# --------- Rutas ----------
+@pytest.fixture
+def cliente(app_bd, descriptores):
+    cliente = app_bd.app.test_client()
+    datos = {'nombre': 'Ana', 'apellido': 'Prueba', 'codigo_unico': 'C-1', 'email': 'ana@x.pe',
+             'requisitoriado': 'false'}
+    for _ in range(3):
+        uid = cliente.post('/registrar_usuario', data=datos).get_json()['id_usuario']
+    for k in range(3):
+        imagen = imagen_png(k)
+        descriptores.registrar(imagen, [float(k == j) for j in range(8)], [float(k == j) for j in range(4)])
+        respuesta = cliente.put(f'/editar_usuario/{uid}', data=dict(datos, imagen=(io.BytesIO(imagen), 'foto.jpg')),
+                                content_type='multipart/form-data')
+        assert respuesta.status_code == 200
+    cliente.uid = uid
+    return cliente
+
+
+def recorrer(cliente, ruta, clave):
+    vistos, cursor = [], None
+    while True:
+        pagina = cliente.get(ruta, query_string={'limite': 2, **({'cursor': cursor} if cursor else {})})
+        assert pagina.status_code == 200
+        vistos += [fila['id'] for fila in pagina.get_json()[clave]]
+        cursor = pagina.get_json()['siguiente']
+        if cursor is None:
+            return vistos
+
+
+def test_paginas_completas(cliente, bd):
+    assert recorrer(cliente, '/listar_usuarios', 'usuarios') == [1, 2, 3]
+    en_bd = [f[0] for f in bd.consultar("SELECT id FROM imagenes ORDER BY fecha_registro DESC, id DESC")]
+    assert len(en_bd) == 3
+    assert recorrer(cliente, f'/imagenes_usuario/{cliente.uid}', 'imagenes') == en_bd
+
+
+@pytest.mark.parametrize('ruta', ['/listar_usuarios', '/imagenes_usuario/3'])
+@pytest.mark.parametrize('cursor', ['MQ', codificar_cursor(['x']), codificar_cursor([None, 'x'])])
+def test_cursor_con_otra_forma_responde_400(cliente, ruta, cursor):
+    respuesta = cliente.get(ruta, query_string={'cursor': cursor})
+    assert respuesta.status_code == 400
+    assert respuesta.get_json() == {"mensaje": "cursor no válido"}
+
+
+def test_requisitoriado_en_imagenes_responde_400(cliente):
+    respuesta = cliente.get(f'/imagenes_usuario/{cliente.uid}', query_string={'requisitoriado': '1'})
+    assert respuesta.status_code == 400
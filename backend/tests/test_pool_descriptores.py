@@ -0,0 +1,118 @@
+import io
+import os
+import threading
+import time
+
+import pytest
+
+from utils import pool_descriptores
+from utils.pool_descriptores import PoolDescriptores, ColaLlena, TiempoAgotado
+
+FOTO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'uploads', 'BENITES.jpg')
+
+
+# Trabajo que corre dentro del proceso del pool
+def dormir(segundos):
+    time.sleep(segundos)
+    return os.getpid()
+
+
+@pytest.fixture(scope='module')
+def pool():
+    """Un proceso, un solo cupo y 1 s de timeout; ya precalentado para que
+    el arranque del proceso no cuente en los tiempos."""
+    pool = PoolDescriptores(procesos=1, max_en_cola=1, timeout_s=1)
+    pool.precalentar(timeout_s=120)
+    yield pool
+    pool.cerrar()
+
+
+def ocupar(pool, segundos):
+    """Lanza un trabajo en otro hilo y espera a que tome el cupo."""
+    empezado = threading.Event()
+    resultado = {}
+
+    def ejecutar():
+        empezado.set()
+        try:
+            resultado['pid'] = pool._ejecutar(dormir, segundos)
+        except Exception as e:
+            resultado['error'] = e
+
+    hilo = threading.Thread(target=ejecutar)
+    hilo.start()
+    empezado.wait()
+    time.sleep(0.1)
+    return hilo, resultado
+
+
+def esperar_cupo(pool, limite_s=10):
+    # El cupo vuelve cuando el trabajo termina de verdad en el proceso
+    fin = time.monotonic() + limite_s
+    while time.monotonic() < fin:
+        try:
+            return pool._ejecutar(dormir, 0)
+        except ColaLlena:
+            time.sleep(0.05)
+    raise AssertionError("el cupo del pool no se liberó")
+
+
+def test_trabajo_normal(pool):
+    assert isinstance(pool._ejecutar(dormir, 0), int)
+
+
+def test_cola_llena_rechaza_sin_esperar(pool):
+    hilo, resultado = ocupar(pool, 0.5)
+    t0 = time.perf_counter()
+    with pytest.raises(ColaLlena):
+        pool._ejecutar(dormir, 0)
+    assert time.perf_counter() - t0 < 0.05
+    hilo.join()
+    assert 'pid' in resultado
+    # Terminado el trabajo, el cupo vuelve a estar libre
+    assert isinstance(pool._ejecutar(dormir, 0), int)
+
+
+def test_timeout_conserva_el_cupo_hasta_que_termina(pool):
+    t0 = time.perf_counter()
+    with pytest.raises(TiempoAgotado):
+        pool._ejecutar(dormir, 2.5)
+    assert 0.9 < time.perf_counter() - t0 < 2
+    # El trabajo sigue corriendo en el proceso: no se admite otro
+    with pytest.raises(ColaLlena):
+        pool._ejecutar(dormir, 0)
+    esperar_cupo(pool)
+
+
+# --------- Respuestas HTTP de las rutas ----------
+@pytest.fixture
+def cliente(modulo_app, pool, monkeypatch):
+    monkeypatch.setattr(pool_descriptores, 'pool', pool)
+    monkeypatch.setitem(modulo_app.cache_config, 'habilitado', False)
+    return modulo_app.app.test_client()
+
+
+def subir(cliente):
+    with open(FOTO, 'rb') as f:
+        datos = f.read()
+    return cliente.post('/reconocer_usuario', data={'imagen': (io.BytesIO(datos), 'foto.jpg')},
+                        content_type='multipart/form-data')
+
+
+def test_ruta_responde_503_con_retry_after(cliente, pool, modulo_app):
+    hilo, _ = ocupar(pool, 0.5)
+    respuesta = subir(cliente)
+    hilo.join()
+    assert respuesta.status_code == 503
+    assert respuesta.headers['Retry-After'] == str(modulo_app.pool_config['retry_after_s'])
+
+
+def test_ruta_responde_504_si_el_trabajo_tarda(cliente, pool):
+    # Ninguna imagen real se procesa en 1 ms
+    timeout_s, pool.timeout_s = pool.timeout_s, 0.001
+    try:
+        respuesta = subir(cliente)
+    finally:
+        pool.timeout_s = timeout_s
+    assert respuesta.status_code == 504
+    esperar_cupo(pool)
@@ -0,0 +1,197 @@
+import io
+import json
+import os
+import struct
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils import pool_descriptores
+from utils.seguimiento import Seguidor, iou, leer_frames
+
+FOTO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'uploads', 'sthefano6.jpg')
+
+
+def caja(top, left, lado=100):
+    return (top, left + lado, top + lado, left)
+
+
+def avanzar(seguidor, cajas, frame, emb_fr=None):
+    """Un frame del seguidor; los tracks que lo piden reciben un embedding."""
+    asociaciones = seguidor.actualizar(cajas, frame)
+    for track, necesita in asociaciones:
+        if necesita:
+            fr = np.zeros(128) if emb_fr is None else emb_fr
+            track = seguidor.confirmar_identidad(track, fr, frame)
+            track.agregar_embeddings(np.ones(8), fr, frame)
+    return asociaciones
+
+
+# --------- Seguidor con cajas sintéticas ----------
+def test_iou():
+    assert iou(caja(0, 0), caja(0, 0)) == 1.0
+    assert iou(caja(0, 0), caja(0, 200)) == 0.0
+    assert iou(caja(0, 0), caja(0, 50)) == pytest.approx(50 * 100 / (2 * 100 * 100 - 50 * 100))
+
+
+def test_asociacion_por_iou_conserva_los_tracks():
+    seguidor = Seguidor(iou_minimo=0.3, cada_n=5)
+    ids = []
+    for frame in range(10):
+        # Dos rostros que se desplazan 5 px por frame
+        asociaciones = avanzar(seguidor, [caja(10, 10 + 5 * frame), caja(10, 300 - 5 * frame)], frame)
+        ids.append([t.id for t, _ in asociaciones])
+    assert ids == [[1, 2]] * 10
+    # Una caja lejos de todas abre un track nuevo
+    asociaciones = avanzar(seguidor, [caja(10, 60), caja(10, 250), caja(400, 400)], 10)
+    assert [t.id for t, _ in asociaciones] == [1, 2, 3]
+
+
+def test_embedding_al_aparecer_y_cada_n_frames():
+    seguidor = Seguidor(cada_n=4)
+    calculados = [frame for frame in range(13) if avanzar(seguidor, [caja(10, 10 + frame)], frame)[0][1]]
+    assert calculados == [0, 4, 8, 12]
+    assert seguidor.todos()[0].n_embeddings == 4
+
+
+def test_track_perdido_vence_y_reaparece_como_nuevo():
+    seguidor = Seguidor(max_perdidos=3)
+    avanzar(seguidor, [caja(10, 10)], 0)
+    for frame in range(1, 4):
+        avanzar(seguidor, [], frame)
+    assert len(seguidor.tracks) == 1          # 3 frames sin verse: sigue abierto
+    avanzar(seguidor, [], 4)
+    assert not seguidor.tracks and [t.id for t in seguidor.terminados] == [1]
+    asociaciones = avanzar(seguidor, [caja(10, 10)], 5)
+    assert asociaciones[0][0].id == 2
+
+
+def test_otra_persona_en_la_misma_caja_abre_otro_track():
+    seguidor = Seguidor(cada_n=1, distancia_maxima=0.6)
+    avanzar(seguidor, [caja(10, 10)], 0, emb_fr=np.zeros(128))
+    avanzar(seguidor, [caja(10, 10)], 1, emb_fr=np.full(128, 0.01))
+    assert list(seguidor.tracks) == [1]
+    avanzar(seguidor, [caja(10, 10)], 2, emb_fr=np.full(128, 1.0))
+    assert list(seguidor.tracks) == [2] and seguidor.terminados[0].id == 1
+
+
+def test_leer_frames():
+    cuerpo = b''.join(struct.pack('>I', len(d)) + d for d in [b'abc', b'', b'x' * 10])
+    assert list(leer_frames(io.BytesIO(cuerpo), 100)) == [b'abc', b'', b'x' * 10]
+    with pytest.raises(ValueError):
+        list(leer_frames(io.BytesIO(cuerpo[:-2]), 100))
+    with pytest.raises(ValueError):
+        list(leer_frames(io.BytesIO(cuerpo), 5))
+
+
+# --------- Secuencia de frames a partir de uploads/ ----------
+def secuencia(n_con_rostro, n_sin_rostro, n_reaparece, paso=4):
+    """Frames 400x300: el rostro de sthefano6.jpg se desplaza `paso` px por
+    frame, desaparece `n_sin_rostro` frames y vuelve a aparecer."""
+    if not os.path.exists(FOTO):
+        pytest.skip(f"falta {FOTO}")
+    rostro = Image.open(FOTO).convert('RGB')
+    rostro = rostro.resize((rostro.width * 3 // 5, rostro.height * 3 // 5))
+    frames = []
+    for k in range(n_con_rostro + n_sin_rostro + n_reaparece):
+        lienzo = Image.new('RGB', (400, 300), (90, 90, 90))
+        if k < n_con_rostro or k >= n_con_rostro + n_sin_rostro:
+            lienzo.paste(rostro, (20 + paso * k, 20))
+        buffer = io.BytesIO()
+        lienzo.save(buffer, format='JPEG', quality=90)
+        frames.append(buffer.getvalue())
+    return frames
+
+
+def cuerpo_video(frames):
+    return b''.join(struct.pack('>I', len(f)) + f for f in frames)
+
+
+@pytest.fixture
+def cliente(modulo_app, monkeypatch):
+    from utils.indice_embeddings import IndiceEmbeddings
+    from utils.busqueda_ann import BusquedaExacta
+    # Sin pool (mismo código, en el hilo) y con la galería vacía
+    monkeypatch.setattr(pool_descriptores, 'pool', None)
+    indice = IndiceEmbeddings()
+    indice.cargar([])
+    monkeypatch.setattr(modulo_app, 'indice', indice)
+    monkeypatch.setattr(modulo_app, 'busqueda', BusquedaExacta())
+    monkeypatch.setitem(modulo_app.video_config, 'cada_n_frames', 3)
+    monkeypatch.setitem(modulo_app.video_config, 'max_frames_perdido', 2)
+    return modulo_app.app.test_client()
+
+
+def lineas(respuesta):
+    return [json.loads(l) for l in respuesta.get_data(as_text=True).splitlines()]
+
+
+def test_reconocer_video_sigue_el_rostro(cliente):
+    frames = secuencia(n_con_rostro=7, n_sin_rostro=4, n_reaparece=2)
+    respuesta = cliente.post('/reconocer_video', data=cuerpo_video(frames))
+    assert respuesta.status_code == 200
+    *por_frame, final = lineas(respuesta)
+    assert [l['frame'] for l in por_frame] == list(range(len(frames)))
+
+    tracks = [[r['track'] for r in l['rostros']] for l in por_frame]
+    calculados = [[r['embedding_calculado'] for r in l['rostros']] for l in por_frame]
+    # Mismo track mientras se desplaza; embeddings en los frames 0, 3 y 6
+    assert tracks[:7] == [[1]] * 7
+    assert calculados[:7] == [[True], [False], [False], [True], [False], [False], [True]]
+    assert tracks[7:11] == [[]] * 4
+    # Tras más de max_frames_perdido frames sin rostro, vuelve como track nuevo
+    assert tracks[11:] == [[2], [2]] and calculados[11:] == [[True], [False]]
+
+    resumen = {t['track']: t for t in final['resumen']}
+    assert resumen[1]['embeddings'] == 3 and resumen[1]['ultimo_frame'] == 6
+    assert resumen[2]['embeddings'] == 1 and resumen[2]['primer_frame'] == 11
+
+
+def test_reconocer_video_usa_el_pool_y_omite_frames_sin_cupo(cliente, modulo_app, monkeypatch):
+    llamadas = []
+
+    def sin_cupo(imagen_bytes):
+        llamadas.append(len(imagen_bytes))
+        raise pool_descriptores.ColaLlena()
+
+    monkeypatch.setattr(modulo_app, 'detectar_rostros_frame', sin_cupo)
+    frames = secuencia(n_con_rostro=2, n_sin_rostro=0, n_reaparece=0) + [b'no es un jpeg']
+    *por_frame, final = lineas(cliente.post('/reconocer_video', data=cuerpo_video(frames)))
+    assert len(llamadas) == 3
+    assert all(l['omitido'] and l['reintentar_en_s'] == modulo_app.pool_config['retry_after_s']
+               for l in por_frame)
+    assert final == {"resumen": []}
+
+
+def test_reconocer_video_frame_invalido(cliente):
+    frames = [b'no es un jpeg'] + secuencia(n_con_rostro=1, n_sin_rostro=0, n_reaparece=0)
+    primero, segundo, final = lineas(cliente.post('/reconocer_video', data=cuerpo_video(frames)))
+    assert primero == {"frame": 0, "omitido": True, "mensaje": "No se pudo leer el frame"}
+    assert [r['track'] for r in segundo['rostros']] == [1]
+
+
+def test_reconocer_video_decodifica_cada_frame_una_vez(cliente, monkeypatch):
+    from utils import preprocesamiento
+    decodificados = []
+    original = preprocesamiento.ImagenPreprocesada.__init__
+
+    def contar(self, imagen_bytes, *args, **kwargs):
+        decodificados.append(len(imagen_bytes))
+        original(self, imagen_bytes, *args, **kwargs)
+
+    monkeypatch.setattr(preprocesamiento.ImagenPreprocesada, '__init__', contar)
+    frames = secuencia(n_con_rostro=4, n_sin_rostro=0, n_reaparece=0)
+    *por_frame, _ = lineas(cliente.post('/reconocer_video', data=cuerpo_video(frames)))
+    assert [[r['embedding_calculado'] for r in l['rostros']] for l in por_frame] == [[True], [False], [False], [True]]
+    assert decodificados == [len(f) for f in frames]
+
+
+def test_reconocer_video_informa_el_embedding_que_no_se_pudo_calcular(cliente, modulo_app, monkeypatch):
+    monkeypatch.setattr(modulo_app, 'calcular_descriptores_cajas',
+                        lambda pre, cajas: (np.full((len(cajas), 8), np.nan), np.zeros((len(cajas), 128))))
+    frames = secuencia(n_con_rostro=2, n_sin_rostro=0, n_reaparece=0)
+    *por_frame, final = lineas(cliente.post('/reconocer_video', data=cuerpo_video(frames)))
+    # El track lo pidió en ambos frames, pero ninguno llegó a calcularse
+    assert [[r['embedding_calculado'] for r in l['rostros']] for l in por_frame] == [[False], [False]]
+    assert final['resumen'][0]['embeddings'] == 0
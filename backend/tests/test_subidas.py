@@ -0,0 +1,53 @@
+import io
+
+import pytest
+
+from utils import pool_descriptores
+
+LIMITE = 4096
+
+
+@pytest.fixture
+def cliente(modulo_app, monkeypatch):
+    monkeypatch.setattr(pool_descriptores, 'pool', None)
+    monkeypatch.setitem(modulo_app.cache_config, 'habilitado', False)
+    monkeypatch.setitem(modulo_app.subidas_config, 'max_bytes', LIMITE)
+    return modulo_app.app.test_client()
+
+
+def formulario(*archivos):
+    partes = []
+    for k, datos in enumerate(archivos):
+        partes.append(b'--limite\r\nContent-Disposition: form-data; name="imagen%d"; filename="foto.jpg"\r\n'
+                      b'Content-Type: image/jpeg\r\n\r\n' % k + datos + b'\r\n')
+    return b''.join(partes).replace(b'name="imagen0"', b'name="imagen"') + b'--limite--\r\n'
+
+
+def subir(cliente, cuerpo, chunked):
+    if not chunked:
+        return cliente.post('/reconocer_usuario', data=cuerpo,
+                            content_type='multipart/form-data; boundary=limite')
+    # Sin Content-Length: el servidor solo sabe el tamaño leyendo el cuerpo
+    return cliente.post('/reconocer_usuario', input_stream=io.BytesIO(cuerpo),
+                        headers={'Content-Type': 'multipart/form-data; boundary=limite',
+                                 'Transfer-Encoding': 'chunked'},
+                        environ_overrides={'wsgi.input_terminated': True})
+
+
+@pytest.mark.parametrize('chunked', [False, True])
+def test_subida_dentro_del_limite_llega_a_la_ruta(cliente, chunked):
+    # No es una imagen: la ruta la rechaza con 400, no el límite de tamaño
+    respuesta = subir(cliente, formulario(b'x' * (LIMITE // 2)), chunked)
+    assert respuesta.status_code == 400
+
+
+@pytest.mark.parametrize('chunked', [False, True])
+def test_subida_que_supera_el_limite_responde_413(cliente, chunked):
+    respuesta = subir(cliente, formulario(b'x' * (LIMITE + 1)), chunked)
+    assert respuesta.status_code == 413
+    assert respuesta.get_json()['max_bytes'] == LIMITE
+
+
+def test_el_limite_cuenta_todos_los_archivos_del_formulario(cliente):
+    respuesta = subir(cliente, formulario(b'x' * (LIMITE // 2), b'y' * (LIMITE // 2 + 1)), chunked=True)
+    assert respuesta.status_code == 413
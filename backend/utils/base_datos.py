@@ -0,0 +1,204 @@
+import time
+import queue
+import threading
+from contextlib import contextmanager
+
+from config import db_config, db_pool_config
+
+
+# --------- Consultas frecuentes (parametrizadas, en un solo lugar) ----------
+SQL_CARGAR_GALERIA = "SELECT id, usuario_id, imagen_path, embeddings, embedding_fr FROM imagenes ORDER BY id"
+SQL_RESUMEN_GALERIA = "SELECT COUNT(*), MAX(id) FROM imagenes WHERE embeddings IS NOT NULL"
+SQL_DATOS_USUARIO = "SELECT nombre, apellido, codigo_unico, requisitoriado FROM usuarios WHERE id=%s"
+SQL_IMAGENES_USUARIO = """
+    SELECT id, imagen_path, fecha_registro, embeddings
+    FROM imagenes
+    WHERE usuario_id = %s
+    ORDER BY fecha_registro DESC, id DESC
+"""
+# {} se reemplaza por un %s por cada id
+SQL_EMBEDDINGS_POR_ID = "SELECT id, embeddings, embedding_fr FROM imagenes WHERE id IN ({})"
+SQL_INSERTAR_IMAGEN = """INSERT INTO imagenes (usuario_id, imagen_path, embeddings, embedding_fr)
+                         VALUES (%s, %s, %s, %s)"""
+
+
+class PoolAgotado(Exception):
+    """No se liberó ninguna conexión dentro de db_pool_config['timeout_s']."""
+
+
+def conectar():
+    """Conexión nueva a MySQL con los datos de db_config."""
+    import pymysql
+    return pymysql.connect(
+        host=db_config['host'],
+        user=db_config['user'],
+        password=db_config['password'],
+        database=db_config['database'],
+        autocommit=False
+    )
+
+
+def _verificar(con):
+    # PyMySQL reconecta con ping(); otros backends (sqlite3) con un SELECT 1
+    if hasattr(con, 'ping'):
+        con.ping(reconnect=True)
+    else:
+        con.execute("SELECT 1")
+
+
+# --------- Pool de conexiones acotado ----------
+class PoolConexiones:
+    """Hasta `max_conexiones` conexiones abiertas que se reutilizan entre
+    peticiones. Una conexión que estuvo ociosa más de `verificar_tras_s`
+    se verifica (ping) antes de entregarla; si falla se descarta y se abre
+    otra. `crear` es la fábrica de conexiones (conectar() por defecto)."""
+
+    def __init__(self, crear=None, max_conexiones=None, timeout_s=None, verificar_tras_s=None):
+        self.crear = crear or conectar
+        self.max_conexiones = max_conexiones or db_pool_config['max_conexiones']
+        self.timeout_s = timeout_s or db_pool_config['timeout_s']
+        self.verificar_tras_s = (db_pool_config['verificar_tras_s'] if verificar_tras_s is None
+                                 else verificar_tras_s)
+        # LIFO: se reutiliza primero la conexión usada más recientemente
+        self._libres = queue.LifoQueue()
+        self._cupos = threading.BoundedSemaphore(self.max_conexiones)
+        self.creadas = 0
+        self.reutilizadas = 0
+        self.descartadas = 0
+
+    def tomar(self):
+        if not self._cupos.acquire(timeout=self.timeout_s):
+            raise PoolAgotado()
+        try:
+            while True:
+                try:
+                    con, ultimo_uso = self._libres.get_nowait()
+                except queue.Empty:
+                    self.creadas += 1
+                    return self.crear()
+                if time.monotonic() - ultimo_uso < self.verificar_tras_s:
+                    self.reutilizadas += 1
+                    return con
+                try:
+                    _verificar(con)
+                    self.reutilizadas += 1
+                    return con
+                except Exception:
+                    self._cerrar(con)
+        except Exception:
+            self._cupos.release()
+            raise
+
+    def devolver(self, con, descartar=False):
+        """Devuelve la conexión al pool; lo que no se confirmó se deshace."""
+        try:
+            if not descartar:
+                con.rollback()
+        except Exception:
+            descartar = True
+        if descartar:
+            self._cerrar(con)
+        else:
+            self._libres.put((con, time.monotonic()))
+        self._cupos.release()
+
+    def _cerrar(self, con):
+        self.descartadas += 1
+        try:
+            con.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def conexion(self):
+        con = self.tomar()
+        try:
+            yield con
+        except Exception:
+            self.devolver(con, descartar=not _sigue_viva(con))
+            raise
+        self.devolver(con)
+
+    @contextmanager
+    def transaccion(self):
+        """Cursor dentro de una transacción: commit al salir, rollback si hay error."""
+        with self.conexion() as con:
+            cursor = con.cursor()
+            try:
+                yield cursor
+                con.commit()
+            finally:
+                cursor.close()
+
+    def estadisticas(self):
+        return {
+            "max_conexiones": self.max_conexiones,
+            "libres": self._libres.qsize(),
+            "creadas": self.creadas,
+            "reutilizadas": self.reutilizadas,
+            "descartadas": self.descartadas
+        }
+
+    def cerrar(self):
+        while True:
+            try:
+                con, _ = self._libres.get_nowait()
+            except queue.Empty:
+                return
+            self._cerrar(con)
+
+
+def _sigue_viva(con):
+    try:
+        _verificar(con)
+        return True
+    except Exception:
+        return False
+
+
+# --------- Escrituras por lotes ----------
+def ejecutar_lote(con, sql, filas, tamano_lote=500):
+    """executemany en bloques de `tamano_lote` filas y un solo commit al
+    final. Devuelve la cantidad de filas enviadas."""
+    filas = list(filas)
+    if not filas:
+        return 0
+    cursor = con.cursor()
+    try:
+        for inicio in range(0, len(filas), tamano_lote):
+            cursor.executemany(sql, filas[inicio:inicio + tamano_lote])
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    finally:
+        cursor.close()
+    return len(filas)
+
+
+# --------- Conexión por contexto de Flask ----------
+class BaseDatosFlask:
+    """Reemplazo de flask_mysqldb.MySQL sobre el pool: `mysql.connection`
+    toma una conexión del pool la primera vez que se usa en un contexto de
+    la app y la devuelve al cerrarse el contexto."""
+
+    def __init__(self, app=None, pool=None):
+        self.pool = pool or PoolConexiones()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.teardown_appcontext(self._liberar)
+
+    @property
+    def connection(self):
+        from flask import g
+        if 'conexion_bd' not in g:
+            g.conexion_bd = self.pool.tomar()
+        return g.conexion_bd
+
+    def _liberar(self, excepcion=None):
+        from flask import g
+        con = g.pop('conexion_bd', None)
+        if con is not None:
+            self.pool.devolver(con, descartar=excepcion is not None and not _sigue_viva(con))
@@ -0,0 +1,200 @@
+import os
+import threading
+import numpy as np
+
+from config import busqueda_config
+from utils.indice_embeddings import normalizar_filas
+
+
+# --------- K-means esférico (similitud coseno) ----------
+def asignar_listas(matriz, centroides, bloque=65536):
+    """Índice del centroide más cercano (mayor producto punto) para cada fila."""
+    asignacion = np.empty(len(matriz), dtype=np.int32)
+    for inicio in range(0, len(matriz), bloque):
+        asignacion[inicio:inicio + bloque] = np.argmax(matriz[inicio:inicio + bloque] @ centroides.T, axis=1)
+    return asignacion
+
+
+def kmeans_esferico(matriz, n_listas, iteraciones=20, semilla=0):
+    rng = np.random.default_rng(semilla)
+    n_listas = min(n_listas, len(matriz))
+    centroides = matriz[rng.choice(len(matriz), n_listas, replace=False)].copy()
+    for _ in range(iteraciones):
+        asignacion = asignar_listas(matriz, centroides)
+        sumas = np.zeros_like(centroides)
+        np.add.at(sumas, asignacion, matriz)
+        conteos = np.bincount(asignacion, minlength=n_listas)
+        vacias = conteos == 0
+        # Las listas vacías se reinician con puntos al azar
+        sumas[vacias] = matriz[rng.choice(len(matriz), int(vacias.sum()))]
+        centroides = normalizar_filas(sumas)
+    return centroides, asignar_listas(matriz, centroides)
+
+
+# --------- Índice IVF sobre los embeddings face_recognition ----------
+class IndiceIVF:
+    """Índice de archivo invertido: cada imagen pertenece a la lista de su
+    centroide más cercano y una consulta solo revisa las `n_sondeos` listas
+    más cercanas."""
+
+    def __init__(self, centroides, listas):
+        self.centroides = np.asarray(centroides, dtype=np.float32)
+        self.listas = [np.asarray(l, dtype=np.int64) for l in listas]
+        self._lock = threading.Lock()
+
+    @classmethod
+    def construir(cls, imagen_ids, matriz_fr, n_listas=None, iteraciones=20):
+        matriz_fr = normalizar_filas(matriz_fr)
+        imagen_ids = np.asarray(imagen_ids, dtype=np.int64)
+        # Regla habitual: ~sqrt(N) listas
+        n_listas = n_listas or max(1, int(np.sqrt(len(matriz_fr))))
+        centroides, asignacion = kmeans_esferico(matriz_fr, n_listas, iteraciones)
+        listas = [imagen_ids[asignacion == k] for k in range(len(centroides))]
+        return cls(centroides, listas)
+
+    def guardar(self, ruta):
+        tamanos = np.array([len(l) for l in self.listas], dtype=np.int64)
+        ids = np.concatenate(self.listas) if self.listas else np.zeros(0, dtype=np.int64)
+        temporal = ruta + '.tmp.npz'
+        np.savez(temporal, centroides=self.centroides, ids=ids, tamanos=tamanos)
+        os.replace(temporal, ruta)
+
+    @classmethod
+    def cargar(cls, ruta):
+        datos = np.load(ruta)
+        limites = np.cumsum(datos['tamanos'])[:-1]
+        return cls(datos['centroides'], np.split(datos['ids'], limites))
+
+    def __len__(self):
+        return sum(len(l) for l in self.listas)
+
+    def contiene(self):
+        with self._lock:
+            return np.concatenate(self.listas) if self.listas else np.zeros(0, dtype=np.int64)
+
+    def agregar(self, imagen_ids, matriz_fr):
+        if len(imagen_ids) == 0:
+            return
+        asignacion = asignar_listas(normalizar_filas(matriz_fr), self.centroides)
+        imagen_ids = np.asarray(imagen_ids, dtype=np.int64)
+        with self._lock:
+            for k in np.unique(asignacion):
+                self.listas[k] = np.concatenate([self.listas[k], imagen_ids[asignacion == k]])
+
+    def buscar(self, emb_fr, n_sondeos):
+        """imagen_ids de las listas más cercanas a la consulta (ordenados)."""
+        q = normalizar_filas(np.asarray(emb_fr)[np.newaxis])[0]
+        sims = self.centroides @ q
+        n_sondeos = min(n_sondeos, len(sims))
+        cercanas = np.argpartition(-sims, n_sondeos - 1)[:n_sondeos]
+        candidatos = np.concatenate([self.listas[k] for k in cercanas])
+        return np.sort(candidatos)
+
+
+# --------- Backends de búsqueda intercambiables ----------
+class BusquedaExacta:
+    """Fuerza bruta sobre toda la galería (comportamiento por defecto)."""
+    nombre = 'exacto'
+
+    def similitudes(self, indice, emb, emb_fr):
+        return indice.similitudes(emb, emb_fr)
+
+    def similitudes_lote(self, indice, embs, embs_fr):
+        return indice.similitudes_lote(embs, embs_fr)
+
+    def agregar(self, imagen_id, emb_fr):
+        pass
+
+
+class BusquedaIVF:
+    """Preselecciona candidatos con el índice IVF sobre face_recognition y
+    recalcula ambas similitudes (tradicional y fr) solo para ellos."""
+    nombre = 'ivf'
+
+    def __init__(self, ivf, n_sondeos):
+        self.ivf = ivf
+        self.n_sondeos = n_sondeos
+
+    def similitudes(self, indice, emb, emb_fr):
+        candidatos = self.ivf.buscar(emb_fr, self.n_sondeos)
+        return indice.similitudes(emb, emb_fr, imagen_ids=candidatos)
+
+    def similitudes_lote(self, indice, embs, embs_fr):
+        # Unión de los candidatos de cada consulta y un solo producto matriz-matriz
+        candidatos = np.unique(np.concatenate([self.ivf.buscar(q, self.n_sondeos) for q in embs_fr]))
+        return indice.similitudes_lote(embs, embs_fr, imagen_ids=candidatos)
+
+    def agregar(self, imagen_id, emb_fr):
+        if emb_fr is not None:
+            self.ivf.agregar([imagen_id], np.asarray(emb_fr)[np.newaxis])
+
+    def sincronizar(self, indice):
+        """Agrega al IVF las imágenes del índice que no estaban cuando se construyó."""
+        ids, _, _, _, fr, tiene_fr = indice.snapshot()
+        faltantes = tiene_fr & ~np.isin(ids, self.ivf.contiene())
+        if faltantes.any():
+            self.ivf.agregar(ids[faltantes], fr[faltantes])
+        return int(faltantes.sum())
+
+
+class BusquedaCascada:
+    """Dos etapas: primero compara la consulta contra el centroide de cada
+    usuario y luego evalúa imagen por imagen solo a los `top_usuarios`
+    mejores. La lógica de fallback decide igual que en la búsqueda exacta."""
+    nombre = 'cascada'
+
+    def __init__(self, top_usuarios):
+        self.top_usuarios = top_usuarios
+
+    def similitudes(self, indice, emb, emb_fr):
+        candidatos = indice.mejores_usuarios(emb, emb_fr, self.top_usuarios)
+        return indice.similitudes(emb, emb_fr, usuario_ids=candidatos)
+
+    def similitudes_lote(self, indice, embs, embs_fr):
+        candidatos = indice.mejores_usuarios(embs, embs_fr, self.top_usuarios)
+        return indice.similitudes_lote(embs, embs_fr, usuario_ids=candidatos)
+
+    def agregar(self, imagen_id, emb_fr):
+        # Los centroides se actualizan dentro de IndiceEmbeddings
+        pass
+
+
+class BusquedaCuantizada:
+    """Recorre la copia int8 de la galería y recalcula en float32 solo las
+    filas que podrían alcanzar los umbrales más bajos de la selección, así
+    que las decisiones son las de la búsqueda exacta."""
+    nombre = 'int8'
+
+    def __init__(self, umbral_trad, umbral_fr):
+        self.umbral_trad = umbral_trad
+        self.umbral_fr = umbral_fr
+
+    def similitudes(self, indice, emb, emb_fr):
+        usuarios, rutas, sim_trad, sim_fr, validos = self.similitudes_lote(indice, [emb], [emb_fr])
+        return usuarios, rutas, sim_trad[0], sim_fr[0], validos
+
+    def similitudes_lote(self, indice, embs, embs_fr):
+        return indice.similitudes_cuantizadas(embs, embs_fr, self.umbral_trad, self.umbral_fr)
+
+    def agregar(self, imagen_id, emb_fr):
+        # La copia int8 se actualiza dentro de IndiceEmbeddings
+        pass
+
+
+def crear_busqueda(indice):
+    """Crea el backend configurado en busqueda_config; si el índice IVF no
+    existe en disco se usa la búsqueda exacta."""
+    if busqueda_config['backend'] == 'int8':
+        indice.activar_cuantizacion()
+        return BusquedaCuantizada(busqueda_config['recalcular_desde_trad'], busqueda_config['recalcular_desde_fr'])
+    if busqueda_config['backend'] == 'cascada':
+        return BusquedaCascada(busqueda_config['top_usuarios'])
+    if busqueda_config['backend'] == 'ivf':
+        ruta = busqueda_config['ruta_indice_ivf']
+        if os.path.exists(ruta):
+            busqueda = BusquedaIVF(IndiceIVF.cargar(ruta), busqueda_config['n_sondeos'])
+            agregadas = busqueda.sincronizar(indice)
+            print(f"Índice IVF cargado: {len(busqueda.ivf)} imágenes ({agregadas} agregadas desde la construcción)")
+            return busqueda
+        print(f"No existe {ruta}; se usa búsqueda exacta (ejecutar construir_indice_ann.py)")
+    return BusquedaExacta()
@@ -0,0 +1,75 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+# --------- Cache LRU/TTL de reconocimientos por contenido de la imagen ----------
+class CacheResultados:
+    """Guarda, por hash de los bytes subidos, los embeddings calculados y la
+    respuesta final del reconocimiento.
+
+    La respuesta solo es válida mientras no cambie la galería: cada entrada
+    recuerda la `generacion` con la que se calculó y las rutas que modifican
+    usuarios o imágenes llaman a invalidar(). Si la generación cambió, los
+    embeddings se siguen aprovechando y solo se repite la comparación."""
+
+    def __init__(self, max_entradas=1024, ttl_s=300):
+        self.max_entradas = max_entradas
+        self.ttl_s = ttl_s
+        self.generacion = 0
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.aciertos_embeddings = 0
+        self.fallos = 0
+
+    @staticmethod
+    def clave(imagen_bytes, modo=''):
+        return hashlib.sha256(imagen_bytes).hexdigest() + ':' + modo
+
+    def obtener(self, clave):
+        """Devuelve (embeddings, resultado); resultado es None si la galería
+        cambió desde que se calculó. Devuelve None si no hay entrada vigente."""
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None or ahora - entrada[0] > self.ttl_s:
+                if entrada is not None:
+                    del self._datos[clave]
+                self.fallos += 1
+                return None
+            self._datos.move_to_end(clave)
+            _, generacion, embeddings, resultado = entrada
+            if generacion != self.generacion:
+                self.aciertos_embeddings += 1
+                return embeddings, None
+            self.aciertos += 1
+            return embeddings, resultado
+
+    def guardar(self, clave, embeddings, resultado, generacion):
+        # `generacion` es la que se leyó antes de comparar: si hubo una
+        # invalidación mientras tanto, la entrada nace ya desactualizada
+        with self._lock:
+            self._datos[clave] = (time.monotonic(), generacion, embeddings, resultado)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def invalidar(self):
+        with self._lock:
+            self.generacion += 1
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.aciertos + self.aciertos_embeddings + self.fallos
+            return {
+                "entradas": len(self._datos),
+                "max_entradas": self.max_entradas,
+                "ttl_s": self.ttl_s,
+                "generacion": self.generacion,
+                "aciertos": self.aciertos,
+                "aciertos_solo_embeddings": self.aciertos_embeddings,
+                "fallos": self.fallos,
+                "tasa_aciertos": round(self.aciertos / consultas, 4) if consultas else 0.0
+            }
@@ -0,0 +1,128 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+
+from utils.codificacion_embeddings import decodificar_embedding
+from utils.indice_embeddings import normalizar_filas
+from utils.duplicados import dhash_archivo, distancias_hamming
+
+
+# --------- Imágenes de un usuario ya decodificadas ----------
+class ImagenesUsuario:
+    """Metadatos de las imágenes de un usuario (en el orden de la consulta)
+    y la matriz normalizada de sus embeddings tradicionales. `filas_emb`
+    indica a qué imagen corresponde cada fila de `trad`: las imágenes sin
+    embedding se listan pero no se comparan.
+
+    `hashes_conocidos` ({imagen_id: dhash}) son los dHash ya calculados:
+    solo se lee del disco el archivo de las imágenes que no están ahí."""
+
+    def __init__(self, filas, hashes_conocidos=None):
+        self.ids = np.array([f[0] for f in filas], dtype=np.int64)
+        self.rutas = [f[1] for f in filas]
+        self.fechas = [f[2] for f in filas]
+        embeddings = [decodificar_embedding(f[3]) for f in filas]
+        dims = [len(e) for e in embeddings if e is not None]
+        dim = max(set(dims), key=dims.count) if dims else 0
+        self.filas_emb = np.array([k for k, e in enumerate(embeddings) if e is not None and len(e) == dim],
+                                  dtype=np.int64)
+        self.trad = normalizar_filas([embeddings[k] for k in self.filas_emb]) if len(self.filas_emb) else None
+        self._hashes = None
+        self._conocidos = hashes_conocidos or {}
+
+    def similitudes(self, emb):
+        """(filas, similitudes) de las imágenes comparables con `emb`."""
+        if self.trad is None or len(emb) != self.trad.shape[1]:
+            return self.filas_emb[:0], np.zeros(0, dtype=np.float32)
+        q = normalizar_filas(np.asarray(emb)[np.newaxis])[0]
+        return self.filas_emb, self.trad @ q
+
+    def hashes(self):
+        """(filas, dhashes) de las imágenes cuyo archivo se pudo leer; se
+        calculan la primera vez que se piden."""
+        if self._hashes is None:
+            valores = [self._conocidos[i] if i in self._conocidos else dhash_archivo(ruta)
+                       for i, ruta in zip(self.ids.tolist(), self.rutas)]
+            filas = np.array([k for k, h in enumerate(valores) if h is not None], dtype=np.int64)
+            self._hashes = (filas, np.array([valores[k] for k in filas], dtype=np.uint64))
+        return self._hashes
+
+    def hashes_conocidos(self):
+        """{imagen_id: dhash} de las imágenes actuales, sin leer archivos."""
+        if self._hashes is None:
+            return {i: self._conocidos[i] for i in self.ids.tolist() if i in self._conocidos}
+        filas, hashes = self._hashes
+        return dict(zip(self.ids[filas].tolist(), hashes.tolist()))
+
+    def duplicado_por_hash(self, h, distancia_maxima):
+        """imagen_id de la imagen más parecida por dHash, o None."""
+        filas, hashes = self.hashes()
+        if len(filas) == 0:
+            return None
+        distancias = distancias_hamming(h, hashes)
+        k = int(np.argmin(distancias))
+        return int(self.ids[filas[k]]) if distancias[k] <= distancia_maxima else None
+
+    def duplicado_por_embedding(self, emb, umbral):
+        """(imagen_id, similitud) de la imagen más parecida, o None."""
+        filas, sims = self.similitudes(emb)
+        if len(filas) == 0:
+            return None
+        k = int(np.argmax(sims))
+        return (int(self.ids[filas[k]]), float(sims[k])) if sims[k] >= umbral else None
+
+
+# --------- Cache por usuario con invalidación write-through ----------
+class CacheUsuarios:
+    """LRU de ImagenesUsuario por usuario_id. Las rutas que agregan o borran
+    imágenes llaman a invalidar(usuario_id).
+
+    Al invalidar se conservan los dHash ya calculados del usuario (más los
+    de las imágenes nuevas que se pasen): la próxima carga relee las filas
+    de la base pero no vuelve a abrir y decodificar cada archivo.
+
+    Cada usuario tiene un contador de versión: una carga que empezó antes de
+    una invalidación no se guarda, así una lectura lenta de la base de datos
+    no puede dejar en el cache un estado anterior al último cambio."""
+
+    def __init__(self, max_usuarios=256):
+        self.max_usuarios = max_usuarios
+        self._datos = OrderedDict()
+        self._versiones = {}
+        self._hashes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, usuario_id, cargar):
+        """cargar(usuario_id) -> filas (id, imagen_path, fecha_registro, embeddings)."""
+        with self._lock:
+            entrada = self._datos.get(usuario_id)
+            if entrada is not None:
+                self._datos.move_to_end(usuario_id)
+                return entrada
+            version = self._versiones.get(usuario_id, 0)
+            conocidos = self._hashes.get(usuario_id)
+        entrada = ImagenesUsuario(cargar(usuario_id), conocidos)
+        with self._lock:
+            if self._versiones.get(usuario_id, 0) == version:
+                self._hashes.pop(usuario_id, None)
+                self._datos[usuario_id] = entrada
+                while len(self._datos) > self.max_usuarios:
+                    self._datos.popitem(last=False)
+        return entrada
+
+    def invalidar(self, usuario_id, hashes=None):
+        """hashes: {imagen_id: dhash} de imágenes recién agregadas."""
+        with self._lock:
+            self._versiones[usuario_id] = self._versiones.get(usuario_id, 0) + 1
+            entrada = self._datos.pop(usuario_id, None)
+            conocidos = dict(self._hashes.pop(usuario_id, {}))
+            if entrada is not None:
+                conocidos.update(entrada.hashes_conocidos())
+            conocidos.update(hashes or {})
+            if conocidos:
+                self._hashes[usuario_id] = conocidos
+                while len(self._hashes) > self.max_usuarios:
+                    self._hashes.popitem(last=False)
+
+    def __len__(self):
+        return len(self._datos)
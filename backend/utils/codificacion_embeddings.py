@@ -0,0 +1,92 @@
+import json
+import struct
+import numpy as np
+
+from config import db_config, embeddings_config
+
+# ---- Formato binario de embeddings ----
+# Cabecera (8 bytes, little-endian) + datos crudos:
+#   b'EMB' | versión (uint8) | tipo (uint8) | dimensión (uint32)
+MAGIA = b'EMB'
+VERSION = 1
+CABECERA = struct.Struct('<3sBBI')
+TIPOS = {
+    1: np.dtype('<f4'),   # float32
+    2: np.dtype('<f2'),   # float16
+}
+CODIGOS = {'float32': 1, 'float16': 2}
+
+# Tipo de las columnas de embeddings (los formatos binarios necesitan BLOB)
+SQL_TIPOS_COLUMNAS = """
+    SELECT COLUMN_NAME, DATA_TYPE FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA=%s AND TABLE_NAME='imagenes' AND COLUMN_NAME IN ('embeddings', 'embedding_fr')
+"""
+
+# Formato con el que escribe este proceso: None hasta verificar las columnas
+# (se usa embeddings_config['formato']), 'json' si la base no está migrada
+_formato_forzado = None
+
+
+def columnas_no_binarias(conexion):
+    """Columnas de embeddings de la tabla imagenes que no son BLOB."""
+    cursor = conexion.cursor()
+    cursor.execute(SQL_TIPOS_COLUMNAS, (db_config['database'],))
+    tipos = cursor.fetchall()
+    cursor.close()
+    return [columna for columna, tipo in tipos if 'blob' not in str(tipo).lower()]
+
+
+def verificar_columnas(conexion):
+    """Con un formato binario configurado, revisa que las columnas sean
+    BLOB. Si la base todavía no se migró, este proceso sigue escribiendo
+    JSON (MySQL en modo estricto rechaza bytes en una columna TEXT).
+    Devuelve el formato con el que se escribirá."""
+    global _formato_forzado
+    formato = embeddings_config['formato']
+    _formato_forzado = formato
+    if formato != 'json':
+        columnas = columnas_no_binarias(conexion)
+        if columnas:
+            print(f"Columnas {', '.join(columnas)} sin migrar a BLOB: los embeddings se guardan en 'json' "
+                  f"en lugar de '{formato}' (ejecutar migrar_embeddings_binario.py)")
+            _formato_forzado = 'json'
+    return _formato_forzado
+
+
+def columnas_verificadas():
+    return _formato_forzado is not None
+
+
+def codificar_embedding(emb, formato=None):
+    """Serializa un embedding para guardarlo en la base de datos según
+    embeddings_config['formato'] ('float32', 'float16' o 'json')."""
+    if emb is None:
+        return None
+    formato = formato or _formato_forzado or embeddings_config['formato']
+    if formato == 'json':
+        return json.dumps([float(x) for x in emb])
+    codigo = CODIGOS[formato]
+    datos = np.asarray(emb).astype(TIPOS[codigo])
+    return CABECERA.pack(MAGIA, VERSION, codigo, datos.size) + datos.tobytes()
+
+
+def es_binario(valor):
+    return isinstance(valor, (bytes, bytearray, memoryview)) and bytes(valor[:3]) == MAGIA
+
+
+def decodificar_embedding(valor):
+    """Acepta tanto el formato JSON antiguo como el binario nuevo y devuelve
+    un np.ndarray (float32 para binario, float64 para JSON) o None."""
+    if valor is None:
+        return None
+    if isinstance(valor, (list, tuple, np.ndarray)):
+        return np.asarray(valor)
+    if es_binario(valor):
+        _, version, codigo, dim = CABECERA.unpack_from(valor)
+        if version != VERSION or codigo not in TIPOS:
+            raise ValueError(f"Formato de embedding no soportado (versión {version}, tipo {codigo})")
+        datos = np.frombuffer(valor, dtype=TIPOS[codigo], count=dim, offset=CABECERA.size)
+        return datos.astype(np.float32)
+    if isinstance(valor, memoryview):
+        valor = valor.tobytes()
+    return np.asarray(json.loads(valor), dtype=np.float64)
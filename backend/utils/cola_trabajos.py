@@ -0,0 +1,213 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Estados posibles de un trabajo
+PENDIENTE = 'pendiente'
+PROCESANDO = 'procesando'
+COMPLETADO = 'completado'
+FALLIDO = 'fallido'
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS trabajos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tipo TEXT NOT NULL,
+    usuario_id INTEGER NOT NULL,
+    imagen_path TEXT NOT NULL,
+    estado TEXT NOT NULL,
+    imagen_id INTEGER,
+    error TEXT,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    creado REAL NOT NULL,
+    actualizado REAL NOT NULL,
+    duenio TEXT,
+    vence REAL
+)
+"""
+COLUMNAS = ['id', 'tipo', 'usuario_id', 'imagen_path', 'estado', 'imagen_id',
+            'error', 'intentos', 'creado', 'actualizado', 'duenio', 'vence']
+# Columnas agregadas después de la primera versión de la tabla
+COLUMNAS_NUEVAS = {'duenio': 'TEXT', 'vence': 'REAL'}
+
+
+def duenio_actual():
+    """Proceso que toma un trabajo: host y pid."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class TrabajoReintentable(Exception):
+    """El trabajo no pudo procesarse ahora pero debe volver a la cola
+    (por ejemplo, el pool de descriptores está lleno)."""
+
+
+# --------- Cola de trabajos persistente (SQLite local) ----------
+class ColaTrabajos:
+    """Cola compartida por todos los procesos que abren el mismo archivo.
+
+    Un trabajo 'procesando' tiene dueño (host:pid) y un arriendo que vence
+    `arriendo_s` segundos después de la última renovación; el proceso
+    dueño lo renueva mientras viva (ver iniciar_workers). Solo un trabajo
+    con el arriendo vencido (su proceso murió) vuelve a tomarse, así que
+    reiniciar un worker no reencola lo que otros procesos siguen procesando."""
+
+    def __init__(self, ruta_db, arriendo_s=60):
+        self.ruta_db = ruta_db
+        self.arriendo_s = arriendo_s
+        self.nuevo = threading.Event()
+        with self._conectar() as con:
+            con.execute(ESQUEMA)
+            existentes = {fila[1] for fila in con.execute("PRAGMA table_info(trabajos)")}
+            for columna, tipo in COLUMNAS_NUEVAS.items():
+                if columna not in existentes:
+                    con.execute(f"ALTER TABLE trabajos ADD COLUMN {columna} {tipo}")
+            con.execute("CREATE INDEX IF NOT EXISTS idx_trabajos_estado ON trabajos (estado, id)")
+
+    @contextmanager
+    def _conectar(self):
+        # Modo autocommit: cada sentencia es su propia transacción salvo BEGIN explícito
+        con = sqlite3.connect(self.ruta_db, timeout=30, isolation_level=None)
+        try:
+            yield con
+        finally:
+            con.close()
+
+    def crear(self, tipo, usuario_id, imagen_path):
+        ahora = time.time()
+        with self._conectar() as con:
+            cur = con.execute(
+                "INSERT INTO trabajos (tipo, usuario_id, imagen_path, estado, creado, actualizado) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (tipo, usuario_id, imagen_path, PENDIENTE, ahora, ahora)
+            )
+            trabajo_id = cur.lastrowid
+        self.nuevo.set()
+        return trabajo_id
+
+    def obtener(self, trabajo_id):
+        with self._conectar() as con:
+            fila = con.execute(
+                f"SELECT {', '.join(COLUMNAS)} FROM trabajos WHERE id=?", (trabajo_id,)
+            ).fetchone()
+        return dict(zip(COLUMNAS, fila)) if fila else None
+
+    def tomar_siguiente(self):
+        """Marca como 'procesando' (a nombre de este proceso) el trabajo
+        pendiente más antiguo, o uno cuyo arriendo venció, y lo devuelve."""
+        ahora = time.time()
+        with self._conectar() as con:
+            con.execute("BEGIN IMMEDIATE")
+            fila = con.execute(
+                f"SELECT {', '.join(COLUMNAS)} FROM trabajos "
+                f"WHERE estado=? OR (estado=? AND COALESCE(vence, 0) < ?) ORDER BY id LIMIT 1",
+                (PENDIENTE, PROCESANDO, ahora)
+            ).fetchone()
+            if fila is None:
+                con.execute("COMMIT")
+                return None
+            duenio, vence = duenio_actual(), ahora + self.arriendo_s
+            con.execute(
+                "UPDATE trabajos SET estado=?, intentos=intentos+1, actualizado=?, duenio=?, vence=? WHERE id=?",
+                (PROCESANDO, ahora, duenio, vence, fila[0])
+            )
+            con.execute("COMMIT")
+            trabajo = dict(zip(COLUMNAS, fila))
+            trabajo.update(estado=PROCESANDO, intentos=trabajo['intentos'] + 1, duenio=duenio, vence=vence)
+            return trabajo
+
+    def renovar(self):
+        """Extiende el arriendo de los trabajos que este proceso está procesando."""
+        with self._conectar() as con:
+            cur = con.execute("UPDATE trabajos SET vence=? WHERE estado=? AND duenio=?",
+                              (time.time() + self.arriendo_s, PROCESANDO, duenio_actual()))
+            return cur.rowcount
+
+    def _actualizar(self, trabajo_id, estado, **campos):
+        campos.update(duenio=None, vence=None)
+        asignaciones = ', '.join(f"{k}=?" for k in campos)
+        sql = f"UPDATE trabajos SET estado=?, actualizado=?, {asignaciones} WHERE id=?"
+        with self._conectar() as con:
+            con.execute(sql, (estado, time.time(), *campos.values(), trabajo_id))
+
+    def completar(self, trabajo_id, imagen_id):
+        self._actualizar(trabajo_id, COMPLETADO, imagen_id=imagen_id, error=None)
+
+    def fallar(self, trabajo_id, error):
+        self._actualizar(trabajo_id, FALLIDO, error=str(error))
+
+    def devolver(self, trabajo_id):
+        # Vuelve a la cola sin contar como intento fallido
+        with self._conectar() as con:
+            con.execute("UPDATE trabajos SET estado=?, intentos=intentos-1, actualizado=?, duenio=NULL, vence=NULL "
+                        "WHERE id=?", (PENDIENTE, time.time(), trabajo_id))
+
+    def reprocesar(self, trabajo_id=None):
+        """Vuelve a encolar un trabajo fallido (o todos si trabajo_id es None).
+        Devuelve la cantidad de trabajos reencolados."""
+        with self._conectar() as con:
+            if trabajo_id is None:
+                cur = con.execute("UPDATE trabajos SET estado=?, error=NULL, actualizado=? WHERE estado=?",
+                                  (PENDIENTE, time.time(), FALLIDO))
+            else:
+                cur = con.execute("UPDATE trabajos SET estado=?, error=NULL, actualizado=? WHERE id=? AND estado=?",
+                                  (PENDIENTE, time.time(), trabajo_id, FALLIDO))
+            cantidad = cur.rowcount
+        if cantidad:
+            self.nuevo.set()
+        return cantidad
+
+    def recuperar_interrumpidos(self):
+        """Vuelve a la cola los trabajos 'procesando' cuyo arriendo venció
+        (su proceso se detuvo). Los de procesos vivos no se tocan.
+        Devuelve la cantidad recuperada."""
+        ahora = time.time()
+        with self._conectar() as con:
+            cur = con.execute(
+                "UPDATE trabajos SET estado=?, actualizado=?, duenio=NULL, vence=NULL "
+                "WHERE estado=? AND COALESCE(vence, 0) < ?",
+                (PENDIENTE, ahora, PROCESANDO, ahora)
+            )
+            cantidad = cur.rowcount
+        if cantidad:
+            self.nuevo.set()
+        return cantidad
+
+
+# --------- Hilos que consumen la cola ----------
+def iniciar_workers(cola, procesar, hilos=1, espera_reintento=2):
+    """Arranca `hilos` hilos daemon que llaman procesar(trabajo) -> imagen_id
+    y uno que renueva el arriendo de los trabajos de este proceso."""
+    cola.recuperar_interrumpidos()
+
+    def renovar():
+        while True:
+            time.sleep(cola.arriendo_s / 3)
+            try:
+                cola.renovar()
+            except Exception as e:
+                print("Error renovando el arriendo de los trabajos:", e)
+
+    def bucle():
+        while True:
+            trabajo = cola.tomar_siguiente()
+            if trabajo is None:
+                cola.nuevo.wait(timeout=1.0)
+                cola.nuevo.clear()
+                continue
+            try:
+                imagen_id = procesar(trabajo)
+                cola.completar(trabajo['id'], imagen_id)
+            except TrabajoReintentable:
+                cola.devolver(trabajo['id'])
+                time.sleep(espera_reintento)
+            except Exception as e:
+                print(f"Error procesando trabajo {trabajo['id']}:", e)
+                cola.fallar(trabajo['id'], e)
+
+    workers = [threading.Thread(target=bucle, daemon=True, name=f"trabajos-{i}") for i in range(hilos)]
+    workers.append(threading.Thread(target=renovar, daemon=True, name="trabajos-arriendo"))
+    for w in workers:
+        w.start()
+    return workers
@@ -0,0 +1,96 @@
+import numpy as np
+
+# Redondeo unitario de float32: acota el error de acumular los productos
+_U_F32 = float(np.finfo(np.float32).eps) / 2
+
+# Buffer float32 de cada bloque de filas en puntajes() (un cuarto de una L2 típica)
+BYTES_BLOQUE = 512 * 1024
+
+
+def _cuantizar(matriz, escalas, bloque=10000):
+    """int8 por dimensión (x ≈ escalas * q), la norma L1 de cada fila de q y
+    el error máximo de redondeo de cada fila en unidades de la escala (0.5
+    salvo que algún valor haya quedado recortado a ±127)."""
+    matriz = np.asarray(matriz, dtype=np.float32)
+    q = np.empty(matriz.shape, dtype=np.int8)
+    l1 = np.empty(len(matriz), dtype=np.float32)
+    error = np.empty(len(matriz), dtype=np.float32)
+    # Por bloques para no crear un temporal float del tamaño de la galería
+    for inicio in range(0, len(matriz), bloque):
+        escalado = matriz[inicio:inicio + bloque] / escalas
+        entero = np.clip(np.rint(escalado), -127, 127)
+        q[inicio:inicio + bloque] = entero
+        l1[inicio:inicio + bloque] = np.abs(entero).sum(axis=1)
+        error[inicio:inicio + bloque] = np.abs(escalado - entero).max(axis=1, initial=0.0)
+    return q, l1, error
+
+
+# --------- Galería en int8 con cota de error por fila ----------
+class MatrizCuantizada:
+    """Filas float cuantizadas a int8 con una escala por dimensión. Ocupa la
+    cuarta parte que la matriz float32 y cada puntaje viene con una cota del
+    error respecto del producto punto en float32, para saber qué filas hay
+    que recalcular antes de comparar contra un umbral."""
+
+    def __init__(self, q, escalas, l1, error):
+        self.q = q
+        self.escalas = escalas
+        self.l1 = l1
+        self.error = error
+
+    @classmethod
+    def desde(cls, matriz):
+        matriz = np.asarray(matriz, dtype=np.float32)
+        maximos = np.abs(matriz).max(axis=0, initial=0.0)
+        escalas = np.where(maximos > 0, maximos / 127, 1.0).astype(np.float32)
+        q, l1, error = _cuantizar(matriz, escalas)
+        return cls(q, escalas, l1, error)
+
+    def agregar(self, matriz):
+        """Nueva matriz con las filas agregadas (mismas escalas; lo que quede
+        fuera de rango se recorta y se refleja en el error de la fila)."""
+        q, l1, error = _cuantizar(matriz, self.escalas)
+        return MatrizCuantizada(np.vstack([self.q, q]), self.escalas,
+                                np.concatenate([self.l1, l1]), np.concatenate([self.error, error]))
+
+    def filas(self, indices):
+        return MatrizCuantizada(self.q[indices], self.escalas, self.l1[indices], self.error[indices])
+
+    @property
+    def nbytes(self):
+        return self.q.nbytes + self.escalas.nbytes + self.l1.nbytes + self.error.nbytes
+
+    def puntajes(self, consultas, bytes_bloque=BYTES_BLOQUE):
+        """Productos punto aproximados de K consultas normalizadas contra
+        todas las filas. Devuelve (aprox (K, N), cota (K, N)) con
+        |aprox - consultas @ filas.T| <= cota.
+
+        La consulta se multiplica por las escalas y se cuantiza a enteros con
+        una escala propia; el producto se hace con BLAS por bloques de filas
+        pasadas a float32 (los enteros caben exactos). El bloque se mide en
+        bytes y no en filas: la conversión es lo que más cuesta y conviene que
+        el bloque convertido quede en la caché L2 tanto con dim 128 como con
+        dim ~2300."""
+        consultas = np.atleast_2d(np.asarray(consultas, dtype=np.float32))
+        n, dim = self.q.shape
+        escalada = consultas * self.escalas
+        t = np.abs(escalada).max(axis=1) / 127
+        t[t == 0] = 1.0
+        p = np.rint(escalada / t[:, np.newaxis]).astype(np.float32)
+
+        bloque = max(1, bytes_bloque // (4 * dim))
+        enteros = np.empty((n, len(consultas)), dtype=np.float32)
+        p_t = np.ascontiguousarray(p.T)
+        for inicio in range(0, n, bloque):
+            np.matmul(self.q[inicio:inicio + bloque], p_t, dtype=np.float32,
+                      out=enteros[inicio:inicio + bloque])
+        aprox = enteros.T * t[:, np.newaxis]
+
+        # Error de redondear la consulta (t/2 por unidad de |q|), de
+        # redondear la galería (error * escala * |consulta|) y de acumular en
+        # float32 aquí y en la búsqueda exacta (dim * u por lado)
+        por_l1 = t * (0.5 + 127 * dim * _U_F32)
+        por_error = np.abs(consultas) @ self.escalas
+        cota = (por_l1[:, np.newaxis] * self.l1 + por_error[:, np.newaxis] * self.error
+                + 4 * dim * _U_F32)
+        return aprox, cota.astype(np.float32)
@@ -0,0 +1,87 @@
+import numpy as np
+
+# Implementaciones originales de los descriptores, píxel por píxel. No se
+# usan en las rutas: son la referencia de los tests de paridad y del modo
+# 'micro' de benchmark_backend.py, que las mide junto a las vectorizadas.
+
+
+# --------- LBP manual ----------
+def lbp_referencia(variante):
+    lbp = np.zeros_like(variante)
+    for i in range(1, variante.shape[0] - 1):
+        for j in range(1, variante.shape[1] - 1):
+            centro = variante[i, j]
+            binario = ''
+            binario += '1' if variante[i-1, j-1] >= centro else '0'
+            binario += '1' if variante[i-1, j  ] >= centro else '0'
+            binario += '1' if variante[i-1, j+1] >= centro else '0'
+            binario += '1' if variante[i  , j+1] >= centro else '0'
+            binario += '1' if variante[i+1, j+1] >= centro else '0'
+            binario += '1' if variante[i+1, j  ] >= centro else '0'
+            binario += '1' if variante[i+1, j-1] >= centro else '0'
+            binario += '1' if variante[i  , j-1] >= centro else '0'
+            lbp[i, j] = int(binario, 2)
+    return lbp
+
+
+def histograma_referencia(codigos):
+    hist, _ = np.histogram(codigos.ravel(), bins=256, range=(0, 256))
+    hist = hist.astype("float")
+    return hist / (hist.sum() + 1e-6)
+
+
+def lbp_descriptor_referencia(variante):
+    return histograma_referencia(lbp_referencia(variante))
+
+
+# --------- LPQ con convolve2d ----------
+def lpq_respuestas_referencia(image, win_size=7):
+    """(H', W', 8): partes reales e imaginarias de los 4 filtros."""
+    from scipy.signal import convolve2d
+    STFTalpha = 1.0 / win_size
+    x = np.arange(-(win_size // 2), win_size // 2 + 1)[np.newaxis]
+    w0 = np.ones_like(x)
+    w1 = np.exp(2 * np.pi * 1j * x * STFTalpha)
+    w2 = np.conj(w1)
+    filters = [w0.T @ w1, w1.T @ w0, w1.T @ w1, w1.T @ w2]
+    responses = [convolve2d(image, np.real(f), mode='valid') for f in filters]
+    responses += [convolve2d(image, np.imag(f), mode='valid') for f in filters]
+    return np.stack(responses, axis=-1)
+
+
+def lpq_ceros_referencia(image, win_size=7):
+    """(H', W', 8): True donde la respuesta es exactamente 0.
+
+    Se calcula con enteros: por cada filtro y cada fase k, convolve2d con un
+    kernel que vale 1 en los píxeles de fase k da c_k, y la respuesta es
+    sum_k c_k·e^(2πik/win). Con win primo es 0 solo en las simetrías que
+    se comprueban abajo."""
+    from scipy.signal import convolve2d
+    imagen = np.asarray(image, dtype=np.int64)
+    x = np.arange(-(win_size // 2), win_size // 2 + 1)
+    k = np.arange(1, win_size // 2 + 1)
+    reales, imaginarias = [], []
+    for a, b in ((0, 1), (1, 0), (1, 1), (1, -1)):
+        fase = (a * x[:, np.newaxis] + b * x[np.newaxis, :]) % win_size
+        c = np.stack([convolve2d(imagen, (fase == f).astype(np.int64), mode='valid')
+                      for f in range(win_size)], axis=-1)
+        reales.append(np.all(c[..., k] + c[..., win_size - k] == 2 * c[..., :1], axis=-1))
+        imaginarias.append(np.all(c[..., k] == c[..., win_size - k], axis=-1))
+    return np.stack(reales + imaginarias, axis=-1)
+
+
+def lpq_codigos_referencia(image, win_size=7, ceros_exactos=True):
+    """Códigos LPQ originales. Con ceros_exactos=False es el código tal
+    cual estaba: el bit de una respuesta nula sale del signo del error de
+    redondeo de convolve2d."""
+    codes = (lpq_respuestas_referencia(image, win_size) > 0).astype(np.uint8)
+    if ceros_exactos:
+        codes[lpq_ceros_referencia(image, win_size)] = 0
+    lpq_codes = np.zeros(codes.shape[:2], dtype=np.uint8)
+    for i in range(8):
+        lpq_codes += codes[:, :, i] << i
+    return lpq_codes
+
+
+def lpq_referencia(image, win_size=7, ceros_exactos=True):
+    return histograma_referencia(lpq_codigos_referencia(image, win_size, ceros_exactos))
@@ -0,0 +1,47 @@
+import io
+import os
+import numpy as np
+from PIL import Image
+
+
+class ImagenDuplicada(Exception):
+    """La imagen es un duplicado de otra ya registrada para el mismo usuario."""
+
+    def __init__(self, imagen_id, motivo):
+        super().__init__(f"Imagen duplicada de la imagen {imagen_id} ({motivo})")
+        self.imagen_id = imagen_id
+        self.motivo = motivo
+
+
+def resolver_ruta(imagen_path):
+    # /agregar_imagen guarda 'uploads/user_X/...' y /editar_usuario 'user_X/...'
+    if os.path.exists(imagen_path):
+        return imagen_path
+    return os.path.join("uploads", imagen_path)
+
+
+# --------- Hash perceptual (dHash de 64 bits) ----------
+def dhash(imagen, tam=8):
+    """dHash de bytes de imagen o de una ruta: compara cada píxel con su
+    vecino derecho en una miniatura de (tam+1)x tam en escala de grises."""
+    im = Image.open(io.BytesIO(imagen) if isinstance(imagen, (bytes, bytearray, memoryview)) else imagen)
+    # En JPEG, draft() decodifica directamente a una escala reducida
+    im.draft('L', (tam * 8, tam * 8))
+    miniatura = np.asarray(im.convert('L').resize((tam + 1, tam), Image.LANCZOS), dtype=np.int16)
+    bits = (miniatura[:, 1:] > miniatura[:, :-1]).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def distancias_hamming(h, hashes):
+    """Bits distintos entre el hash `h` y cada elemento de `hashes` (uint64)."""
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    xor = np.bitwise_xor(hashes, np.uint64(h))
+    return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def dhash_archivo(ruta):
+    # None si el archivo no existe o no se puede leer
+    try:
+        return dhash(resolver_ruta(ruta))
+    except Exception:
+        return None
@@ -1,9 +1,14 @@
-import cv2
 import numpy as np
 from PIL import Image
 import io
-from scipy.signal import convolve2d
-from skimage.feature import hog
+from functools import lru_cache
+
+from utils.metricas import etapa
+from utils.importacion_diferida import ModuloDiferido
+
+# cv2 y skimage se importan recién al calcular el primer descriptor
+cv2 = ModuloDiferido('cv2')
+skimage_feature = ModuloDiferido('skimage.feature')
 
 # ---- Normalizar Embedding ----
 def normalizar_embedding(emb):
@@ -13,46 +18,142 @@ def normalizar_embedding(emb):
         return emb
     return emb / norm
 
-# --------- LPQ Manual ----------
-def lpq_descriptor(image, win_size=7):
-    rho = 0.90
-    STFTalpha = 1.0 / win_size
-    conv_mode = 'valid'
-    x = np.arange(-(win_size // 2), win_size // 2 + 1)[np.newaxis]
-    w0 = np.ones_like(x)
-    w1 = np.exp(2 * np.pi * 1j * x * STFTalpha)
-    w2 = np.conj(w1)
-
-    # Filters
-    filters = [
-        w0.T @ w1,  # horizontal
-        w1.T @ w0,  # vertical
-        w1.T @ w1,  # diagonal /
-        w1.T @ w2,  # diagonal \
-    ]
-
-    # Apply filters and stack results
-    responses = [convolve2d(image, np.real(f), mode=conv_mode) for f in filters]
-    responses += [convolve2d(image, np.imag(f), mode=conv_mode) for f in filters]
-
-    # Quantization
-    responses = np.stack(responses, axis=-1)
-    codes = (responses > 0).astype(np.uint8)
-    lpq_codes = np.zeros(codes.shape[:2], dtype=np.uint8)
-    for i in range(8):
-        lpq_codes += codes[:, :, i] << i
-
-    # Histogram
-    hist, _ = np.histogram(lpq_codes.ravel(), bins=256, range=(0, 256))
+# --------- LBP Vectorizado ----------
+# Vecinos en el orden del bit más significativo al menos significativo:
+# arriba-izq, arriba, arriba-der, der, abajo-der, abajo, abajo-izq, izq
+LBP_VECINOS = [(-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1)]
+
+def lbp_codigos(imagenes):
+    """Códigos LBP de una imagen (H, W) o de una pila (N, H, W); el borde queda en 0."""
+    centro = imagenes[..., 1:-1, 1:-1]
+    alto, ancho = imagenes.shape[-2:]
+    lbp = np.zeros_like(imagenes)
+    codigos = np.zeros(centro.shape, dtype=np.uint8)
+    for peso, (di, dj) in zip(range(7, -1, -1), LBP_VECINOS):
+        vecino = imagenes[..., 1 + di:alto - 1 + di, 1 + dj:ancho - 1 + dj]
+        codigos |= (vecino >= centro).astype(np.uint8) << peso
+    lbp[..., 1:-1, 1:-1] = codigos
+    return lbp
+
+
+def histogramas_256(codigos):
+    """Histograma normalizado de 256 bins por imagen de una pila (N, H, W)."""
+    planos = codigos.reshape(len(codigos), -1).astype(np.int64)
+    desplazados = planos + 256 * np.arange(len(planos))[:, np.newaxis]
+    hist = np.bincount(desplazados.ravel(), minlength=256 * len(planos)).reshape(len(planos), 256)
     hist = hist.astype("float")
-    hist /= (hist.sum() + 1e-6)
+    hist /= (hist.sum(axis=1, keepdims=True) + 1e-6)
     return hist
 
+
+def lbp_descriptor(image):
+    """Histograma LBP normalizado; para una pila (N, H, W) devuelve (N, 256)."""
+    codigos = lbp_codigos(image)
+    hist = histogramas_256(codigos.reshape(-1, *codigos.shape[-2:]))
+    return hist[0] if codigos.ndim == 2 else hist
+
+# --------- LPQ Separable ----------
+# Exponente de frecuencia de cada vector 1D (vertical, horizontal) de los
+# filtros, en el orden original: horizontal, vertical, diagonal /, diagonal \\
+# (0 -> w0 = 1, 1 -> w1 = e^(2πi·x/win), -1 -> w2 = conj(w1))
+EXPONENTES_LPQ = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+# Respuestas por debajo de esto se revisan con aritmética entera (ver
+# anular_ceros_exactos); el ruido de redondeo de una respuesta nula es ~1e-13
+CASI_CERO_LPQ = 1e-6
+
+
+@lru_cache(maxsize=None)
+def filtros_lpq(win_size=7):
+    """Banco de filtros LPQ (se construye una vez por tamaño de ventana).
+
+    Cada filtro 2D es el producto exterior de dos vectores 1D, así que se
+    guarda como pares (vertical, horizontal) en el orden de EXPONENTES_LPQ."""
+    x = np.arange(-(win_size // 2), win_size // 2 + 1)
+    return tuple(tuple(np.exp(2 * np.pi * 1j * e * x / win_size) for e in par) for par in EXPONENTES_LPQ)
+
+
+@lru_cache(maxsize=None)
+def fases_lpq(win_size=7):
+    """(4, win, win): la fase k (múltiplo de 2π/win) con la que cada píxel de
+    la ventana entra en la respuesta de cada filtro, ya invertido el kernel
+    como en convolve2d."""
+    r = win_size // 2
+    u = np.arange(win_size)
+    return np.stack([(a * (r - u)[:, np.newaxis] + b * (r - u)[np.newaxis, :]) % win_size
+                     for a, b in EXPONENTES_LPQ])
+
+
+def anular_ceros_exactos(imagenes, partes, bits, win_size=7):
+    """Pone en 0 los bits de las respuestas que son exactamente 0.
+
+    Con píxeles enteros, una respuesta es sum_k c_k·e^(2πik/win), donde c_k
+    suma los píxeles de la ventana con fase k. Si win es primo, la parte
+    imaginaria es 0 solo si c_k == c_(win-k) y la real solo si todos los
+    c_k + c_(win-k) valen 2·c_0. En esas ventanas (zonas planas, simetrías)
+    el signo en punto flotante es ruido de redondeo y depende del orden de
+    las sumas; así el código no depende de él. Solo se revisan las
+    respuestas con |valor| < CASI_CERO_LPQ."""
+    if any(win_size % p == 0 for p in range(2, win_size)):
+        return
+    candidatos = np.flatnonzero(np.abs(partes) < CASI_CERO_LPQ)
+    if not len(candidatos):
+        return
+    posicion, parte = np.divmod(candidatos, 8)
+    posiciones, cual = np.unique(posicion, return_inverse=True)
+    ventanas = np.lib.stride_tricks.sliding_window_view(imagenes, (win_size, win_size), axis=(-2, -1))
+    ventanas = ventanas[np.unravel_index(posiciones, partes.shape[:-1])].reshape(len(posiciones), -1)
+    ventanas = ventanas.astype(np.float64)
+    # c[m, filtro, k] = suma de los píxeles de la ventana m con fase k en ese
+    # filtro. Son sumas de enteros chicos: en float64 son exactas y usan BLAS
+    por_fase = (fases_lpq(win_size).reshape(4, -1, 1) == np.arange(win_size)).astype(np.float64)
+    c = (ventanas @ por_fase.transpose(1, 0, 2).reshape(win_size * win_size, -1)).reshape(-1, 4, win_size)
+    c = c[cual, parte % 4]
+    k = np.arange(1, win_size // 2 + 1)
+    cero_imag = np.all(c[:, k] == c[:, win_size - k], axis=1)
+    cero_real = np.all(c[:, k] + c[:, win_size - k] == 2 * c[:, :1], axis=1)
+    bits.flat[candidatos[np.where(parte >= 4, cero_imag, cero_real)]] = False
+
+def convolucion_1d(imagenes, kernel, axis):
+    # Convolución 'valid' a lo largo de un eje (el kernel se invierte como en convolve2d)
+    ventanas = np.lib.stride_tricks.sliding_window_view(imagenes, len(kernel), axis=axis)
+    return ventanas @ kernel[::-1]
+
+
+def lpq_codigos(imagenes, win_size=7):
+    """Códigos LPQ de una imagen (H, W) o de una pila de imágenes (N, H, W)."""
+    originales = np.asarray(imagenes)
+    imagenes = originales.astype(np.float64)
+    eje_h, eje_v = imagenes.ndim - 1, imagenes.ndim - 2
+    respuestas_h = {}
+    respuestas = []
+    for vertical, horizontal in filtros_lpq(win_size):
+        # La pasada horizontal se comparte entre filtros con el mismo vector
+        clave = horizontal.tobytes()
+        if clave not in respuestas_h:
+            respuestas_h[clave] = convolucion_1d(imagenes, horizontal, eje_h)
+        respuestas.append(convolucion_1d(respuestas_h[clave], vertical, eje_v))
+
+    # Cuantización: bits 0-3 parte real, bits 4-7 parte imaginaria
+    partes = np.stack([np.real(r) for r in respuestas] + [np.imag(r) for r in respuestas], axis=-1)
+    bits = partes > 0
+    if np.issubdtype(originales.dtype, np.integer):
+        anular_ceros_exactos(originales, partes, bits, win_size)
+    pesos = (1 << np.arange(8)).astype(np.uint8)
+    return (bits.astype(np.uint8) * pesos).sum(axis=-1, dtype=np.uint8)
+
+
+def lpq_descriptor(image, win_size=7):
+    """Histograma LPQ normalizado; para una pila (N, H, W) devuelve (N, 256)."""
+    codigos = lpq_codigos(image, win_size)
+    hist = histogramas_256(codigos.reshape(-1, *codigos.shape[-2:]))
+    return hist[0] if codigos.ndim == 2 else hist
+
 # --------- HOG Descriptor ----------
 def hog_descriptor(image_np):
     image_np = image_np.astype('float32') / 255.0
-    features = hog(image_np, pixels_per_cell=(16, 16), cells_per_block=(2, 2),
-                   orientations=9, block_norm='L2-Hys', visualize=False)
+    features = skimage_feature.hog(image_np, pixels_per_cell=(16, 16), cells_per_block=(2, 2),
+                                   orientations=9, block_norm='L2-Hys', visualize=False)
     return features
 
 # --------- Simple Data Augmentation ----------
@@ -60,56 +161,69 @@ def augmentations(image_np):
     # Devuelve la imagen original y una volteada horizontal
     return [image_np, cv2.flip(image_np, 1)]
 
-# --------- Embeddings Fusionados LBP + LPQ + HOG + Augmentation ----------
-def obtener_embeddings_lbp_lpq_hog(imagen_bytes):
-    try:
-        imagen = Image.open(io.BytesIO(imagen_bytes)).convert('L')
-        imagen_np = np.array(imagen)
-
-        # Redimensionar y ecualizar
-        imagen_np = cv2.resize(imagen_np, (128, 128))
-        imagen_np = cv2.equalizeHist(imagen_np)
-
-        variantes = augmentations(imagen_np)
-        embeddings_list = []
-
+# --------- Preparación de cada imagen ----------
+def preparar_variantes(imagen):
+    """Bytes o arreglo en escala de grises -> pila (2, 128, 128) con la imagen
+    redimensionada y ecualizada y su versión volteada."""
+    if isinstance(imagen, np.ndarray):
+        imagen_np = imagen
+    else:
+        imagen_np = np.array(Image.open(io.BytesIO(imagen)).convert('L'))
+
+    # Redimensionar y ecualizar
+    imagen_np = cv2.resize(imagen_np, (128, 128))
+    imagen_np = cv2.equalizeHist(imagen_np)
+    return np.stack(augmentations(imagen_np))
+
+# --------- Embeddings Fusionados LBP + LPQ + HOG en lote ----------
+def obtener_embeddings_lote(imagenes, dtype=np.float32):
+    """Calcula el embedding LBP+LPQ+HOG de N imágenes (bytes o arreglos).
+
+    Las 2N variantes se apilan y LBP y LPQ se calculan sobre toda la pila;
+    HOG se calcula variante por variante con skimage.
+    Devuelve (matriz (N, D), errores) donde errores es {indice: mensaje} y
+    las filas de las imágenes que fallaron quedan en NaN."""
+    errores = {}
+    pilas = []
+    validos = []
+    for i, imagen in enumerate(imagenes):
+        try:
+            pilas.append(preparar_variantes(imagen))
+            validos.append(i)
+        except Exception as e:
+            errores[i] = f"No se pudo preparar la imagen: {e}"
+    if not validos:
+        return np.full((len(imagenes), 0), np.nan, dtype=dtype), errores
+
+    variantes = np.concatenate(pilas)                       # (2N, 128, 128)
+    with etapa('lbp'):
+        hist_lbp = lbp_descriptor(variantes)                # (2N, 256)
+    with etapa('lpq'):
+        hist_lpq = lpq_descriptor(variantes, win_size=7)    # (2N, 256)
+    hog_vecs = []
+    with etapa('hog'):
         for variante in variantes:
-            # --- LBP manual ---
-            lbp = np.zeros_like(variante)
-            for i in range(1, variante.shape[0] - 1):
-                for j in range(1, variante.shape[1] - 1):
-                    centro = variante[i, j]
-                    binario = ''
-                    binario += '1' if variante[i-1, j-1] >= centro else '0'
-                    binario += '1' if variante[i-1, j  ] >= centro else '0'
-                    binario += '1' if variante[i-1, j+1] >= centro else '0'
-                    binario += '1' if variante[i  , j+1] >= centro else '0'
-                    binario += '1' if variante[i+1, j+1] >= centro else '0'
-                    binario += '1' if variante[i+1, j  ] >= centro else '0'
-                    binario += '1' if variante[i+1, j-1] >= centro else '0'
-                    binario += '1' if variante[i  , j-1] >= centro else '0'
-                    lbp[i, j] = int(binario, 2)
-            hist_lbp, _ = np.histogram(lbp.ravel(), bins=256, range=(0, 256))
-            hist_lbp = hist_lbp.astype("float")
-            hist_lbp /= (hist_lbp.sum() + 1e-6)
-
-            # --- LPQ ---
-            hist_lpq = lpq_descriptor(variante, win_size=7)
-
-            # --- HOG ---
             hog_vec = hog_descriptor(variante)
-            hog_vec = hog_vec / (np.linalg.norm(hog_vec) + 1e-6)  # normaliza HOG
+            hog_vecs.append(hog_vec / (np.linalg.norm(hog_vec) + 1e-6))  # normaliza HOG
 
-            # --- Fusionar LBP + LPQ + HOG ---
-            fusion = np.concatenate([hist_lbp, hist_lpq, hog_vec])
-            embeddings_list.append(fusion)
+    # --- Fusionar LBP + LPQ + HOG y promediar las dos variantes ---
+    fusion = np.concatenate([hist_lbp, hist_lpq, np.stack(hog_vecs)], axis=1)
+    promedio = fusion.reshape(len(validos), 2, -1).mean(axis=1)
 
-        embeddings_final = np.mean(np.stack(embeddings_list), axis=0)
-        embeddings_final = normalizar_embedding(embeddings_final)
-        return embeddings_final.tolist()
+    matriz = np.full((len(imagenes), promedio.shape[1]), np.nan, dtype=dtype)
+    for fila, i in enumerate(validos):
+        matriz[i] = normalizar_embedding(promedio[fila])
+    return matriz, errores
+
+# --------- Embeddings Fusionados LBP + LPQ + HOG + Augmentation ----------
+def obtener_embeddings_lbp_lpq_hog(imagen):
+    # Acepta los bytes de la imagen o un arreglo en escala de grises ya decodificado
+    try:
+        matriz, errores = obtener_embeddings_lote([imagen], dtype=np.float64)
+        if errores:
+            raise ValueError(errores[0])
+        return matriz[0].tolist()
     except Exception as e:
         print("Error LBP+LPQ+HOG:", e)
         import traceback; traceback.print_exc()
         return None
-
-    
\ No newline at end of file
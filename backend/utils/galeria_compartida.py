@@ -0,0 +1,279 @@
+import os
+import json
+import base64
+import struct
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+from utils.codificacion_embeddings import codificar_embedding, decodificar_embedding
+
+try:
+    import fcntl
+except ImportError:     # Windows: sin bloqueo entre procesos (un solo worker)
+    fcntl = None
+
+# ---- Formato del snapshot ----
+# Cabecera (little-endian) y luego las secciones, cada una alineada a 64 bytes:
+#   b'GALE' | versión (uint16) | reservado (uint16) | generación (uint64) |
+#   n imágenes (uint64) | dim tradicional (uint32) | dim fr (uint32) |
+#   n usuarios del resumen (uint64) | bytes de las rutas (uint64)
+MAGIA = b'GALE'
+VERSION = 1
+CABECERA = struct.Struct('<4sHHQQIIQQ')
+ALINEACION = 64
+
+
+def _secciones(n, dim_trad, dim_fr, n_usuarios, bytes_rutas):
+    """[(nombre, dtype, forma)] en el orden en que están en el archivo."""
+    return [
+        ('ids', np.int64, (n,)),
+        ('usuarios', np.int64, (n,)),
+        ('tiene_fr', np.bool_, (n,)),
+        ('trad', np.float32, (n, dim_trad)),
+        ('fr', np.float32, (n, dim_fr)),
+        ('resumen_usuarios', np.int64, (n_usuarios,)),
+        ('resumen_trad', np.float32, (n_usuarios, dim_trad)),
+        ('resumen_fr', np.float32, (n_usuarios, dim_fr)),
+        ('resumen_tiene_fr', np.bool_, (n_usuarios,)),
+        ('rutas_inicios', np.int64, (n + 1,)),
+        ('rutas', np.uint8, (bytes_rutas,)),
+    ]
+
+
+def _alinear(posicion):
+    return -(-posicion // ALINEACION) * ALINEACION
+
+
+def escribir_snapshot(ruta, generacion, arreglos, resumen):
+    """Escribe la galería (ids, usuarios, rutas, trad, fr, tiene_fr ya
+    normalizados y ordenados por id) y su resumen por usuario en un archivo
+    temporal y lo reemplaza de forma atómica."""
+    ids, usuarios, rutas, trad, fr, tiene_fr = arreglos
+    codificadas = [str(r).encode('utf-8') for r in rutas]
+    inicios = np.zeros(len(codificadas) + 1, dtype=np.int64)
+    inicios[1:] = np.cumsum([len(c) for c in codificadas])
+    datos = {
+        'ids': ids, 'usuarios': usuarios, 'tiene_fr': tiene_fr, 'trad': trad, 'fr': fr,
+        'resumen_usuarios': resumen[0], 'resumen_trad': resumen[1],
+        'resumen_fr': resumen[2], 'resumen_tiene_fr': resumen[3],
+        'rutas_inicios': inicios, 'rutas': np.frombuffer(b''.join(codificadas), dtype=np.uint8),
+    }
+    secciones = _secciones(len(ids), trad.shape[1], fr.shape[1], len(resumen[0]), int(inicios[-1]))
+
+    temporal = f"{ruta}.tmp{os.getpid()}"
+    with open(temporal, 'wb') as f:
+        f.write(CABECERA.pack(MAGIA, VERSION, 0, generacion, len(ids), trad.shape[1], fr.shape[1],
+                              len(resumen[0]), int(inicios[-1])))
+        for nombre, dtype, forma in secciones:
+            f.write(b'\0' * (_alinear(f.tell()) - f.tell()))
+            arreglo = np.ascontiguousarray(datos[nombre], dtype=dtype).reshape(forma)
+            f.write(memoryview(arreglo).cast('B'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporal, ruta)
+
+
+def leer_generacion(ruta):
+    try:
+        with open(ruta, 'rb') as f:
+            cabecera = f.read(CABECERA.size)
+    except FileNotFoundError:
+        return None
+    if len(cabecera) < CABECERA.size or cabecera[:4] != MAGIA:
+        return None
+    return CABECERA.unpack(cabecera)[3]
+
+
+def leer_snapshot(ruta):
+    """Mapea el snapshot en memoria (solo lectura). Devuelve (generación,
+    arreglos, resumen); las matrices son vistas de un np.memmap y sus
+    páginas se comparten entre todos los procesos que abren el archivo."""
+    mapa = np.memmap(ruta, dtype=np.uint8, mode='r')
+    magia, version, _, generacion, n, dim_trad, dim_fr, n_usuarios, bytes_rutas = \
+        CABECERA.unpack(mapa[:CABECERA.size].tobytes())
+    if magia != MAGIA or version != VERSION:
+        raise ValueError(f"Snapshot de galería no soportado (versión {version})")
+    vistas = {}
+    posicion = CABECERA.size
+    for nombre, dtype, forma in _secciones(n, dim_trad, dim_fr, n_usuarios, bytes_rutas):
+        posicion = _alinear(posicion)
+        tamano = int(np.prod(forma)) * np.dtype(dtype).itemsize
+        vistas[nombre] = mapa[posicion:posicion + tamano].view(dtype).reshape(forma)
+        posicion += tamano
+
+    # Las rutas se decodifican a str (pocos bytes por imagen)
+    blob = vistas['rutas'].tobytes()
+    inicios = vistas['rutas_inicios'].tolist()
+    rutas = np.empty(n, dtype=object)
+    rutas[:] = [blob[a:b].decode('utf-8') for a, b in zip(inicios[:-1], inicios[1:])]
+    arreglos = (vistas['ids'], vistas['usuarios'], rutas, vistas['trad'], vistas['fr'], vistas['tiene_fr'])
+    resumen = (vistas['resumen_usuarios'], vistas['resumen_trad'], vistas['resumen_fr'], vistas['resumen_tiene_fr'])
+    return generacion, arreglos, resumen
+
+
+def descartar_snapshot(ruta):
+    """Borra el snapshot para que el próximo arranque cargue desde la base de datos."""
+    if os.path.exists(ruta):
+        os.remove(ruta)
+        print(f"Snapshot de galería {ruta} descartado")
+
+
+# ---- Registro de cambios posteriores al snapshot (una línea JSON por cambio) ----
+def _serializar(cambio):
+    cambio = dict(cambio)
+    for clave in ('emb', 'emb_fr'):
+        if cambio.get(clave) is not None:
+            cambio[clave] = base64.b64encode(codificar_embedding(cambio[clave], formato='float32')).decode('ascii')
+    return json.dumps(cambio) + '\n'
+
+
+def _deserializar(linea):
+    cambio = json.loads(linea)
+    for clave in ('emb', 'emb_fr'):
+        if cambio.get(clave) is not None:
+            cambio[clave] = decodificar_embedding(base64.b64decode(cambio[clave]))
+    return cambio
+
+
+# --------- Galería compartida entre procesos ----------
+class GaleriaCompartida:
+    """Mantiene un IndiceEmbeddings a partir de un snapshot mapeado con
+    np.memmap y del registro de cambios de su generación.
+
+    Los cambios de cualquier proceso se escriben en el registro
+    (registrar) y cada proceso los aplica al sincronizar, con `aplicar`
+    (idempotente: las altas de un id que ya está se ignoran). Cuando el
+    registro junta `max_cambios` cambios, un hilo escribe la generación
+    siguiente del snapshot y los procesos vuelven a mapearla."""
+
+    def __init__(self, ruta, indice, aplicar, max_cambios=200):
+        self.ruta = ruta
+        self.indice = indice
+        self.aplicar = aplicar
+        self.max_cambios = max_cambios
+        self.generacion = None
+        self.posicion = 0           # bytes del registro ya aplicados
+        self.cambios = 0            # cambios aplicados desde el snapshot
+        self._lock = threading.RLock()
+        self._reconstruyendo = False
+
+    def _registro(self, generacion):
+        return f"{self.ruta}.cambios-{generacion}"
+
+    @contextmanager
+    def _bloqueo(self):
+        # Serializa entre procesos las escrituras al registro y el reemplazo del snapshot
+        with open(f"{self.ruta}.lock", 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    # ---- Carga ----
+    def cargar(self):
+        """Mapea el snapshot y aplica su registro. False si no hay snapshot."""
+        with self._lock:
+            if leer_generacion(self.ruta) is None:
+                return False
+            generacion, arreglos, resumen = leer_snapshot(self.ruta)
+            self.indice.cargar_mapeado(*arreglos, resumen)
+            self.generacion, self.posicion, self.cambios = generacion, 0, 0
+            self._leer_registro()
+            return True
+
+    def publicar(self):
+        """Escribe el índice actual como una generación nueva (por ejemplo,
+        después de cargarlo desde la base de datos)."""
+        with self._lock:
+            arreglos, resumen = self.indice.exportar()
+            if arreglos[3] is None:
+                return False
+            # La generación se elige con el archivo bloqueado, como en
+            # _reconstruir: dos procesos que publican a la vez no escriben
+            # el mismo número
+            with self._bloqueo():
+                generacion = max(leer_generacion(self.ruta) or 0, self.generacion or 0) + 1
+                escribir_snapshot(self.ruta, generacion, arreglos, resumen)
+            self.generacion, self.posicion, self.cambios = generacion, 0, 0
+            return True
+
+    # ---- Cambios ----
+    def registrar(self, cambio):
+        """Agrega el cambio al registro de la generación vigente; este
+        proceso lo aplica en el próximo sincronizar(), como los demás."""
+        with self._bloqueo():
+            generacion = leer_generacion(self.ruta) or self.generacion
+            if generacion is None:
+                # Todavía no hay snapshot: nadie más lee el registro
+                self.aplicar(cambio)
+                return
+            with open(self._registro(generacion), 'a', encoding='utf-8') as f:
+                f.write(_serializar(cambio))
+
+    def sincronizar(self):
+        """Aplica los cambios nuevos del registro o vuelve a mapear el
+        snapshot si otro proceso publicó una generación nueva. Devuelve True
+        si se volvió a mapear."""
+        with self._lock:
+            generacion = leer_generacion(self.ruta)
+            recargado = generacion is not None and generacion != self.generacion
+            if recargado:
+                self.cargar()
+            else:
+                self._leer_registro()
+            reconstruir = self.cambios >= self.max_cambios and not self._reconstruyendo
+            if reconstruir:
+                self._reconstruyendo = True
+        if reconstruir:
+            threading.Thread(target=self._reconstruir, daemon=True, name="snapshot-galeria").start()
+        return recargado
+
+    def _leer_registro(self):
+        try:
+            with open(self._registro(self.generacion), 'rb') as f:
+                f.seek(self.posicion)
+                datos = f.read()
+        except FileNotFoundError:
+            return
+        # Solo líneas completas (otro proceso puede estar escribiendo)
+        fin = datos.rfind(b'\n') + 1
+        for linea in datos[:fin].splitlines():
+            self.aplicar(_deserializar(linea))
+            self.cambios += 1
+        self.posicion += fin
+
+    # ---- Reconstrucción en segundo plano ----
+    def _reconstruir(self):
+        try:
+            with self._lock:
+                arreglos, resumen = self.indice.exportar()
+                generacion, posicion = self.generacion, self.posicion
+            # La escritura (lo lento) no bloquea a los demás
+            temporal = f"{self.ruta}.nuevo{os.getpid()}"
+            escribir_snapshot(temporal, generacion + 1, arreglos, resumen)
+            with self._bloqueo():
+                if leer_generacion(self.ruta) != generacion:
+                    # Otro proceso ya publicó una generación más nueva
+                    os.remove(temporal)
+                    return
+                # Lo que se registró después de copiar el índice pasa al registro nuevo
+                try:
+                    with open(self._registro(generacion), 'rb') as f:
+                        f.seek(posicion)
+                        pendientes = f.read()
+                except FileNotFoundError:
+                    pendientes = b''
+                with open(self._registro(generacion + 1), 'wb') as f:
+                    f.write(pendientes[:pendientes.rfind(b'\n') + 1])
+                os.replace(temporal, self.ruta)
+                if os.path.exists(self._registro(generacion)):
+                    os.remove(self._registro(generacion))
+            print(f"Snapshot de galería: generación {generacion + 1} ({len(arreglos[0])} imágenes)")
+        except Exception as e:
+            print("Error reconstruyendo el snapshot de la galería:", e)
+        finally:
+            self._reconstruyendo = False
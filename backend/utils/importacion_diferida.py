@@ -0,0 +1,40 @@
+import time
+import importlib
+import threading
+
+# Segundos que tardó cada import diferido (para /metrics y /health/ready)
+tiempos_importacion = {}
+_lock = threading.Lock()
+
+
+# --------- Módulos que se importan al usarlos ----------
+class ModuloDiferido:
+    """Reemplaza a `import modulo` en los módulos que usan librerías pesadas
+    (cv2, skimage, face_recognition carga los modelos de dlib al importarse):
+    el import real ocurre con el primer acceso a un atributo, así que
+    importar la app o un script que no los usa no paga ese costo."""
+
+    def __init__(self, nombre):
+        self._nombre = nombre
+        self._modulo = None
+
+    def cargar(self):
+        if self._modulo is None:
+            with _lock:
+                if self._modulo is None:
+                    t0 = time.perf_counter()
+                    modulo = importlib.import_module(self._nombre)
+                    tiempos_importacion[self._nombre] = time.perf_counter() - t0
+                    self._modulo = modulo
+        return self._modulo
+
+    @property
+    def cargado(self):
+        return self._modulo is not None
+
+    def __getattr__(self, atributo):
+        return getattr(self.cargar(), atributo)
+
+    def __repr__(self):
+        estado = 'cargado' if self.cargado else 'sin cargar'
+        return f"<ModuloDiferido {self._nombre} ({estado})>"
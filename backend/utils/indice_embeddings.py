@@ -0,0 +1,457 @@
+import threading
+import numpy as np
+
+from utils.codificacion_embeddings import decodificar_embedding
+from utils.cuantizacion import MatrizCuantizada
+
+
+# ---- Normalizar filas de una matriz (float32) ----
+def normalizar_filas(matriz):
+    matriz = np.asarray(matriz, dtype=np.float32)
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    normas[normas == 0] = 1.0
+    return matriz / normas
+
+
+# ---- Posiciones de imagen_ids en un arreglo de ids ordenado ----
+def filas_de(ids, imagen_ids):
+    # Los imagen_ids que ya no existen en el índice se ignoran
+    imagen_ids = np.asarray(imagen_ids, dtype=np.int64)
+    if len(ids) == 0 or len(imagen_ids) == 0:
+        return np.zeros(0, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(ids, imagen_ids), len(ids) - 1)
+    return pos[ids[pos] == imagen_ids]
+
+
+# ---- Agrupar resultados por usuario (en orden de aparición) ----
+def agrupar_por_usuario(usuarios, mascara, *similitudes):
+    """Devuelve [(usuario_id, cantidad, fila_primera, [promedios...]), ...]
+    en el mismo orden en que cada usuario aparece en el índice."""
+    filas = np.flatnonzero(mascara)
+    if filas.size == 0:
+        return []
+    ids, primera, inversa, cantidades = np.unique(
+        usuarios[filas], return_index=True, return_inverse=True, return_counts=True
+    )
+    promedios = [np.bincount(inversa, weights=s[filas].astype(np.float64)) / cantidades
+                 for s in similitudes]
+    orden = np.argsort(primera, kind="stable")
+    return [
+        (int(ids[k]), int(cantidades[k]), int(filas[primera[k]]), [float(p[k]) for p in promedios])
+        for k in orden
+    ]
+
+
+# ---- Centroides normalizados por usuario ----
+def centroides_por_usuario(usuarios, trad, fr, tiene_fr):
+    """Devuelve (usuario_ids, centroides_trad, centroides_fr, tiene_fr) con un
+    centroide normalizado por usuario para cada tipo de embedding."""
+    if len(usuarios) == 0:
+        return (np.zeros(0, dtype=np.int64), np.zeros((0, trad.shape[1]), dtype=np.float32),
+                np.zeros((0, fr.shape[1]), dtype=np.float32), np.zeros(0, dtype=bool))
+    orden = np.argsort(usuarios, kind="stable")
+    ordenados = usuarios[orden]
+    inicios = np.flatnonzero(np.r_[True, ordenados[1:] != ordenados[:-1]])
+    suma_trad = np.add.reduceat(trad[orden], inicios, axis=0)
+    # Las filas sin embedding fr son ceros y no afectan la suma
+    suma_fr = np.add.reduceat(fr[orden] * tiene_fr[orden, np.newaxis], inicios, axis=0)
+    con_fr = np.add.reduceat(tiene_fr[orden].astype(np.int64), inicios) > 0
+    return ordenados[inicios], normalizar_filas(suma_trad), normalizar_filas(suma_fr), con_fr
+
+
+# --------- Índice de embeddings en memoria ----------
+class IndiceEmbeddings:
+    """Galería completa en memoria: matrices float32 normalizadas para los
+    embeddings tradicionales (LBP+LPQ+HOG) y de face_recognition, más los
+    arreglos paralelos de imagen_id, usuario_id e imagen_path.
+
+    También mantiene un resumen por usuario (centroide normalizado de cada
+    tipo de embedding) para la búsqueda en cascada y, si se activa, una
+    copia int8 de ambas matrices para la búsqueda cuantizada. En ese caso
+    solo la copia int8 queda en memoria (ver _cuantizar_todo): las pocas
+    filas que hay que recalcular se leen en float32 del snapshot mapeado o,
+    si no están ahí, de `fuente`.
+
+    fuente: función opcional que recibe imagen_ids y devuelve las filas
+    (imagen_id, embeddings, embedding_fr) de la base de datos."""
+
+    def __init__(self, fuente=None):
+        self._lock = threading.Lock()
+        self.cargado = False
+        self.cuantizar = False
+        self.fuente = fuente
+        self._vaciar()
+
+    def _vaciar(self):
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.usuarios = np.zeros(0, dtype=np.int64)
+        self.rutas = np.zeros(0, dtype=object)
+        self.trad = None
+        self.fr = None
+        self.tiene_fr = np.zeros(0, dtype=bool)
+        self.resumen_usuarios = np.zeros(0, dtype=np.int64)
+        self.resumen_trad = None
+        self.resumen_fr = None
+        self.resumen_tiene_fr = np.zeros(0, dtype=bool)
+        self.trad_q = None
+        self.fr_q = None
+        self.base = None        # (ids, trad, fr) del snapshot mapeado, con la copia int8
+
+    # ---- Construcción ----
+    def _preparar(self, filas):
+        ids, usuarios, rutas, trad, fr, tiene_fr = [], [], [], [], [], []
+        dim_trad, dim_fr = self._dimensiones()
+        for imagen_id, usuario_id, imagen_path, emb, emb_fr in filas:
+            emb = decodificar_embedding(emb)
+            emb_fr = decodificar_embedding(emb_fr)
+            if emb is None:
+                continue
+            if dim_trad is None:
+                dim_trad = len(emb)
+            if len(emb) != dim_trad:
+                continue
+            if emb_fr is not None and dim_fr is None:
+                dim_fr = len(emb_fr)
+            valido_fr = emb_fr is not None and len(emb_fr) == dim_fr
+            ids.append(imagen_id)
+            usuarios.append(usuario_id)
+            rutas.append(imagen_path)
+            trad.append(emb)
+            fr.append(emb_fr if valido_fr else None)
+            tiene_fr.append(valido_fr)
+        if not ids:
+            return None
+        dim_fr = dim_fr or 128
+        fr = [f if f is not None else np.zeros(dim_fr) for f in fr]
+        rutas_arr = np.empty(len(rutas), dtype=object)
+        rutas_arr[:] = rutas
+        return (
+            np.asarray(ids, dtype=np.int64),
+            np.asarray(usuarios, dtype=np.int64),
+            rutas_arr,
+            normalizar_filas(trad),
+            normalizar_filas(fr),
+            np.asarray(tiene_fr, dtype=bool),
+        )
+
+    def cargar(self, filas):
+        """filas: iterable de (imagen_id, usuario_id, imagen_path, embeddings, embedding_fr)."""
+        with self._lock:
+            self._vaciar()
+            bloque = self._preparar(filas)
+            if bloque is not None:
+                self.ids, self.usuarios, self.rutas, self.trad, self.fr, self.tiene_fr = bloque
+                self._ordenar_por_id()
+                self._resumir()
+                self._cuantizar_todo()
+            self.cargado = True
+
+    def cargar_arreglos(self, ids, usuarios, rutas, trad, fr, tiene_fr):
+        """Carga la galería desde arreglos ya armados (por ejemplo, una
+        galería sintética) sin decodificar fila por fila."""
+        with self._lock:
+            self._vaciar()
+            if len(ids):
+                rutas_arr = np.empty(len(rutas), dtype=object)
+                rutas_arr[:] = list(rutas)
+                self.ids = np.asarray(ids, dtype=np.int64)
+                self.usuarios = np.asarray(usuarios, dtype=np.int64)
+                self.rutas = rutas_arr
+                self.trad = normalizar_filas(trad)
+                self.fr = normalizar_filas(fr)
+                self.tiene_fr = np.asarray(tiene_fr, dtype=bool)
+                self._ordenar_por_id()
+                self._resumir()
+                self._cuantizar_todo()
+            self.cargado = True
+
+    def cargar_mapeado(self, ids, usuarios, rutas, trad, fr, tiene_fr, resumen):
+        """Usa tal cual arreglos ya normalizados y ordenados por id, con su
+        resumen por usuario (por ejemplo, vistas np.memmap de un snapshot):
+        no copia ni recalcula nada."""
+        with self._lock:
+            self._vaciar()
+            if len(ids):
+                self.ids, self.usuarios, self.rutas, self.trad, self.fr, self.tiene_fr = (
+                    ids, usuarios, rutas, trad, fr, tiene_fr)
+                (self.resumen_usuarios, self.resumen_trad,
+                 self.resumen_fr, self.resumen_tiene_fr) = resumen
+                self._cuantizar_todo()
+            self.cargado = True
+
+    def _ordenar_por_id(self):
+        # Las filas se mantienen ordenadas por imagen_id para ubicarlas con searchsorted
+        if np.all(self.ids[:-1] <= self.ids[1:]):
+            return
+        self._conservar(np.argsort(self.ids, kind="stable"))
+
+    # ---- Actualizaciones incrementales ----
+    def agregar(self, imagen_id, usuario_id, imagen_path, emb, emb_fr=None):
+        with self._lock:
+            bloque = self._preparar([(imagen_id, usuario_id, imagen_path, emb, emb_fr)])
+            if bloque is None:
+                return
+            ids, usuarios, rutas, trad, fr, tiene_fr = bloque
+            if self.trad is None and self.trad_q is None:
+                self.ids, self.usuarios, self.rutas, self.trad, self.fr, self.tiene_fr = bloque
+                self._resumir()
+                self._cuantizar_todo()
+                return
+            # Se crean arreglos nuevos para que las consultas en curso
+            # sigan usando su copia anterior sin bloquear
+            self.ids = np.concatenate([self.ids, ids])
+            self.usuarios = np.concatenate([self.usuarios, usuarios])
+            self.rutas = np.concatenate([self.rutas, rutas])
+            if self.trad is not None:
+                self.trad = np.vstack([self.trad, trad])
+                self.fr = np.vstack([self.fr, fr])
+            self.tiene_fr = np.concatenate([self.tiene_fr, tiene_fr])
+            if self.trad_q is not None:
+                self.trad_q = self.trad_q.agregar(trad)
+                self.fr_q = self.fr_q.agregar(fr)
+            self._ordenar_por_id()
+            self._resumir([usuario_id])
+
+    def _conservar(self, mantener):
+        self.ids = self.ids[mantener]
+        self.usuarios = self.usuarios[mantener]
+        self.rutas = self.rutas[mantener]
+        self.trad = self.trad[mantener] if self.trad is not None else None
+        self.fr = self.fr[mantener] if self.fr is not None else None
+        self.tiene_fr = self.tiene_fr[mantener]
+        self.trad_q = self.trad_q.filas(mantener) if self.trad_q is not None else None
+        self.fr_q = self.fr_q.filas(mantener) if self.fr_q is not None else None
+
+    def eliminar_imagenes(self, imagen_ids):
+        with self._lock:
+            borrar = np.isin(self.ids, np.asarray(list(imagen_ids), dtype=np.int64))
+            afectados = np.unique(self.usuarios[borrar])
+            self._conservar(~borrar)
+            self._resumir(afectados)
+
+    def eliminar_usuario(self, usuario_id):
+        with self._lock:
+            self._conservar(self.usuarios != usuario_id)
+            self._resumir([usuario_id])
+
+    # ---- Copia int8 para la búsqueda cuantizada ----
+    def activar_cuantizacion(self):
+        with self._lock:
+            self.cuantizar = True
+            if self.trad_q is None:
+                self._cuantizar_todo()
+
+    def _cuantizar_todo(self):
+        """Arma la copia int8 (las escalas se recalculan con cada carga
+        completa) y suelta las matrices float: la búsqueda int8 solo las
+        necesita para recalcular las filas cercanas a los umbrales, y esas se
+        leen en float32 del snapshot mapeado o de `fuente` (ver _exactas).
+        Sin `fuente` las matrices float32 se quedan como están."""
+        if not self.cuantizar or self.trad is None:
+            return
+        self.trad_q = MatrizCuantizada.desde(self.trad)
+        self.fr_q = MatrizCuantizada.desde(self.fr)
+        if self.fuente is not None:
+            if isinstance(self.trad, np.memmap):
+                self.base = (self.ids, self.trad, self.fr)
+            self.trad = self.fr = None
+            # El resumen solo lo usa la cascada; se calcula al exportar
+            self.resumen_usuarios = np.zeros(0, dtype=np.int64)
+            self.resumen_trad = self.resumen_fr = None
+            self.resumen_tiene_fr = np.zeros(0, dtype=bool)
+
+    def _dimensiones(self):
+        if self.trad is not None:
+            return self.trad.shape[1], self.fr.shape[1]
+        if self.trad_q is not None:
+            return self.trad_q.q.shape[1], self.fr_q.q.shape[1]
+        return None, None
+
+    def _exactas(self, ids, base):
+        """(trad, fr) en float32 de las imagen_ids cuando las matrices no están
+        en memoria: del snapshot mapeado (`base`) las que estén ahí y de
+        `fuente` las demás (altas posteriores o galería cargada de la base)."""
+        dim_trad, dim_fr = self._dimensiones()
+        trad = np.zeros((len(ids), dim_trad), dtype=np.float32)
+        fr = np.zeros((len(ids), dim_fr), dtype=np.float32)
+        faltan = np.arange(len(ids))
+        if base is not None and len(base[0]):
+            base_ids, base_trad, base_fr = base
+            pos = np.minimum(np.searchsorted(base_ids, ids), len(base_ids) - 1)
+            en_base = base_ids[pos] == ids
+            trad[en_base] = base_trad[pos[en_base]]
+            fr[en_base] = base_fr[pos[en_base]]
+            faltan = np.flatnonzero(~en_base)
+        if len(faltan):
+            # Una imagen borrada mientras tanto queda en ceros: no alcanza ningún umbral
+            leidas = {int(imagen_id): (emb, emb_fr)
+                      for imagen_id, emb, emb_fr in self.fuente([int(i) for i in ids[faltan]])}
+            for k in faltan:
+                emb, emb_fr = leidas.get(int(ids[k]), (None, None))
+                emb, emb_fr = decodificar_embedding(emb), decodificar_embedding(emb_fr)
+                if emb is not None and len(emb) == dim_trad:
+                    trad[k] = normalizar_filas([emb])[0]
+                if emb_fr is not None and len(emb_fr) == dim_fr:
+                    fr[k] = normalizar_filas([emb_fr])[0]
+        return trad, fr
+
+    # ---- Resumen por usuario ----
+    def _resumir(self, afectados=None):
+        """Recalcula los centroides de los usuarios afectados (o de todos)."""
+        if self.trad is None:
+            # Vacío, o con la copia int8 (sin resumen en memoria)
+            return
+        if afectados is None:
+            (self.resumen_usuarios, self.resumen_trad,
+             self.resumen_fr, self.resumen_tiene_fr) = centroides_por_usuario(
+                self.usuarios, self.trad, self.fr, self.tiene_fr)
+            return
+        afectados = np.asarray(afectados, dtype=np.int64)
+        if self.resumen_trad is None:
+            self._resumir()
+            return
+        filas = np.isin(self.usuarios, afectados)
+        nuevos = centroides_por_usuario(self.usuarios[filas], self.trad[filas],
+                                        self.fr[filas], self.tiene_fr[filas])
+        mantener = ~np.isin(self.resumen_usuarios, afectados)
+        self.resumen_usuarios = np.concatenate([self.resumen_usuarios[mantener], nuevos[0]])
+        self.resumen_trad = np.vstack([self.resumen_trad[mantener], nuevos[1]])
+        self.resumen_fr = np.vstack([self.resumen_fr[mantener], nuevos[2]])
+        self.resumen_tiene_fr = np.concatenate([self.resumen_tiene_fr[mantener], nuevos[3]])
+
+    def mejores_usuarios(self, emb, emb_fr, top_k):
+        """Etapa 1 de la cascada: compara la consulta solo contra los
+        centroides y devuelve los usuarios con mejor similitud tradicional
+        o face_recognition (unión de ambos top_k). Acepta también K consultas
+        (matrices) y devuelve la unión de los candidatos de todas."""
+        with self._lock:
+            usuarios, trad, fr, tiene_fr = (self.resumen_usuarios, self.resumen_trad,
+                                            self.resumen_fr, self.resumen_tiene_fr)
+            if trad is None:
+                # Sin resumen en memoria (copia int8): todos pasan a la etapa 2
+                return np.unique(self.usuarios)
+        if len(usuarios) <= top_k:
+            return usuarios
+        q = normalizar_filas(np.atleast_2d(emb))
+        q_fr = normalizar_filas(np.atleast_2d(emb_fr))
+        if q.shape[1] != trad.shape[1] or q_fr.shape[1] != fr.shape[1]:
+            return usuarios[:0]
+        sim_trad = q @ trad.T
+        sim_fr = np.where(tiene_fr, q_fr @ fr.T, -np.inf)
+        mejores = np.union1d(np.argpartition(-sim_trad, top_k - 1, axis=1)[:, :top_k],
+                             np.argpartition(-sim_fr, top_k - 1, axis=1)[:, :top_k])
+        return usuarios[mejores]
+
+    # ---- Consulta ----
+    def snapshot(self):
+        """(ids, usuarios, rutas, trad, fr, tiene_fr) tal como están en
+        memoria; con la copia int8, trad y fr son None (ver exportar)."""
+        with self._lock:
+            return self.ids, self.usuarios, self.rutas, self.trad, self.fr, self.tiene_fr
+
+    def resumen(self):
+        with self._lock:
+            return self.resumen_usuarios, self.resumen_trad, self.resumen_fr, self.resumen_tiene_fr
+
+    def exportar(self):
+        """(arreglos, resumen) completos para escribir un snapshot. Con la
+        copia int8 las matrices float32 se arman en ese momento (del
+        snapshot mapeado y `fuente`) y el resumen se calcula sobre ellas."""
+        with self._lock:
+            ids, usuarios, rutas, trad, fr, tiene_fr = (self.ids, self.usuarios, self.rutas,
+                                                        self.trad, self.fr, self.tiene_fr)
+            resumen = self.resumen_usuarios, self.resumen_trad, self.resumen_fr, self.resumen_tiene_fr
+            base, cuantizado = self.base, self.trad_q is not None
+        if trad is None and cuantizado:
+            trad, fr = self._exactas(ids, base)
+            resumen = centroides_por_usuario(usuarios, trad, fr, tiene_fr)
+        return (ids, usuarios, rutas, trad, fr, tiene_fr), resumen
+
+    def contiene(self, imagen_id):
+        return len(filas_de(self.ids, [imagen_id])) > 0
+
+    def _galeria(self, imagen_ids=None, usuario_ids=None):
+        """(usuarios, rutas, trad, fr, tiene_fr) de toda la galería o solo de
+        las imagen_ids (o de las imágenes de usuario_ids) indicadas."""
+        with self._lock:
+            ids, usuarios, rutas, trad, fr, tiene_fr = (self.ids, self.usuarios, self.rutas,
+                                                        self.trad, self.fr, self.tiene_fr)
+            base, cuantizado = self.base, self.trad_q is not None
+        if trad is None and not cuantizado:
+            return usuarios, rutas, trad, fr, tiene_fr
+        if imagen_ids is None and usuario_ids is None:
+            filas = slice(None)
+        elif imagen_ids is not None:
+            filas = filas_de(ids, imagen_ids)
+        else:
+            filas = np.flatnonzero(np.isin(usuarios, usuario_ids))
+        if trad is None:
+            # Con la copia int8 las filas float32 se leen aparte
+            trad, fr = self._exactas(ids[filas], base)
+            return usuarios[filas], rutas[filas], trad, fr, tiene_fr[filas]
+        if isinstance(filas, slice):
+            return usuarios, rutas, trad, fr, tiene_fr
+        return usuarios[filas], rutas[filas], trad[filas], fr[filas], tiene_fr[filas]
+
+    def similitudes(self, emb, emb_fr, imagen_ids=None, usuario_ids=None):
+        """Similitud coseno de la consulta contra toda la galería: dos
+        productos matriz-vector. Devuelve (usuarios, rutas, sim_trad, sim_fr,
+        validos), donde validos marca filas comparables en ambos embeddings.
+        Si se pasan imagen_ids (o usuario_ids), solo se evalúan esas imágenes
+        (o las imágenes de esos usuarios)."""
+        usuarios, rutas, trad, fr, tiene_fr = self._galeria(imagen_ids, usuario_ids)
+        vacio = np.zeros(0, dtype=np.float32)
+        if trad is None or len(emb) != trad.shape[1] or len(emb_fr) != fr.shape[1]:
+            return usuarios[:0], rutas[:0], vacio, vacio, np.zeros(0, dtype=bool)
+        q = normalizar_filas(np.asarray(emb)[np.newaxis])[0]
+        q_fr = normalizar_filas(np.asarray(emb_fr)[np.newaxis])[0]
+        return usuarios, rutas, trad @ q, fr @ q_fr, tiene_fr
+
+    def similitudes_lote(self, embs, embs_fr, imagen_ids=None, usuario_ids=None):
+        """Igual que similitudes() pero para K consultas a la vez (por ejemplo,
+        todos los rostros de una foto): dos productos matriz-matriz.
+        sim_trad y sim_fr tienen forma (K, N)."""
+        usuarios, rutas, trad, fr, tiene_fr = self._galeria(imagen_ids, usuario_ids)
+        embs, embs_fr = np.atleast_2d(embs), np.atleast_2d(embs_fr)
+        if trad is None or embs.shape[1] != trad.shape[1] or embs_fr.shape[1] != fr.shape[1]:
+            vacio = np.zeros((len(embs), 0), dtype=np.float32)
+            return usuarios[:0], rutas[:0], vacio, vacio, np.zeros(0, dtype=bool)
+        return usuarios, rutas, normalizar_filas(embs) @ trad.T, normalizar_filas(embs_fr) @ fr.T, tiene_fr
+
+    def similitudes_cuantizadas(self, embs, embs_fr, umbral_trad, umbral_fr):
+        """Igual que similitudes_lote() pero recorriendo la copia int8. Toda
+        fila que, según la cota de error, podría alcanzar umbral_trad o
+        umbral_fr se recalcula con sus embeddings float32; el resto queda con
+        su puntaje aproximado, que está garantizado por debajo de ambos
+        umbrales."""
+        with self._lock:
+            ids, usuarios, rutas, trad, fr, tiene_fr = (self.ids, self.usuarios, self.rutas,
+                                                        self.trad, self.fr, self.tiene_fr)
+            trad_q, fr_q, base = self.trad_q, self.fr_q, self.base
+        if trad_q is None:
+            return self.similitudes_lote(embs, embs_fr)
+        embs, embs_fr = np.atleast_2d(embs), np.atleast_2d(embs_fr)
+        if embs.shape[1] != trad_q.q.shape[1] or embs_fr.shape[1] != fr_q.q.shape[1]:
+            vacio = np.zeros((len(embs), 0), dtype=np.float32)
+            return usuarios[:0], rutas[:0], vacio, vacio, np.zeros(0, dtype=bool)
+        q, q_fr = normalizar_filas(embs), normalizar_filas(embs_fr)
+        sim_trad, cota_trad = trad_q.puntajes(q)
+        sim_fr, cota_fr = fr_q.puntajes(q_fr)
+        posibles = (sim_trad + cota_trad >= umbral_trad) | (sim_fr + cota_fr >= umbral_fr)
+        filas = np.flatnonzero(posibles.any(axis=0))
+        if len(filas):
+            if trad is None:
+                exactas_trad, exactas_fr = self._exactas(ids[filas], base)
+            else:
+                exactas_trad, exactas_fr = trad[filas], fr[filas]
+            # Misma operación que la búsqueda exacta (matriz-vector con una consulta)
+            if len(q) == 1:
+                sim_trad[0, filas] = exactas_trad @ q[0]
+                sim_fr[0, filas] = exactas_fr @ q_fr[0]
+            else:
+                sim_trad[:, filas] = q @ exactas_trad.T
+                sim_fr[:, filas] = q_fr @ exactas_fr.T
+        return usuarios, rutas, sim_trad, sim_fr, tiene_fr
+
+    def __len__(self):
+        return len(self.ids)
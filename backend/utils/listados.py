@@ -0,0 +1,201 @@
+import json
+import base64
+import hashlib
+
+from config import listados_config
+
+# Columnas que se pueden pedir con ?campos= (nunca se interpola otra cosa en el SQL)
+CAMPOS_USUARIO = ('id', 'nombre', 'apellido', 'codigo_unico', 'email', 'requisitoriado', 'fecha_registro')
+CAMPOS_IMAGEN = ('id', 'imagen_path', 'fecha_registro')
+
+# Huella de la tabla usuarios para el ETag de las exportaciones completas:
+# recorre la tabla en el servidor pero no transfiere filas
+SQL_HUELLA_USUARIOS = """
+    SELECT COUNT(*), COALESCE(MAX(id), 0),
+           COALESCE(BIT_XOR(CRC32(CONCAT_WS('|', id, nombre, apellido, codigo_unico, email,
+                                              requisitoriado, fecha_registro))), 0)
+    FROM usuarios
+"""
+
+
+class ParametroInvalido(ValueError):
+    """Parámetro de listado mal formado: la ruta responde 400."""
+
+
+# --------- Parámetros comunes de los listados ----------
+# Forma del cursor de cada listado: una posición por valor (str admite None)
+CURSOR_USUARIOS = (int,)            # [id]
+CURSOR_IMAGENES = (str, int)        # [fecha_registro, id]
+
+
+class ParametrosListado:
+    """?limite, ?cursor, ?campos, ?requisitoriado y ?formato ya validados.
+    `paginado` es False cuando no se pidió página (listado completo).
+    `forma_cursor` es la forma que debe tener el cursor decodificado y, sin
+    `con_requisitoriado`, el filtro ?requisitoriado se rechaza."""
+
+    def __init__(self, args, campos_validos, forma_cursor=CURSOR_USUARIOS, con_requisitoriado=True):
+        self.formato = args.get('formato', 'json')
+        if self.formato not in ('json', 'jsonl'):
+            raise ParametroInvalido("formato debe ser 'json' o 'jsonl'")
+
+        limite = args.get('limite')
+        self.paginado = limite is not None or args.get('cursor') is not None
+        try:
+            self.limite = int(limite) if limite is not None else listados_config['limite_por_defecto']
+        except ValueError:
+            raise ParametroInvalido("limite debe ser un número entero")
+        if not 1 <= self.limite <= listados_config['limite_maximo']:
+            raise ParametroInvalido(f"limite debe estar entre 1 y {listados_config['limite_maximo']}")
+        self.cursor = decodificar_cursor(args['cursor'], forma_cursor) if args.get('cursor') else None
+
+        campos = args.get('campos')
+        self.campos = list(campos_validos)
+        if campos:
+            pedidos = [c.strip() for c in campos.split(',') if c.strip()]
+            invalidos = [c for c in pedidos if c not in campos_validos]
+            if invalidos:
+                raise ParametroInvalido(f"campos no válidos: {', '.join(invalidos)}")
+            self.campos = [c for c in campos_validos if c in pedidos]
+
+        valor = args.get('requisitoriado')
+        self.requisitoriado = None
+        if valor is not None and not con_requisitoriado:
+            raise ParametroInvalido("requisitoriado no se aplica a este listado")
+        if valor is not None:
+            if valor.lower() not in ('1', '0', 'true', 'false', 'si', 'sí', 'no'):
+                raise ParametroInvalido("requisitoriado debe ser 1 o 0")
+            self.requisitoriado = valor.lower() in ('1', 'true', 'si', 'sí')
+
+
+def codificar_cursor(valores):
+    return base64.urlsafe_b64encode(json.dumps(valores).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(texto, forma=CURSOR_USUARIOS):
+    """Valores del cursor; ParametroInvalido si no es base64/JSON o si no
+    tiene la forma del listado (por ejemplo, un número suelto en vez de [id])."""
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(texto + '=' * (-len(texto) % 4)))
+    except Exception:
+        raise ParametroInvalido("cursor no válido")
+    if not isinstance(valores, list) or len(valores) != len(forma):
+        raise ParametroInvalido("cursor no válido")
+    for valor, tipo in zip(valores, forma):
+        # bool es subclase de int: true/false no son ids
+        if tipo is int and (not isinstance(valor, int) or isinstance(valor, bool)):
+            raise ParametroInvalido("cursor no válido")
+        if tipo is str and valor is not None and not isinstance(valor, str):
+            raise ParametroInvalido("cursor no válido")
+    return valores
+
+
+def etag_de(*partes):
+    return hashlib.sha1(json.dumps(partes, default=str).encode('utf-8')).hexdigest()
+
+
+# --------- Usuarios: paginación por id (keyset) ----------
+def _fila_usuario(columnas, fila):
+    usuario = dict(zip(columnas, fila))
+    if 'requisitoriado' in usuario:
+        usuario['requisitoriado'] = bool(usuario['requisitoriado'])
+    return usuario
+
+
+def consultar_usuarios(conexion, campos, requisitoriado=None, despues_de=0, limite=50):
+    """Hasta `limite` usuarios con id > despues_de, ordenados por id. El id
+    siempre se consulta (es el cursor) aunque no esté en `campos`."""
+    columnas = ['id'] + [c for c in campos if c != 'id']
+    condiciones, parametros = ["id > %s"], [despues_de]
+    if requisitoriado is not None:
+        condiciones.append("requisitoriado = %s")
+        parametros.append(int(requisitoriado))
+    cursor = conexion.cursor()
+    cursor.execute(
+        f"SELECT {', '.join(columnas)} FROM usuarios WHERE {' AND '.join(condiciones)} ORDER BY id LIMIT %s",
+        (*parametros, limite)
+    )
+    filas = cursor.fetchall()
+    cursor.close()
+    return [_fila_usuario(columnas, f) for f in filas]
+
+
+def pagina_usuarios(conexion, parametros):
+    """(usuarios, cursor_siguiente o None). Se pide una fila de más para
+    saber si hay otra página sin contar la tabla."""
+    despues_de = parametros.cursor[0] if parametros.cursor else 0
+    usuarios = consultar_usuarios(conexion, parametros.campos, parametros.requisitoriado,
+                                  despues_de, parametros.limite + 1)
+    siguiente = None
+    if len(usuarios) > parametros.limite:
+        usuarios = usuarios[:parametros.limite]
+        siguiente = codificar_cursor([usuarios[-1]['id']])
+    return [_proyectar(u, parametros.campos) for u in usuarios], siguiente
+
+
+def iterar_usuarios(conexion, parametros):
+    """Todos los usuarios que pasan el filtro, de a
+    listados_config['lote_exportacion'] filas: la memoria no crece con la tabla."""
+    despues_de = parametros.cursor[0] if parametros.cursor else 0
+    while True:
+        usuarios = consultar_usuarios(conexion, parametros.campos, parametros.requisitoriado,
+                                      despues_de, listados_config['lote_exportacion'])
+        for usuario in usuarios:
+            yield _proyectar(usuario, parametros.campos)
+        if len(usuarios) < listados_config['lote_exportacion']:
+            return
+        despues_de = usuarios[-1]['id']
+
+
+def huella_usuarios(conexion, parametros):
+    """ETag de una exportación completa sin leer las filas."""
+    sql, valores = SQL_HUELLA_USUARIOS, ()
+    if parametros.requisitoriado is not None:
+        sql, valores = sql + " WHERE requisitoriado = %s", (int(parametros.requisitoriado),)
+    cursor = conexion.cursor()
+    cursor.execute(sql, valores)
+    huella = cursor.fetchone()
+    cursor.close()
+    return etag_de(huella, parametros.campos, parametros.requisitoriado, parametros.cursor, parametros.formato)
+
+
+def _proyectar(fila, campos):
+    return {c: fila[c] for c in campos}
+
+
+# --------- Imágenes de un usuario: paginación por (fecha_registro, id) ----------
+def pagina_imagenes(imagenes, parametros):
+    """imagenes: dicts ordenados por fecha_registro e id descendentes (como
+    SQL_IMAGENES_USUARIO). Devuelve (página, cursor_siguiente o None)."""
+    if parametros.cursor:
+        fecha, imagen_id = parametros.cursor
+        clave = (fecha or '', imagen_id)
+        imagenes = [i for i in imagenes if (i['fecha_registro'] or '', i['id']) < clave]
+    pagina = imagenes[:parametros.limite]
+    siguiente = None
+    if len(imagenes) > parametros.limite:
+        siguiente = codificar_cursor([pagina[-1]['fecha_registro'], pagina[-1]['id']])
+    return [_proyectar(i, parametros.campos) for i in pagina], siguiente
+
+
+def lineas_json(filas, serializar=json.dumps, por_bloque=500):
+    """Una línea JSON por fila (application/x-ndjson), enviadas de a
+    `por_bloque` líneas."""
+    bloque = []
+    for fila in filas:
+        bloque.append(serializar(fila))
+        if len(bloque) >= por_bloque:
+            yield '\n'.join(bloque) + '\n'
+            bloque = []
+    if bloque:
+        yield '\n'.join(bloque) + '\n'
+
+
+def arreglo_json(filas, serializar=json.dumps, por_bloque=500):
+    """El mismo arreglo JSON de siempre, pero generado por partes."""
+    yield '['
+    separador = ''
+    for lineas in lineas_json(filas, serializar, por_bloque):
+        yield separador + ','.join(lineas.rstrip('\n').split('\n'))
+        separador = ','
+    yield ']\n'
@@ -0,0 +1,170 @@
+import os
+import sys
+import time
+import bisect
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+# Límites de los buckets en segundos (mismos para rutas y etapas)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+# --------- Histogramas con etiquetas ----------
+class Histograma:
+    def __init__(self, nombre, ayuda, etiquetas, buckets=BUCKETS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *valores_etiquetas):
+        with self._lock:
+            serie = self._series.get(valores_etiquetas)
+            if serie is None:
+                serie = self._series[valores_etiquetas] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][bisect.bisect_left(self.buckets, valor)] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def exportar(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._lock:
+            series = {k: (list(v[0]), v[1], v[2]) for k, v in self._series.items()}
+        for valores_etiquetas, (conteos, suma, total) in sorted(series.items()):
+            base = ','.join(f'{k}="{v}"' for k, v in zip(self.etiquetas, valores_etiquetas))
+            acumulado = 0
+            for limite, conteo in zip(self.buckets, conteos):
+                acumulado += conteo
+                lineas.append(f'{self.nombre}_bucket{{{base},le="{limite}"}} {acumulado}')
+            lineas.append(f'{self.nombre}_bucket{{{base},le="+Inf"}} {total}')
+            lineas.append(f'{self.nombre}_sum{{{base}}} {suma:.6f}')
+            lineas.append(f'{self.nombre}_count{{{base}}} {total}')
+        return lineas
+
+
+peticiones = Histograma("reconocimiento_peticion_segundos", "Duración de las peticiones HTTP",
+                        ("ruta", "metodo", "estado"))
+etapas = Histograma("reconocimiento_etapa_segundos", "Duración de cada etapa del procesamiento",
+                    ("ruta", "etapa"))
+
+
+# --------- Medición de etapas ----------
+_local = threading.local()
+
+
+def _ruta_actual():
+    try:
+        from flask import has_request_context, request
+        if has_request_context():
+            return request.endpoint or 'desconocida'
+    except ImportError:
+        pass
+    return 'fondo'
+
+
+@contextmanager
+def etapa(nombre):
+    """Mide un bloque. Si hay un recolector activo en el hilo (dentro de un
+    worker del pool) el tiempo se acumula ahí para devolverlo al proceso
+    principal; si no, se registra directamente en el histograma."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - t0
+        recolector = getattr(_local, 'recolector', None)
+        if recolector is not None:
+            recolector.append((nombre, duracion))
+        else:
+            etapas.observar(duracion, _ruta_actual(), nombre)
+
+
+@contextmanager
+def recolectar():
+    """Junta las etapas medidas en el hilo actual en una lista [(etapa, s)]."""
+    anterior = getattr(_local, 'recolector', None)
+    _local.recolector = []
+    try:
+        yield _local.recolector
+    finally:
+        _local.recolector = anterior
+
+
+def registrar_etapas(tiempos):
+    # Tiempos que vienen de un worker del pool de procesos
+    ruta = _ruta_actual()
+    for nombre, duracion in tiempos:
+        etapas.observar(duracion, ruta, nombre)
+
+
+def exportar(extras=()):
+    """Texto en formato de exposición de Prometheus. `extras` son líneas
+    adicionales (por ejemplo, contadores de otros módulos)."""
+    return '\n'.join(peticiones.exportar() + etapas.exportar() + list(extras)) + '\n'
+
+
+# --------- Perfilador por muestreo (opcional) ----------
+class PerfiladorMuestreo:
+    """Un hilo toma cada `intervalo_s` la pila de los hilos que están
+    atendiendo una petición. Si la petición tarda más que `umbral_s`, sus
+    pilas se guardan en `carpeta` en formato "collapsed" (una línea por pila
+    con su cantidad de muestras), que leen flamegraph.pl y speedscope."""
+
+    def __init__(self, carpeta, umbral_s, intervalo_s=0.005):
+        self.carpeta = carpeta
+        self.umbral_s = umbral_s
+        self.intervalo_s = intervalo_s
+        self._activos = {}
+        self._lock = threading.Lock()
+        self._hilo = None
+
+    def iniciar(self):
+        hilo_id = threading.get_ident()
+        with self._lock:
+            self._activos[hilo_id] = (time.perf_counter(), Counter())
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._bucle, daemon=True, name="perfilador")
+                self._hilo.start()
+
+    def terminar(self, nombre):
+        with self._lock:
+            inicio, muestras = self._activos.pop(threading.get_ident(), (None, None))
+        if inicio is None:
+            return None
+        duracion = time.perf_counter() - inicio
+        if duracion < self.umbral_s or not muestras:
+            return None
+        os.makedirs(self.carpeta, exist_ok=True)
+        ruta = os.path.join(self.carpeta, f"{time.strftime('%Y%m%d-%H%M%S')}_{nombre}_{int(duracion * 1000)}ms.txt")
+        with open(ruta, 'w') as f:
+            for pila, cantidad in muestras.most_common():
+                f.write(f"{pila} {cantidad}\n")
+        return ruta
+
+    def _bucle(self):
+        while True:
+            time.sleep(self.intervalo_s)
+            with self._lock:
+                hilos = list(self._activos.items())
+            if not hilos:
+                continue
+            marcos = sys._current_frames()
+            pilas = {}
+            for hilo_id, _ in hilos:
+                marco = marcos.get(hilo_id)
+                pila = []
+                while marco is not None:
+                    codigo = marco.f_code
+                    pila.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{marco.f_lineno})")
+                    marco = marco.f_back
+                if pila:
+                    pilas[hilo_id] = ';'.join(reversed(pila))
+            del marcos
+            with self._lock:
+                # Solo los hilos que siguen activos (terminar() pudo sacarlos)
+                for hilo_id, pila in pilas.items():
+                    if hilo_id in self._activos:
+                        self._activos[hilo_id][1][pila] += 1
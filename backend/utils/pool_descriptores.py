@@ -0,0 +1,187 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturoTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from config import pool_config
+from utils.metricas import etapa, recolectar, registrar_etapas
+# La decodificación la lanza dentro del proceso del pool y llega tal cual al
+# proceso de Flask (las rutas responden 400); se reexporta junto a ColaLlena
+from utils.preprocesamiento import ImagenInvalida
+
+
+class ColaLlena(Exception):
+    """No hay lugar en la cola del pool: el cliente debe reintentar más tarde."""
+
+
+class TiempoAgotado(Exception):
+    """El trabajo no terminó dentro de pool_config['timeout_s']."""
+
+
+# --------- Código que corre dentro de cada proceso del pool ----------
+def _inicializar_worker():
+    # Cargar los modelos de dlib/face_recognition una vez por proceso
+    from utils.preprocesamiento import precalentar
+    try:
+        precalentar()
+    except Exception as e:
+        print("Aviso: no se pudo precalentar el worker:", e)
+
+
+def _listo():
+    return os.getpid()
+
+
+def _procesar(imagen_bytes, solo_tradicional):
+    from utils.preprocesamiento import ImagenPreprocesada, embedding_tradicional, embedding_face_recognition
+    pre = ImagenPreprocesada(imagen_bytes)
+    emb = embedding_tradicional(pre)
+    if solo_tradicional:
+        return emb, None
+    return emb, embedding_face_recognition(pre)
+
+
+def _procesar_rostros(imagen_bytes):
+    from utils.preprocesamiento import calcular_embeddings_rostros
+    return calcular_embeddings_rostros(imagen_bytes)
+
+
+def _detectar(imagen_bytes):
+    from utils.preprocesamiento import detectar_rostros
+    return detectar_rostros(imagen_bytes)
+
+
+def _procesar_cajas(pre, ubicaciones):
+    from utils.preprocesamiento import calcular_embeddings_cajas
+    return calcular_embeddings_cajas(pre, ubicaciones)
+
+
+def _medido(funcion, *args):
+    # Los tiempos por etapa del worker viajan de vuelta junto con el resultado
+    with recolectar() as tiempos:
+        resultado = funcion(*args)
+    return resultado, tiempos
+
+
+# --------- Pool compartido por el proceso Flask ----------
+class PoolDescriptores:
+    """Pool de procesos para la extracción de descriptores, con cola acotada,
+    timeout por trabajo y rechazo inmediato (ColaLlena) cuando está lleno."""
+
+    def __init__(self, procesos=None, max_en_cola=None, timeout_s=None):
+        self.procesos = procesos or pool_config['procesos'] or multiprocessing.cpu_count()
+        self.max_en_cola = max_en_cola or pool_config['max_en_cola'] or 2 * self.procesos
+        self.timeout_s = timeout_s or pool_config['timeout_s']
+        self._cupos = threading.BoundedSemaphore(self.max_en_cola)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _obtener_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.procesos,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_inicializar_worker
+                )
+            return self._executor
+
+    def _reiniciar(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _ejecutar(self, funcion, *args):
+        if not self._cupos.acquire(blocking=False):
+            raise ColaLlena()
+        try:
+            futuro = self._obtener_executor().submit(_medido, funcion, *args)
+        except BrokenProcessPool:
+            self._cupos.release()
+            self._reiniciar()
+            raise
+        except Exception:
+            self._cupos.release()
+            raise
+        # El cupo se libera cuando el trabajo termina de verdad, aunque el
+        # cliente ya haya recibido el timeout
+        futuro.add_done_callback(lambda _: self._cupos.release())
+        try:
+            resultado, tiempos = futuro.result(timeout=self.timeout_s)
+        except FuturoTimeout:
+            raise TiempoAgotado()
+        except BrokenProcessPool:
+            self._reiniciar()
+            raise
+        registrar_etapas(tiempos)
+        return resultado
+
+    def precalentar(self, timeout_s=None):
+        """Arranca los procesos del pool y espera a que terminen de
+        inicializarse (cada uno se precalienta en _inicializar_worker).
+        Devuelve los pids de los procesos que respondieron."""
+        executor = self._obtener_executor()
+        futuros = [executor.submit(_listo) for _ in range(self.procesos)]
+        return sorted({f.result(timeout=timeout_s) for f in futuros})
+
+    def calcular(self, imagen_bytes, solo_tradicional=False):
+        """Devuelve (embedding_tradicional, embedding_fr) calculados en el pool."""
+        return self._ejecutar(_procesar, bytes(imagen_bytes), solo_tradicional)
+
+    def calcular_rostros(self, imagen_bytes):
+        """Devuelve (cajas, matriz_trad, matriz_fr) de todos los rostros."""
+        return self._ejecutar(_procesar_rostros, bytes(imagen_bytes))
+
+    def detectar(self, imagen_bytes):
+        """Devuelve la ImagenPreprocesada (ubicaciones y escala) sin calcular embeddings."""
+        return self._ejecutar(_detectar, bytes(imagen_bytes))
+
+    def calcular_cajas(self, pre, ubicaciones):
+        """Devuelve (matriz_trad, matriz_fr) de las cajas ya detectadas en
+        `pre`: la imagen viaja ya decodificada, no se vuelve a decodificar."""
+        return self._ejecutar(_procesar_cajas, pre, list(ubicaciones))
+
+    def cerrar(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+pool = PoolDescriptores() if pool_config['habilitado'] else None
+
+
+def calcular_descriptores(imagen_bytes, solo_tradicional=False):
+    """Punto de entrada para las rutas: usa el pool si está habilitado y si
+    no calcula en el mismo hilo de la petición."""
+    with etapa('descriptores'):
+        if pool is None:
+            return _procesar(imagen_bytes, solo_tradicional)
+        return pool.calcular(imagen_bytes, solo_tradicional)
+
+
+def calcular_descriptores_rostros(imagen_bytes):
+    """Como calcular_descriptores, pero para todos los rostros de la imagen."""
+    with etapa('descriptores'):
+        if pool is None:
+            return _procesar_rostros(imagen_bytes)
+        return pool.calcular_rostros(imagen_bytes)
+
+
+def detectar_rostros_frame(imagen_bytes):
+    """Detección de un frame de video (en el pool si está habilitado)."""
+    with etapa('deteccion'):
+        if pool is None:
+            return _detectar(imagen_bytes)
+        return pool.detectar(imagen_bytes)
+
+
+def calcular_descriptores_cajas(pre, ubicaciones):
+    """Embeddings de cajas ya detectadas con detectar_rostros_frame, sobre
+    la misma ImagenPreprocesada que devolvió."""
+    with etapa('descriptores'):
+        if pool is None:
+            return _procesar_cajas(pre, ubicaciones)
+        return pool.calcular_cajas(pre, ubicaciones)
@@ -0,0 +1,174 @@
+import io
+import numpy as np
+from PIL import Image
+
+from config import preprocesamiento_config
+from utils.face_utils import obtener_embeddings_lbp_lpq_hog, obtener_embeddings_lote
+from utils.metricas import etapa, recolectar
+from utils.importacion_diferida import ModuloDiferido
+
+# face_recognition carga los modelos de dlib al importarse (varios segundos):
+# se importa con la primera detección o con precalentar()
+cv2 = ModuloDiferido('cv2')
+face_recognition = ModuloDiferido('face_recognition')
+
+
+class ImagenInvalida(ValueError):
+    """Los bytes subidos no son una imagen que se pueda decodificar: las
+    rutas responden 400."""
+
+
+# --------- Imagen decodificada una sola vez ----------
+class ImagenPreprocesada:
+    """Resultado de decodificar la imagen una vez y detectar el rostro una vez.
+
+    rgb:       imagen RGB reducida a la resolución de detección
+    gris:      imagen completa en escala de grises (para los descriptores tradicionales)
+    escala:    factor aplicado para pasar de la imagen completa a `rgb`
+    ubicacion: (top, right, bottom, left) del primer rostro en coordenadas de `rgb`, o None.
+               Es la caja del detector sin recortar a los bordes, igual que la que
+               usa face_encodings internamente, para que el embedding no cambie.
+    ubicaciones: todas las cajas detectadas, en el mismo orden que face_encodings.
+                 Si se pasan (cajas ya detectadas en la misma imagen), no se detecta
+    """
+
+    def __init__(self, imagen_bytes, max_lado=None, ubicaciones=None):
+        max_lado = max_lado or preprocesamiento_config['max_lado_deteccion']
+        with etapa('decodificar'):
+            try:
+                imagen = Image.open(io.BytesIO(imagen_bytes))
+                imagen.load()
+                self.gris = np.array(imagen.convert('L'))
+                rgb = np.array(imagen.convert('RGB'))
+            except Exception as e:
+                # PIL lanza UnidentifiedImageError, OSError (archivo truncado), etc.
+                raise ImagenInvalida(f"No se pudo decodificar la imagen: {e}") from e
+            alto, ancho = rgb.shape[:2]
+            self.escala = min(1.0, max_lado / max(alto, ancho))
+            if self.escala < 1.0:
+                rgb = cv2.resize(rgb, (round(ancho * self.escala), round(alto * self.escala)),
+                                 interpolation=cv2.INTER_AREA)
+            self.rgb = rgb
+
+        if ubicaciones is not None:
+            self.ubicaciones = [tuple(u) for u in ubicaciones]
+        else:
+            with etapa('detectar'):
+                rostros = face_recognition.api.face_detector(self.rgb, 1)
+            self.ubicaciones = [(r.top(), r.right(), r.bottom(), r.left()) for r in rostros]
+        self.ubicacion = self.ubicaciones[0] if self.ubicaciones else None
+
+    def recorte_rostro(self, margen=None, ubicacion=None):
+        """Recorte en escala de grises del rostro (con margen) sobre la imagen completa.
+        Por defecto usa el primer rostro detectado."""
+        ubicacion = ubicacion or self.ubicacion
+        if ubicacion is None:
+            return None
+        margen = preprocesamiento_config['margen_rostro'] if margen is None else margen
+        top, right, bottom, left = [v / self.escala for v in ubicacion]
+        extra_y = (bottom - top) * margen
+        extra_x = (right - left) * margen
+        alto, ancho = self.gris.shape
+        y0, y1 = max(0, int(top - extra_y)), min(alto, int(bottom + extra_y))
+        x0, x1 = max(0, int(left - extra_x)), min(ancho, int(right + extra_x))
+        return self.gris[y0:y1, x0:x1]
+
+
+# --------- Embeddings sobre la imagen preprocesada ----------
+def imagen_para_descriptores(pre, ubicacion=None):
+    recorte = None
+    if preprocesamiento_config['descriptores_en_rostro']:
+        recorte = pre.recorte_rostro(ubicacion=ubicacion)
+    return recorte if recorte is not None else pre.gris
+
+
+def embedding_tradicional(pre):
+    return obtener_embeddings_lbp_lpq_hog(imagen_para_descriptores(pre))
+
+
+def embeddings_rostros(pre, ubicaciones):
+    """Embeddings de varios rostros de la misma imagen: los descriptores
+    tradicionales se calculan en un lote sobre los recortes y face_encodings
+    recibe todas las ubicaciones en una sola llamada.
+    Devuelve (matriz_trad (K, D), matriz_fr (K, 128))."""
+    if not ubicaciones:
+        return None, None
+    matriz_trad, _ = obtener_embeddings_lote([imagen_para_descriptores(pre, u) for u in ubicaciones])
+    with etapa('face_encodings'):
+        matriz_fr = np.asarray(face_recognition.face_encodings(pre.rgb, known_face_locations=list(ubicaciones)))
+    return matriz_trad, matriz_fr
+
+
+def calcular_embeddings_rostros(imagen_bytes):
+    """Decodifica una vez y calcula los embeddings de todos los rostros.
+    Devuelve (cajas, matriz_trad, matriz_fr) con las cajas (top, right,
+    bottom, left) en coordenadas de la imagen original; las filas de
+    matriz_trad que no se pudieron calcular quedan en NaN."""
+    pre = ImagenPreprocesada(imagen_bytes)
+    if not pre.ubicaciones:
+        return [], None, None
+    matriz_trad, matriz_fr = embeddings_rostros(pre, pre.ubicaciones)
+    cajas = [tuple(int(round(v / pre.escala)) for v in u) for u in pre.ubicaciones]
+    return cajas, matriz_trad, matriz_fr
+
+
+def detectar_rostros(imagen_bytes):
+    """Solo decodificación y detección (frames de video): devuelve la
+    ImagenPreprocesada, con las ubicaciones en coordenadas de detección.
+    Sin rostros no se conservan las imágenes decodificadas: no habrá
+    embeddings que calcular y el resultado viaja más liviano desde el pool."""
+    pre = ImagenPreprocesada(imagen_bytes)
+    if not pre.ubicaciones:
+        pre.gris = pre.rgb = None
+    return pre
+
+
+def calcular_embeddings_cajas(pre, ubicaciones):
+    """Embeddings de algunas de las cajas que detectar_rostros encontró en
+    `pre`: no se decodifica ni se detecta de nuevo.
+    Devuelve (matriz_trad, matriz_fr) como embeddings_rostros."""
+    return embeddings_rostros(pre, [tuple(u) for u in ubicaciones])
+
+
+def embeddings_tradicionales_lote(pres):
+    """Embeddings LBP+LPQ+HOG de varias imágenes preprocesadas en una sola
+    pasada. Devuelve (matriz (N, D) float32, errores {indice: mensaje})."""
+    return obtener_embeddings_lote([imagen_para_descriptores(pre) for pre in pres])
+
+
+def embedding_face_recognition(pre):
+    if pre.ubicacion is None:
+        return None
+    try:
+        with etapa('face_encodings'):
+            encodings = face_recognition.face_encodings(pre.rgb, known_face_locations=[pre.ubicacion])
+        return encodings[0] if encodings else None
+    except Exception as e:
+        print("Error obteniendo embedding face_recognition:", e)
+        return None
+
+
+def calcular_embeddings(imagen_bytes):
+    """Decodifica, detecta el rostro y calcula ambos embeddings.
+    Devuelve (embedding_tradicional, embedding_fr); cualquiera puede ser None."""
+    pre = ImagenPreprocesada(imagen_bytes)
+    return embedding_tradicional(pre), embedding_face_recognition(pre)
+
+
+# --------- Precalentamiento ----------
+def imagen_sintetica(lado=64):
+    buffer = io.BytesIO()
+    Image.fromarray(np.full((lado, lado, 3), 128, dtype=np.uint8)).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def precalentar():
+    """Pasa una imagen sintética por ambos pipelines: importa cv2, skimage y
+    face_recognition, carga los modelos de dlib y ejecuta una vez cada
+    etapa. La imagen no tiene rostro, así que face_encodings se llama con
+    una caja fija. Sus tiempos no se registran en las métricas."""
+    with recolectar():
+        pre = ImagenPreprocesada(imagen_sintetica())
+        embedding_tradicional(pre)
+        alto, ancho = pre.rgb.shape[:2]
+        face_recognition.face_encodings(pre.rgb, known_face_locations=[(0, ancho, alto, 0)])
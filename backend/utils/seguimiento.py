@@ -0,0 +1,127 @@
+import struct
+import numpy as np
+
+
+# ---- Intersección sobre unión de dos cajas (top, right, bottom, left) ----
+def iou(a, b):
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    interseccion = max(0, bottom - top) * max(0, right - left)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    union = area_a + area_b - interseccion
+    return interseccion / union if union > 0 else 0.0
+
+
+# --------- Track: un mismo rostro a lo largo de varios frames ----------
+class Track:
+    def __init__(self, track_id, caja, frame):
+        self.id = track_id
+        self.caja = caja
+        self.primer_frame = frame
+        self.ultimo_frame = frame
+        self.frame_embedding = None
+        # Suma de embeddings normalizados: su producto con la galería dividido
+        # por n_embeddings es el promedio de las similitudes de cada frame
+        self.suma_trad = None
+        self.suma_fr = None
+        self.n_embeddings = 0
+        self.ultimo_fr = None
+        self.decision = None
+
+    def agregar_embeddings(self, emb, emb_fr, frame):
+        emb = np.asarray(emb, dtype=np.float64)
+        emb_fr = np.asarray(emb_fr, dtype=np.float64)
+        self.ultimo_fr = emb_fr
+        emb = emb / (np.linalg.norm(emb) or 1.0)
+        emb_fr = emb_fr / (np.linalg.norm(emb_fr) or 1.0)
+        self.suma_trad = emb if self.suma_trad is None else self.suma_trad + emb
+        self.suma_fr = emb_fr if self.suma_fr is None else self.suma_fr + emb_fr
+        self.n_embeddings += 1
+        self.frame_embedding = frame
+
+    def embeddings_promedio(self):
+        return self.suma_trad / self.n_embeddings, self.suma_fr / self.n_embeddings
+
+
+# --------- Seguimiento por IoU entre frames consecutivos ----------
+class Seguidor:
+    """Asocia las detecciones de cada frame a tracks existentes por IoU
+    (asignación voraz) y decide cuándo un track necesita un embedding nuevo:
+    al aparecer y luego cada `cada_n` frames."""
+
+    def __init__(self, iou_minimo=0.3, cada_n=5, max_perdidos=10, distancia_maxima=0.6):
+        self.iou_minimo = iou_minimo
+        self.cada_n = cada_n
+        self.max_perdidos = max_perdidos
+        self.distancia_maxima = distancia_maxima
+        self.tracks = {}
+        self.terminados = []
+        self._siguiente_id = 1
+
+    def actualizar(self, cajas, frame):
+        """Devuelve [(track, necesita_embedding), ...] en el orden de `cajas`."""
+        pares = sorted(
+            ((iou(t.caja, c), t.id, i) for t in self.tracks.values() for i, c in enumerate(cajas)),
+            reverse=True
+        )
+        asignados = {}
+        usados = set()
+        for valor, track_id, i in pares:
+            if valor < self.iou_minimo:
+                break
+            if i in asignados or track_id in usados:
+                continue
+            asignados[i] = self.tracks[track_id]
+            usados.add(track_id)
+
+        resultado = []
+        for i, caja in enumerate(cajas):
+            track = asignados.get(i)
+            if track is None:
+                track = Track(self._siguiente_id, caja, frame)
+                self.tracks[track.id] = track
+                self._siguiente_id += 1
+            track.caja = caja
+            track.ultimo_frame = frame
+            necesita = track.frame_embedding is None or frame - track.frame_embedding >= self.cada_n
+            resultado.append((track, necesita))
+
+        # Cerrar tracks que llevan demasiados frames sin verse
+        for track_id in [t.id for t in self.tracks.values() if frame - t.ultimo_frame > self.max_perdidos]:
+            self.terminados.append(self.tracks.pop(track_id))
+        return resultado
+
+    def confirmar_identidad(self, track, emb_fr, frame):
+        """Si el nuevo embedding face_recognition no corresponde a la misma
+        persona (distancia euclidiana > distancia_maxima), el track se cierra
+        y se abre uno nuevo en la misma caja. Devuelve el track vigente."""
+        if track.ultimo_fr is None or np.linalg.norm(np.asarray(emb_fr) - track.ultimo_fr) <= self.distancia_maxima:
+            return track
+        self.terminados.append(self.tracks.pop(track.id))
+        nuevo = Track(self._siguiente_id, track.caja, frame)
+        self.tracks[nuevo.id] = nuevo
+        self._siguiente_id += 1
+        return nuevo
+
+    def todos(self):
+        return self.terminados + list(self.tracks.values())
+
+
+# ---- Lectura de frames de un cuerpo con prefijo de longitud ----
+def leer_frames(stream, max_bytes):
+    """Genera los frames de un stream con formato [uint32 big-endian longitud][bytes JPEG]..."""
+    while True:
+        cabecera = stream.read(4)
+        if len(cabecera) < 4:
+            return
+        longitud = struct.unpack('>I', cabecera)[0]
+        if longitud > max_bytes:
+            raise ValueError(f"Frame de {longitud} bytes excede el máximo de {max_bytes}")
+        datos = b''
+        while len(datos) < longitud:
+            parte = stream.read(longitud - len(datos))
+            if not parte:
+                raise ValueError("Stream truncado en medio de un frame")
+            datos += parte
+        yield datos
@@ -0,0 +1,57 @@
+from config import reconocimiento_config
+from utils.indice_embeddings import agrupar_por_usuario
+
+
+# Selección del mejor usuario a partir de las similitudes contra la galería
+def seleccionar_mejor_usuario(usuarios, sim_trad, sim_fr, validos, umbrales=None):
+    """Aplica los umbrales y la lógica de fallback (doble, solo tradicional,
+    solo face_recognition). Devuelve (usuario_id, fila, metodo, similitudes)
+    o None. `umbrales` reemplaza a reconocimiento_config (mismas claves);
+    evaluar_umbrales.py lo usa para medir otras combinaciones."""
+    umbrales = umbrales or reconocimiento_config
+    # Umbrales principales
+    umbral_similitud_tradicional = umbrales['umbral_tradicional']   # similitud coseno tradicional
+    umbral_similitud_fr = umbrales['umbral_fr']                     # similitud coseno face_recognition
+    cantidad_minima = umbrales['cantidad_minima']  # mínimo de coincidencias dobles para aceptar
+
+    # Umbrales estrictos para fallback
+    umbral_strict_tradicional = umbrales['umbral_estricto_tradicional']
+    umbral_strict_fr = umbrales['umbral_estricto_fr']
+
+    # --- Lógica Fallback (máscaras sobre toda la galería) ---
+    # Caso 1: Doble coincidencia
+    mascara_doble = validos & (sim_trad >= umbral_similitud_tradicional) & (sim_fr >= umbral_similitud_fr)
+    # Caso 2: Solo tradicional (umbral estricto)
+    mascara_trad = validos & ~mascara_doble & (sim_trad >= umbral_strict_tradicional)
+    # Caso 3: Solo face_recognition (umbral estricto)
+    mascara_fr = validos & ~mascara_doble & ~mascara_trad & (sim_fr >= umbral_strict_fr)
+
+    # --- Selección del mejor usuario según prioridad ---
+    mejor = None
+    max_coincidencias = 0
+
+    # 1. Buscar coincidencia doble
+    for uid, cantidad, fila, (promedio_trad, promedio_fr) in agrupar_por_usuario(usuarios, mascara_doble, sim_trad, sim_fr):
+        if cantidad >= cantidad_minima and cantidad > max_coincidencias:
+            max_coincidencias = cantidad
+            mejor = (uid, fila, "doble", {
+                "similitud_tradicional_promedio": round(promedio_trad, 4),
+                "similitud_face_recognition_promedio": round(promedio_fr, 4)
+            })
+    # 2. Fallback tradicional
+    if not mejor:
+        for uid, cantidad, fila, (promedio_trad,) in agrupar_por_usuario(usuarios, mascara_trad, sim_trad):
+            if cantidad > max_coincidencias:
+                max_coincidencias = cantidad
+                mejor = (uid, fila, "solo_tradicional", {
+                    "similitud_tradicional_promedio": round(promedio_trad, 4)
+                })
+    # 3. Fallback face_recognition
+    if not mejor:
+        for uid, cantidad, fila, (promedio_fr,) in agrupar_por_usuario(usuarios, mascara_fr, sim_fr):
+            if cantidad > max_coincidencias:
+                max_coincidencias = cantidad
+                mejor = (uid, fila, "solo_face_recognition", {
+                    "similitud_face_recognition_promedio": round(promedio_fr, 4)
+                })
+    return mejor
@@ -0,0 +1,97 @@
+import io
+import os
+import time
+import uuid
+import queue
+import threading
+from contextlib import contextmanager
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+
+from config import subidas_config
+
+
+# --------- Archivos subidos siempre en memoria ----------
+class RequestEnMemoria(Request):
+    """Werkzeug guarda en un archivo temporal las subidas de más de 500 KB;
+    aquí todas quedan en un BytesIO, acotadas por subidas_config['max_bytes'].
+    Sin Content-Length (subida chunked) el límite se aplica contando los
+    bytes de todos los archivos del formulario a medida que llegan."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length and total_content_length > subidas_config['max_bytes']:
+            raise RequestEntityTooLarge()
+        return _BytesIOAcotado(self)
+
+    def _contar_bytes(self, cantidad):
+        self._bytes_recibidos = getattr(self, '_bytes_recibidos', 0) + cantidad
+        if self._bytes_recibidos > subidas_config['max_bytes']:
+            raise RequestEntityTooLarge()
+
+
+class _BytesIOAcotado(io.BytesIO):
+    def __init__(self, request):
+        super().__init__()
+        self._request = request
+
+    def write(self, datos):
+        self._request._contar_bytes(len(datos))
+        return super().write(datos)
+
+
+@contextmanager
+def bytes_subida(archivo):
+    """memoryview sobre el contenido de un archivo subido, sin copiarlo.
+    La vista se libera al salir: el BytesIO no puede cerrarse mientras
+    haya una vista exportada."""
+    stream = archivo.stream
+    if isinstance(stream, io.BytesIO):
+        vista = stream.getbuffer()
+    else:
+        vista = memoryview(archivo.read())
+    try:
+        yield vista
+    finally:
+        vista.release()
+
+
+# --------- Copia de auditoría en segundo plano ----------
+class EscritorAuditoria:
+    """Escribe copias de las imágenes consultadas en `carpeta` desde un hilo
+    aparte, con nombre único (fecha + uuid). Si la cola está llena la copia
+    se descarta para no frenar las peticiones."""
+
+    def __init__(self, carpeta, max_en_cola=64):
+        self.carpeta = carpeta
+        self._cola = queue.Queue(maxsize=max_en_cola)
+        self._hilo = None
+        self._lock = threading.Lock()
+        self.descartadas = 0
+
+    def guardar(self, datos, nombre_original, prefijo=''):
+        nombre = f"{prefijo}{time.strftime('%Y%m%d-%H%M%S')}_{uuid.uuid4().hex[:8]}_{secure_filename(nombre_original or 'imagen')}"
+        try:
+            # bytes(): la vista del request deja de ser válida al terminar la petición
+            self._cola.put_nowait((os.path.join(self.carpeta, nombre), bytes(datos)))
+        except queue.Full:
+            self.descartadas += 1
+            return
+        self._asegurar_hilo()
+
+    def _asegurar_hilo(self):
+        with self._lock:
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._bucle, daemon=True, name="auditoria")
+                self._hilo.start()
+
+    def _bucle(self):
+        os.makedirs(self.carpeta, exist_ok=True)
+        while True:
+            ruta, datos = self._cola.get()
+            try:
+                with open(ruta, 'wb') as f:
+                    f.write(datos)
+            except Exception as e:
+                print("Error guardando copia de auditoría:", e)